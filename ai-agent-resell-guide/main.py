@@ -4,12 +4,13 @@ from langchain.chains import ConversationalRetrievalChain
 from langchain_core.memory import ConversationBufferMemory
 
 class QAModel:
-    def __init__(self, llm, vectorstore):
+    def __init__(self, llm, vectorstore, condense_question_llm=None):
         self.llm = llm
         self.vectorstore = vectorstore
         self.qa_chain = ConversationalRetrievalChain.from_llm(
             llm=self.llm,
             retriever=self.vectorstore.as_retriever(),
+            condense_question_llm=condense_question_llm,
             memory=memory,
             return_source_documents=True,
             output_key="answer"
@@ -0,0 +1,146 @@
+"""
+Semantic answer cache for Zendesk ISV Resell Assistant
+Answers repeated or near-identical standalone questions without retrieval or
+generation by matching question embeddings above a cosine-similarity threshold
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from mmap_store import HEADER_FILENAME, mmap_directory
+from retrievers import documents_by_id
+from index_snapshots import CURRENT_FILENAME
+
+class CachedAnswer:
+    """An answer with the IDs of the chunks it was generated from"""
+    def __init__(self, question, vector, answer, source_ids):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.source_ids = source_ids
+        self.created_at = time.time()
+
+class SemanticAnswerCache:
+    """TTL + LRU bounded answer cache keyed on question embeddings
+
+    The cache empties itself whenever any of `watch_paths` (typically the index
+    manifest and the Chroma database) changes, so answers never outlive the
+    documents they were built from.
+    """
+
+    def __init__(self, embeddings, fetch_documents, similarity_threshold=0.95,
+                 ttl_seconds=3600, max_entries=256, watch_paths=()):
+        self.embeddings = embeddings
+        self.fetch_documents = fetch_documents
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.watch_paths = list(watch_paths)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._fingerprint = self._index_fingerprint()
+
+    def _index_fingerprint(self):
+        fingerprint = []
+        for path in self.watch_paths:
+            try:
+                stat = os.stat(path)
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        """Drop stale entries; caller holds the lock"""
+        fingerprint = self._index_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._entries.clear()
+            self._fingerprint = fingerprint
+        cutoff = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry.created_at < cutoff]:
+            del self._entries[key]
+
+    def lookup(self, question):
+        """Return (answer, source_documents) for a similar cached question, or None"""
+        vector = self._embed(question)
+        with self._lock:
+            self._expire()
+            best_key, best_score = None, -1.0
+            if self._entries:
+                keys = list(self._entries)
+                matrix = np.stack([self._entries[key].vector for key in keys])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                best_key, best_score = keys[best], float(scores[best])
+            if best_key is None or best_score < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            self.hits += 1
+        return entry.answer, self.fetch_documents(entry.source_ids)
+
+    def store(self, question, answer, source_documents):
+        """Cache an answer; answers whose sources have no chunk IDs are skipped"""
+        source_ids = [
+            chunk_id
+            for doc in source_documents
+            for chunk_id in doc.metadata.get("merged_chunk_ids", [doc.metadata.get("chunk_id")])
+        ]
+        if not all(source_ids):
+            return
+        entry = CachedAnswer(question, self._embed(question), answer, source_ids)
+        with self._lock:
+            self._expire()
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return hit/miss counters for display"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+def answer_cache_from_env(embeddings, vectorstore, persist_directory="rag_index"):
+    """Build an answer cache for a Chroma or mmap index, configured from ANSWER_CACHE_* variables
+
+    `vectorstore` may be a function returning the store of the published
+    snapshot; publishing a new snapshot replaces CURRENT and empties the cache.
+    """
+    current_store = vectorstore if callable(vectorstore) else lambda: vectorstore
+    return SemanticAnswerCache(
+        embeddings,
+        fetch_documents=lambda ids: documents_by_id(current_store(), ids),
+        similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+        ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", 3600)),
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 256)),
+        watch_paths=[
+            os.path.join(persist_directory, CURRENT_FILENAME),
+            os.path.join(persist_directory, "index_manifest.json"),
+            os.path.join(persist_directory, "chroma.sqlite3"),
+            os.path.join(mmap_directory(persist_directory), HEADER_FILENAME),
+        ],
+    )
@@ -0,0 +1,208 @@
+"""
+Conversational retrieval chain for Zendesk ISV Resell Assistant
+A ConversationalRetrievalChain that only condenses follow-up questions that
+need it, consults a semantic answer cache with the standalone question before
+retrieving and generating, packs retrieved chunks into a token budget and
+reports how long each stage took. Importing it loads LangChain's legacy
+chains, so the apps import it when they build their first chain
+"""
+
+import time
+import logging
+from typing import Any, Dict, List, Optional
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.documents import Document
+from langchain_core.runnables.config import run_in_executor
+from tracing import CONTEXT_DOCUMENTS_EVENT, RETRIEVAL_FILTERS_KEY, STAGE_TIMINGS_EVENT
+
+logger = logging.getLogger(__name__)
+
+class AssistantRetrievalChain(ConversationalRetrievalChain):
+    """ConversationalRetrievalChain with an optional question router, answer cache and context packer"""
+
+    question_router: Optional[Any] = None
+    """Callable (question, chat_history) -> bool; False skips condensing the question"""
+    answer_cache: Optional[Any] = None
+    """SemanticAnswerCache consulted with the standalone question"""
+    context_packer: Optional[Any] = None
+    """Callable that dedupes, merges and trims retrieved documents to a token budget"""
+
+    def _answer_cache_for(self, run_manager):
+        """The answer cache, unless this run has explicit retrieval filters (cached answers aren't scoped)"""
+        if (run_manager.metadata or {}).get(RETRIEVAL_FILTERS_KEY):
+            return None
+        return self.answer_cache
+
+    def _get_docs(
+        self,
+        question: str,
+        inputs: Dict[str, Any],
+        *,
+        run_manager: CallbackManagerForChainRun,
+    ) -> List[Document]:
+        docs = self.retriever.invoke(
+            question, config={"callbacks": run_manager.get_child()}
+        )
+        if self.context_packer is not None:
+            docs = self.context_packer(docs)
+        docs = self._reduce_tokens_below_limit(docs)
+        run_manager.get_child().on_custom_event(CONTEXT_DOCUMENTS_EVENT, docs)
+        return docs
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        answer_cache = self._answer_cache_for(_run_manager)
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+        stages = {}
+        cache_hits = {}
+
+        started = time.perf_counter()
+        if chat_history_str and (
+            self.question_router is None or self.question_router(question, chat_history_str)
+        ):
+            new_question = self.question_generator.run(
+                question=question, chat_history=chat_history_str, callbacks=_run_manager.get_child()
+            )
+            stages["condense"] = time.perf_counter() - started
+        else:
+            new_question = question
+            stages["condense"] = None
+
+        if answer_cache is not None:
+            started = time.perf_counter()
+            cached = answer_cache.lookup(new_question)
+            stages["answer_cache"] = time.perf_counter() - started
+            cache_hits["answer_cache"] = cached is not None
+            if cached is not None:
+                answer, docs = cached
+                self._report_stages(stages, cache_hits, _run_manager)
+                return self._build_output(answer, docs, new_question)
+
+        started = time.perf_counter()
+        docs = self._get_docs(new_question, inputs, run_manager=_run_manager)
+        stages["retrieve"] = time.perf_counter() - started
+        if self.response_if_no_docs_found is not None and len(docs) == 0:
+            self._report_stages(stages, cache_hits, _run_manager)
+            return self._build_output(self.response_if_no_docs_found, docs, new_question)
+
+        new_inputs = inputs.copy()
+        if self.rephrase_question:
+            new_inputs["question"] = new_question
+        new_inputs["chat_history"] = chat_history_str
+        started = time.perf_counter()
+        answer = self.combine_docs_chain.run(
+            input_documents=docs, callbacks=_run_manager.get_child(), **new_inputs
+        )
+        stages["generate"] = time.perf_counter() - started
+        if answer_cache is not None:
+            answer_cache.store(new_question, answer, docs)
+        self._report_stages(stages, cache_hits, _run_manager)
+        return self._build_output(answer, docs, new_question)
+
+    async def _aget_docs(
+        self,
+        question: str,
+        inputs: Dict[str, Any],
+        *,
+        run_manager: AsyncCallbackManagerForChainRun,
+    ) -> List[Document]:
+        docs = await self.retriever.ainvoke(
+            question, config={"callbacks": run_manager.get_child()}
+        )
+        if self.context_packer is not None:
+            docs = self.context_packer(docs)
+        docs = self._reduce_tokens_below_limit(docs)
+        await run_manager.get_child().on_custom_event(CONTEXT_DOCUMENTS_EVENT, docs)
+        return docs
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        answer_cache = self._answer_cache_for(_run_manager)
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+        stages = {}
+        cache_hits = {}
+
+        started = time.perf_counter()
+        if chat_history_str and (
+            self.question_router is None or self.question_router(question, chat_history_str)
+        ):
+            new_question = await self.question_generator.arun(
+                question=question, chat_history=chat_history_str, callbacks=_run_manager.get_child()
+            )
+            stages["condense"] = time.perf_counter() - started
+        else:
+            new_question = question
+            stages["condense"] = None
+
+        # The answer cache embeds the question, so keep it off the event loop
+        if answer_cache is not None:
+            started = time.perf_counter()
+            cached = await run_in_executor(None, answer_cache.lookup, new_question)
+            stages["answer_cache"] = time.perf_counter() - started
+            cache_hits["answer_cache"] = cached is not None
+            if cached is not None:
+                answer, docs = cached
+                await self._areport_stages(stages, cache_hits, _run_manager)
+                return self._build_output(answer, docs, new_question)
+
+        started = time.perf_counter()
+        docs = await self._aget_docs(new_question, inputs, run_manager=_run_manager)
+        stages["retrieve"] = time.perf_counter() - started
+        if self.response_if_no_docs_found is not None and len(docs) == 0:
+            await self._areport_stages(stages, cache_hits, _run_manager)
+            return self._build_output(self.response_if_no_docs_found, docs, new_question)
+
+        new_inputs = inputs.copy()
+        if self.rephrase_question:
+            new_inputs["question"] = new_question
+        new_inputs["chat_history"] = chat_history_str
+        started = time.perf_counter()
+        answer = await self.combine_docs_chain.arun(
+            input_documents=docs, callbacks=_run_manager.get_child(), **new_inputs
+        )
+        stages["generate"] = time.perf_counter() - started
+        if answer_cache is not None:
+            await run_in_executor(None, answer_cache.store, new_question, answer, docs)
+        await self._areport_stages(stages, cache_hits, _run_manager)
+        return self._build_output(answer, docs, new_question)
+
+    def _log_stages(self, stages):
+        logger.info("Stage latency: %s", ", ".join(
+            f"{stage}=skipped" if seconds is None else f"{stage}={seconds:.3f}s"
+            for stage, seconds in stages.items()
+        ))
+
+    def _report_stages(self, stages, cache_hits, run_manager):
+        """Log stage latency and pass it to tracing callbacks"""
+        self._log_stages(stages)
+        run_manager.get_child().on_custom_event(
+            STAGE_TIMINGS_EVENT, {"stages": stages, "cache_hits": cache_hits}
+        )
+
+    async def _areport_stages(self, stages, cache_hits, run_manager):
+        self._log_stages(stages)
+        await run_manager.get_child().on_custom_event(
+            STAGE_TIMINGS_EVENT, {"stages": stages, "cache_hits": cache_hits}
+        )
+
+    def _build_output(self, answer, docs, new_question):
+        output: Dict[str, Any] = {self.output_key: answer}
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
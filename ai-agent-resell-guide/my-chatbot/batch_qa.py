@@ -0,0 +1,245 @@
+"""
+Batch question answering for Zendesk ISV Resell Assistant
+Answers a file of questions (JSONL or CSV) with bounded concurrency, for FAQ
+sheets or for checking answers after a document update. All questions are
+embedded up front in batched requests, repeated questions are answered once,
+and every result is appended to a JSONL file as soon as it is ready, so an
+interrupted run picks up where it stopped
+"""
+
+import os
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from conversation_memory import no_memory
+from embedding_cache import normalize_text
+from metadata_index import FILTER_COLUMNS, check_filters
+from streaming import serialize_sources
+from tracing import ainvoke_traced, format_stats
+
+# Load environment variables
+load_dotenv()
+
+FILTER_KEYS = FILTER_COLUMNS + ("modified_after",)
+
+def _item(number, question, item_id=None, filters=None):
+    """A question to answer; without an ID one is derived from the question and filters"""
+    question = str(question or "").strip()
+    if not question:
+        raise ValueError(f"Row {number}: missing question")
+    if filters is not None:
+        try:
+            check_filters(filters)
+        except ValueError as e:
+            raise ValueError(f"Row {number}: {e}")
+    if not item_id:
+        payload = json.dumps([question, filters or {}], sort_keys=True).encode("utf-8")
+        item_id = "q-" + hashlib.sha1(payload).hexdigest()[:12]
+    return {"id": str(item_id), "row": number, "question": question, "filters": filters or None}
+
+def load_questions(path):
+    """Questions from a JSONL or CSV file
+
+    JSONL lines are objects with "question" and optional "id" and "filters"
+    (as for POST /chat); CSV files have a "question" column, an optional "id"
+    column and optional filter columns (partner, doc_type, ...).
+    """
+    items = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for number, row in enumerate(csv.DictReader(f), 1):
+                filters = {key: row[key] for key in FILTER_KEYS if (row.get(key) or "").strip()}
+                if "modified_after" in filters:
+                    filters["modified_after"] = float(filters["modified_after"])
+                items.append(_item(number, row.get("question"), row.get("id"), filters))
+        else:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    item = json.loads(line)
+                    items.append(_item(number, item.get("question"), item.get("id"), item.get("filters")))
+    return items
+
+def load_finished(path):
+    """IDs already answered in an output file
+
+    Failed results and a line cut short by an interruption are dropped from
+    the file, so they are retried and appending starts on a fresh line.
+    """
+    if not os.path.exists(path):
+        return set()
+    finished = {}
+    rewrite = False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                rewrite = True
+                continue
+            if result.get("status") == "ok" and line.endswith("\n"):
+                finished[result["id"]] = line
+            else:
+                rewrite = True
+    if rewrite:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(finished.values())
+        os.replace(tmp_path, path)
+    return set(finished)
+
+def group_duplicates(items):
+    """Items grouped by question (ignoring case and whitespace) and filters, in input order
+
+    Each group is answered once. Retrieval only depends on the question and
+    filters, so this also keeps repeated questions from retrieving twice.
+    """
+    groups = {}
+    for item in items:
+        key = (normalize_text(item["question"]).casefold(), json.dumps(item["filters"], sort_keys=True))
+        groups.setdefault(key, []).append(item)
+    return list(groups.values())
+
+class BatchRun:
+    """Answers groups of questions on one shared, memoryless chain and appends the results"""
+
+    def __init__(self, assistant, output, concurrency=4, timeout=120.0):
+        self.assistant = assistant
+        self.output = output
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+        self.times = []
+
+    async def prefetch_embeddings(self, questions):
+        """Embed every question up front through the cached query path retrieval uses
+
+        The questions are embedded concurrently, so the query batcher sends
+        them together (up to its batch size per request), and the cache then
+        answers each question's own lookup.
+        """
+        started = time.perf_counter()
+        embeddings = self.assistant.cached_embeddings
+        await asyncio.gather(*(embeddings.aembed_query(question) for question in questions))
+        return time.perf_counter() - started
+
+    def write(self, f, group, result):
+        leader = group[0]
+        for item in group:
+            row = dict(result, id=item["id"], row=item["row"], question=item["question"])
+            if item["filters"]:
+                row["filters"] = item["filters"]
+            if item is not leader:
+                row["duplicate_of"] = leader["id"]
+            f.write(json.dumps(row) + "\n")
+        f.flush()
+
+    async def answer(self, chain, group, slots, f):
+        leader = group[0]
+        async with slots:
+            started = time.perf_counter()
+            try:
+                result, trace = await asyncio.wait_for(
+                    ainvoke_traced(chain, leader["question"], self.assistant.trace_recorder, leader["filters"]),
+                    self.timeout,
+                )
+                row = {
+                    "status": "ok",
+                    "answer": result["answer"],
+                    "sources": serialize_sources(result.get("source_documents", [])),
+                    "timings": trace["stages"],
+                    "cache_hits": trace["cache_hits"],
+                    "index_version": self.assistant.live_index.version,
+                }
+                self.done += len(group)
+                self.times.append(trace["stages"]["total_time"])
+                mark = "✅"
+            except Exception as e:
+                error = "Timed out" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+                row = {"status": "error", "error": error, "timings": {"total_time": time.perf_counter() - started}}
+                self.failed += len(group)
+                mark = "❌"
+            self.write(f, group, row)
+        seconds = row["timings"]["total_time"]
+        extra = f" (+{len(group) - 1} duplicate(s))" if len(group) > 1 else ""
+        print(f"{mark} [{self.done + self.failed}/{self.total}] {leader['id']}{extra} in {seconds:.2f}s")
+
+    async def run(self, groups):
+        self.total = sum(len(group) for group in groups)
+        chain = self.assistant.new_chain(memory=no_memory())
+        slots = asyncio.Semaphore(self.concurrency)
+        with open(self.output, "a", encoding="utf-8") as f:
+            await asyncio.gather(*(self.answer(chain, group, slots, f) for group in groups))
+
+def main():
+    """Answer every question in a file and write the results as JSONL"""
+    from main import ZendeskISVAssistant
+
+    parser = argparse.ArgumentParser(description="Answer a file of questions with the Zendesk ISV Resell Assistant")
+    parser.add_argument("questions", help="JSONL or CSV file of questions")
+    parser.add_argument("--output", help="JSONL results file (default: <questions>.answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions answered at once")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed per question")
+    parser.add_argument("--fresh", action="store_true", help="Discard earlier results instead of resuming")
+    args = parser.parse_args()
+    output = args.output or os.path.splitext(args.questions)[0] + ".answers.jsonl"
+
+    print("📋 Zendesk ISV Resell Assistant - Batch Answers")
+    print("=" * 50)
+    try:
+        items = load_questions(args.questions)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read questions: {e}")
+        return
+    if args.fresh and os.path.exists(output):
+        os.remove(output)
+    finished = load_finished(output)
+    pending = [item for item in items if item["id"] not in finished]
+    groups = group_duplicates(pending)
+    print(f"📄 {len(items)} question(s) in {args.questions}; {len(items) - len(pending)} already answered in {output}")
+    if not pending:
+        print("🎉 Nothing left to answer")
+        return
+    if len(groups) < len(pending):
+        print(f"🔁 {len(pending) - len(groups)} repeated question(s) will share an answer")
+
+    assistant = ZendeskISVAssistant()
+    if not assistant.open_index():
+        return
+    batch = BatchRun(assistant, output, args.concurrency, args.timeout)
+
+    async def run():
+        try:
+            seconds = await batch.prefetch_embeddings([group[0]["question"] for group in groups])
+            print(f"🧮 Embedded {len(groups)} question(s) up front in {seconds:.2f}s")
+        except Exception as e:
+            print(f"⚠️  Batch embedding failed ({e}); questions will be embedded one at a time")
+        await batch.run(groups)
+
+    started = time.perf_counter()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print(f"\n⏸️  Interrupted after {batch.done + batch.failed} of {batch.total}; run again to resume")
+        return
+    elapsed = time.perf_counter() - started
+
+    print("\n📊 Summary:")
+    print(f"   Answered: {batch.done}, failed: {batch.failed}, in {elapsed:.1f}s")
+    if batch.times:
+        p50, p95 = np.percentile(batch.times, [50, 95])
+        print(f"   Per question: p50 {p50:.2f}s, p95 {p95:.2f}s")
+    print(f"💾 Results in {output}")
+    if batch.failed:
+        print("   Run again to retry the failed questions")
+    print("\n⏱️  Latency by stage:")
+    print(format_stats(assistant.trace_recorder.summary()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+Offline benchmark for Zendesk ISV Resell Assistant
+Builds synthetic corpora at multiples of the size of docs/TechResellChatbotRAG,
+indexes them with deterministic local embeddings and answers questions with a
+fake chat model, so it runs without network access or API keys. Results are
+written as JSON with a fixed schema so runs can be compared between commits.
+With --ann-rows, also measures IVF recall and QPS against exact search on a
+synthetic clustered vector set
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+SCHEMA_VERSION = 1
+DEFAULT_DOCS_PATH = "docs/TechResellChatbotRAG"
+DEFAULT_SCALES = (1, 10, 100)
+RETRIEVAL_KS = (1, 4, 10, 20)
+ANN_PROBES = (1, 4, 16, 64)
+ANN_K = 10
+SENTENCES_PER_PARAGRAPH = 5
+
+class FakeChatModel(FakeListChatModel):
+    """FakeListChatModel that waits `latency` seconds before every response
+
+    `sleep` still adds a delay per streamed chunk, as in the base class.
+    """
+
+    latency: float = 0.0
+
+    def _call(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        time.sleep(self.latency)
+        yield from super()._stream(*args, **kwargs)
+
+def fake_llm(latency):
+    return FakeChatModel(
+        responses=["Based on the ISV resell documentation, submit the request for deal desk approval."],
+        latency=latency,
+        # Word counts stand in for tokens so conversation memory needs no tokenizer
+        custom_get_token_ids=lambda text: text.split(),
+    )
+
+def load_seed(docs_path):
+    """Sentences, total characters and file count of the real document set"""
+    # Imported here so worker processes don't load document loaders twice
+    from index_documents import find_documents, load_documents
+    with contextlib.redirect_stdout(io.StringIO()):
+        files = find_documents(docs_path)
+        documents = load_documents(docs_path)
+    text = "\n".join(doc.page_content for doc in documents)
+    sentences = [
+        sentence.strip()
+        for sentence in re.split(r"(?<=[.!?])\s+|\n+", text)
+        if len(sentence.strip()) >= 20
+    ]
+    return sentences, len(text), len(files)
+
+def write_corpus(directory, sentences, target_chars, file_chars, seed=0):
+    """Write deterministic .txt files of shuffled seed sentences; returns the file count"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    files = 0
+    while written < target_chars:
+        limit = min(file_chars, target_chars - written)
+        paragraphs = []
+        size = 0
+        while size < limit:
+            paragraph = " ".join(rng.choice(sentences) for _ in range(SENTENCES_PER_PARAGRAPH))
+            # Synthetic SKUs give keyword search exact terms to find
+            paragraph += f" Reference SKU-{rng.randrange(10000):04d}."
+            paragraphs.append(paragraph)
+            size += len(paragraph) + 2
+        with open(os.path.join(directory, f"synthetic_{files:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+        written += size
+        files += 1
+    return files
+
+def make_questions(sentences, count, seed=1):
+    """Distinct questions built from the opening words of seed sentences"""
+    rng = random.Random(seed)
+    picked = rng.sample(sentences, min(count, len(sentences)))
+    return [" ".join(sentence.split()[:12]).rstrip(".!?") + "?" for sentence in picked]
+
+def latency_stats(seconds):
+    """Milliseconds: mean, p50, p95 and p99 of a list of durations"""
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {
+        "mean_ms": round(float(np.mean(seconds)) * 1000, 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+def run_scale(scale, sentences, seed_chars, seed_files, options):
+    """Benchmark one corpus size; runs in its own process so peak RSS is per scale"""
+    from index_documents import update_index, update_keyword_index, update_metadata_index, update_ann_index
+    from retrievers import HybridRetriever
+    from main import ZendeskISVAssistant
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_path = os.path.join(workdir, "docs")
+        index_path = os.path.join(workdir, "rag_index")
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+        file_chars = max(seed_chars // max(seed_files, 1), 1000)
+        files = write_corpus(corpus_path, sentences, seed_chars * scale, file_chars)
+        embeddings = DeterministicFakeEmbedding(size=options["dim"])
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            vectorstore, summary = update_index(
+                corpus_path, index_path, options["chunk_size"], options["chunk_overlap"],
+                embeddings=embeddings, backend=options["backend"]
+            )
+            bm25 = update_keyword_index(vectorstore, index_path, summary)
+            update_metadata_index(vectorstore, index_path, summary)
+            update_ann_index(vectorstore, index_path, summary)
+        index_seconds = time.perf_counter() - start
+        chunks = summary["chunks_added"]
+
+        questions = make_questions(sentences, options["questions"])
+        retrieval = {}
+        for k in RETRIEVAL_KS:
+            hybrid = HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=k, fetch_k=max(20, k))
+            retrieval[f"k={k}"] = {
+                "vector": latency_stats([timed(vectorstore.similarity_search, q, k=k) for q in questions]),
+                "hybrid": latency_stats([timed(hybrid.invoke, q) for q in questions]),
+            }
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            assistant = ZendeskISVAssistant(
+                llm=fake_llm(options["llm_latency"]), embeddings=embeddings, persist_directory=index_path
+            )
+            # Open now so the first timed question doesn't include it
+            assistant.open_index()
+        response_seconds = []
+        for question in questions:
+            # Every question is a first turn, so runs don't depend on memory state
+            assistant.qa_chain.memory.clear()
+            response_seconds.append(timed(assistant.get_response, question))
+        stage_summary = assistant.trace_recorder.summary()["stages"]
+
+        return {
+            "scale": scale,
+            "corpus": {"files": files, "characters": seed_chars * scale, "chunks": chunks},
+            "indexing": {
+                "seconds": round(index_seconds, 3),
+                "docs_per_second": round(files / index_seconds, 3),
+                "chunks_per_second": round(chunks / index_seconds, 3),
+            },
+            "retrieval": retrieval,
+            "get_response": dict(
+                latency_stats(response_seconds),
+                stages_p50_ms={stage: round(row["p50"] * 1000, 3) for stage, row in stage_summary.items()},
+            ),
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            "peak_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / (1024 * 1024 if sys.platform == "darwin" else 1024), 1
+            ),
+        }
+
+def clustered_vectors(rows, dim, rng, spread=0.6):
+    """Unit vectors scattered around rows / 100 random centres, like real embeddings"""
+    centres = rng.standard_normal((max(rows // 100, 1), dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    noise = rng.standard_normal((rows, dim)).astype(np.float32) * spread / np.sqrt(dim)
+    vectors = centres[rng.integers(len(centres), size=rows)] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def search_all(store, queries, k):
+    """Top-k row sets for every query, and queries per second"""
+    start = time.perf_counter()
+    found = [{row for row, _ in store.search_rows(query, k)} for query in queries]
+    return found, len(queries) / (time.perf_counter() - start)
+
+def run_ann(rows, options):
+    """IVF recall@k and QPS for several probe counts against exact search, plus update costs"""
+    from mmap_store import MmapVectorStore
+    from ivf_index import update_ivf
+
+    rng = np.random.default_rng(0)
+    dim = options["dim"]
+    with tempfile.TemporaryDirectory() as workdir:
+        store = MmapVectorStore(workdir, quantize=True, probes=1)
+        vectors = clustered_vectors(rows, dim, rng)
+        for start in range(0, rows, 8192):
+            block = vectors[start:start + 8192]
+            store.add_vectors(
+                [f"row-{start + i}" for i in range(len(block))], block,
+                [""] * len(block), [{} for _ in block]
+            )
+        build_seconds = timed(update_ivf, store)
+        # Queries are perturbed copies of stored rows, as questions are near their answers
+        picked = rng.choice(rows, options["questions"], replace=False)
+        queries = vectors[picked] + 0.2 * rng.standard_normal((len(picked), dim)).astype(np.float32) / np.sqrt(dim)
+        store = MmapVectorStore(workdir, probes=1)
+        lists = store.stats()["ivf_lists"]
+
+        store.probes = 0
+        exact, exact_qps = search_all(store, queries, ANN_K)
+        results = {
+            "rows": rows,
+            "lists": lists,
+            "build_seconds": round(build_seconds, 3),
+            "exact_qps": round(exact_qps, 1),
+            "probes": {},
+        }
+        for probes in ANN_PROBES:
+            store.probes = probes
+            found, qps = search_all(store, queries, ANN_K)
+            recall = np.mean([len(a & b) / len(a) for a, b in zip(exact, found)])
+            results["probes"][str(probes)] = {
+                f"recall_at_{ANN_K}": round(float(recall), 4),
+                "qps": round(qps, 1),
+            }
+
+        # Incremental maintenance: 1% more rows, then deleting them again
+        added = clustered_vectors(max(rows // 100, 1), dim, rng)
+        ids = [f"new-{i}" for i in range(len(added))]
+        store.add_vectors(ids, added, [""] * len(added), [{} for _ in added])
+        results["insert_1pct_seconds"] = round(timed(update_ivf, store), 3)
+        store.delete(ids)
+        results["delete_1pct_seconds"] = round(timed(update_ivf, store), 3)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def context_packing_available():
+    """Whether tiktoken's encoding can be loaded without downloading it"""
+    try:
+        import tiktoken
+        tiktoken.get_encoding("cl100k_base")
+        return True
+    except Exception:
+        return False
+
+def flatten(results, prefix=""):
+    """Numeric leaves of a results dict keyed by dotted path"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(baseline, current):
+    """Print the relative change of every metric present in both result files"""
+    print(f"\n📈 Compared with {baseline['git_commit'] or 'baseline'}:")
+    baseline_runs = {run["scale"]: run for run in baseline["runs"]}
+    for run in current["runs"]:
+        old = baseline_runs.get(run["scale"])
+        if old is None:
+            continue
+        old_flat, new_flat = flatten(old), flatten(run)
+        for key in sorted(set(old_flat) & set(new_flat)):
+            if key == "scale" or not old_flat[key]:
+                continue
+            change = (new_flat[key] - old_flat[key]) / old_flat[key]
+            print(f"  {run['scale']:>4}x {key:<45} {old_flat[key]:>12} → {new_flat[key]:>12} ({change:+.1%})")
+
+def main():
+    """Run the benchmark and write the results as JSON"""
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark with fake models")
+    parser.add_argument("--docs", default=DEFAULT_DOCS_PATH, help="Seed document folder")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="Comma-separated corpus sizes as multiples of the seed documents")
+    parser.add_argument("--questions", type=int, default=50, help="Questions per measurement")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Fake chat model latency per call")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--backend", choices=["chroma", "mmap"], default="chroma", help="Vector store backend")
+    parser.add_argument("--ann-rows", type=int, default=0,
+                        help="Also benchmark the IVF index on this many synthetic vectors")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    print("🏁 Zendesk ISV Resell Assistant - Offline Benchmark")
+    print("=" * 50)
+    sentences, seed_chars, seed_files = load_seed(args.docs)
+    if not sentences:
+        print(f"❌ No text could be loaded from {args.docs}")
+        return
+    if not context_packing_available():
+        # Packing counts tokens with tiktoken, whose encoding is downloaded on first use
+        os.environ["CONTEXT_TOKEN_BUDGET"] = "0"
+        print("⚠️  tiktoken encoding not available offline, context packing disabled")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark-offline")
+
+    options = {
+        "dim": args.dim,
+        "questions": args.questions,
+        "llm_latency": args.llm_latency_ms / 1000,
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "backend": args.backend,
+    }
+    # The spawned processes open the index through the front end, which reads this
+    os.environ["VECTOR_BACKEND"] = args.backend
+    runs = []
+    for scale in (int(s) for s in args.scales.split(",")):
+        print(f"📚 {scale}x corpus ({seed_chars * scale:,} characters)...")
+        # A fresh process per scale keeps peak RSS and caches independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            run = executor.submit(run_scale, scale, sentences, seed_chars, seed_files, options).result()
+        runs.append(run)
+        print(
+            f"   indexed {run['corpus']['chunks']} chunks at {run['indexing']['chunks_per_second']:.0f} chunks/s, "
+            f"retrieval k=4 p50 {run['retrieval']['k=4']['hybrid']['p50_ms']:.1f} ms, "
+            f"get_response p50 {run['get_response']['p50_ms']:.1f} ms, peak RSS {run['peak_rss_mb']} MB"
+        )
+
+    ann = None
+    if args.ann_rows:
+        print(f"🧭 IVF index on {args.ann_rows:,} synthetic vectors...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            ann = executor.submit(run_ann, args.ann_rows, options).result()
+        print(f"   {ann['lists']} lists, built in {ann['build_seconds']:.1f}s, exact search {ann['exact_qps']:.0f} QPS")
+        for probes, row in ann["probes"].items():
+            print(f"   probes={probes:<3} recall@{ANN_K} {row[f'recall_at_{ANN_K}']:.3f}  {row['qps']:.0f} QPS")
+
+    results = {
+        "schema_version": SCHEMA_VERSION,
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "context_packing": os.getenv("CONTEXT_TOKEN_BUDGET") != "0",
+        "options": dict(options, seed_files=seed_files, seed_characters=seed_chars),
+        "runs": runs,
+        "ann": ann,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+BM25 keyword index for AI Agent Resell Guide Chatbot
+A compact inverted index over the indexed chunks. Postings are stored as flat
+NumPy arrays (one contiguous block of document numbers and term frequencies,
+sliced per term by an offsets array) and persisted next to the vector store
+"""
+
+import os
+import re
+import json
+import threading
+from collections import Counter
+import numpy as np
+
+BM25_DIRNAME = "bm25"
+BM25_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_'][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its me my "
+    "of on or our so that the their them then there these this to was we what "
+    "when where which who why will with you your".split()
+)
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed; hyphenated SKUs stay whole"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over an array-backed inverted index"""
+
+    def __init__(self, chunk_ids, doc_lengths, terms, offsets, postings_docs, postings_tfs,
+                 k1=1.5, b=0.75):
+        self.chunk_ids = chunk_ids
+        self.doc_lengths = doc_lengths
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.terms = terms
+        self.offsets = offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self._length_norms = k1 * (1 - b + b * doc_lengths / max(self.avg_doc_length, 1e-9))
+        # Built by the first scoped search; shared retrievers search from many threads
+        self._positions = None
+        self._positions_lock = threading.Lock()
+
+    @classmethod
+    def build(cls, chunks, k1=1.5, b=0.75):
+        """Build an index from an iterable of (chunk_id, text) pairs"""
+        chunk_ids = []
+        doc_lengths = []
+        postings = {}
+        for doc_number, (chunk_id, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            chunk_ids.append(chunk_id)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_number)
+                postings[term][1].append(tf)
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term][0])
+        postings_docs = np.empty(offsets[-1], dtype=np.uint32)
+        postings_tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            docs, tfs = postings.pop(term)
+            postings_docs[offsets[i]:offsets[i + 1]] = docs
+            postings_tfs[offsets[i]:offsets[i + 1]] = np.minimum(tfs, np.iinfo(np.uint16).max)
+
+        return cls(chunk_ids, np.asarray(doc_lengths, dtype=np.uint32), terms, offsets,
+                   postings_docs, postings_tfs, k1=k1, b=b)
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def _chunk_positions(self):
+        """Chunk ID -> document number, built once"""
+        with self._positions_lock:
+            if self._positions is None:
+                self._positions = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+            return self._positions
+
+    def search(self, query, k=20, ids=None):
+        """Return up to k (chunk_id, score) pairs, best first; with `ids`, only among those chunks"""
+        if not len(self.chunk_ids):
+            return []
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        norms = self._length_norms
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tfs = self.postings_tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1 + (len(self.chunk_ids) - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norms[docs])
+        if ids is not None:
+            positions = self._chunk_positions()
+            allowed = np.zeros(len(self.chunk_ids), dtype=bool)
+            allowed[[positions[i] for i in ids if i in positions]] = True
+            scores[~allowed] = 0
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+    def save(self, persist_directory):
+        """Write the index to <persist_directory>/bm25, replacing any previous one"""
+        directory = os.path.join(persist_directory, BM25_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "doc_lengths.npy"), self.doc_lengths)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "postings_docs.npy"), self.postings_docs)
+        np.save(os.path.join(directory, "postings_tfs.npy"), self.postings_tfs)
+        meta = {
+            "version": BM25_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "chunk_ids": self.chunk_ids,
+            "terms": self.terms,
+        }
+        # The metadata file is written last, so an interrupted first build never loads
+        tmp_path = os.path.join(directory, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, "meta.json"))
+
+    @classmethod
+    def load(cls, persist_directory):
+        """Load the index saved next to a vector store, or None if there is none"""
+        directory = os.path.join(persist_directory, BM25_DIRNAME)
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != BM25_VERSION:
+            return None
+
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        return cls(meta["chunk_ids"], array("doc_lengths"), meta["terms"], array("offsets"),
+                   array("postings_docs"), array("postings_tfs"), k1=meta["k1"], b=meta["b"])
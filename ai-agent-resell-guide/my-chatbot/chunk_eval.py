@@ -0,0 +1,223 @@
+"""
+Chunking evaluation for AI Agent Resell Guide Chatbot
+Sweeps chunk size, overlap, splitter separators and retriever k over a set of
+labelled questions and reports retrieval quality (recall@k, MRR) next to what
+each configuration costs (chunks, index size, prompt tokens per query).
+Runs locally with feature-hashing embeddings, or with cached OpenAI embeddings
+"""
+
+import os
+import io
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import contextlib
+import numpy as np
+from langchain.vectorstores import Chroma
+from http_clients import openai_embeddings
+from langchain_core.embeddings import Embeddings
+from bm25_index import BM25Index, tokenize
+from embedding_cache import cache_embeddings
+from index_documents import load_documents, split_documents, DEFAULT_SEPARATORS
+from retrievers import HybridRetriever
+
+DEFAULT_LABELS_PATH = "eval_questions.jsonl"
+DEFAULT_DOCS_PATH = "docs/TechResellChatbotRAG"
+
+SEPARATOR_PRESETS = {
+    "default": DEFAULT_SEPARATORS,
+    "paragraph": ["\n\n", " ", ""],
+    "sentence": ["\n\n", "\n", ". ", " ", ""],
+}
+
+class HashingEmbeddings(Embeddings):
+    """Local bag-of-words embeddings: signed feature-hashed token counts, L2-normalized
+
+    Only lexical overlap is captured, but rankings are meaningful enough to
+    compare chunking configurations without network access.
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+def load_labels(path):
+    """Labelled questions: one JSON object per line with "question" and "sources"
+
+    Sources are file paths relative to the docs folder.
+    """
+    labels = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                labels.append({"question": item["question"], "sources": set(item["sources"])})
+    return labels
+
+def token_counter():
+    """(name, count_tokens) using tiktoken when its encoding is available locally"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return "tiktoken", lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return "chars/4", lambda text: len(text) // 4
+
+def evaluate_config(documents, labels, docs_path, embeddings, count_tokens, chunk_size, chunk_overlap,
+                    separators, ks, retriever="hybrid"):
+    """Index one chunking configuration in memory and score it at each k"""
+    start = time.perf_counter()
+    chunks = split_documents(documents, chunk_size, chunk_overlap, SEPARATOR_PRESETS[separators])
+    ids = [f"chunk-{i}" for i in range(len(chunks))]
+    for chunk_id, chunk in zip(ids, chunks):
+        chunk.metadata["chunk_id"] = chunk_id
+    vectorstore = Chroma.from_documents(
+        chunks, embeddings, ids=ids, collection_name=f"eval-{chunk_size}-{chunk_overlap}-{separators}"
+    )
+    max_k = max(ks)
+    if retriever == "hybrid":
+        bm25 = BM25Index.build((chunk_id, chunk.page_content) for chunk_id, chunk in zip(ids, chunks))
+        search = HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=max_k, fetch_k=max(20, max_k))
+    else:
+        search = vectorstore.as_retriever(search_kwargs={"k": max_k})
+    build_seconds = time.perf_counter() - start
+
+    scores = {k: {"recall": [], "reciprocal_rank": [], "prompt_tokens": []} for k in ks}
+    for label in labels:
+        docs = search.invoke(label["question"])
+        files = [os.path.relpath(doc.metadata.get("source", ""), docs_path) for doc in docs]
+        for k in ks:
+            top = files[:k]
+            scores[k]["recall"].append(len(label["sources"] & set(top)) / len(label["sources"]))
+            rank = next((i + 1 for i, source in enumerate(top) if source in label["sources"]), None)
+            scores[k]["reciprocal_rank"].append(1 / rank if rank else 0.0)
+            scores[k]["prompt_tokens"].append(sum(count_tokens(doc.page_content) for doc in docs[:k]))
+    vectorstore.delete_collection()
+
+    dim = len(embeddings.embed_query("dimension probe"))
+    index_bytes = sum(len(chunk.page_content.encode("utf-8")) for chunk in chunks) + len(chunks) * dim * 4
+    return [
+        {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "separators": separators,
+            "k": k,
+            "chunks": len(chunks),
+            "index_mb": round(index_bytes / 1e6, 3),
+            "build_seconds": round(build_seconds, 3),
+            "recall_at_k": round(float(np.mean(scores[k]["recall"])), 4),
+            "mrr": round(float(np.mean(scores[k]["reciprocal_rank"])), 4),
+            "prompt_tokens_per_query": round(float(np.mean(scores[k]["prompt_tokens"])), 1),
+        }
+        for k in ks
+    ]
+
+def recommend(rows, recall_tolerance):
+    """Cheapest configuration (prompt tokens, then chunks) within tolerance of the best recall"""
+    best_recall = max(row["recall_at_k"] for row in rows)
+    candidates = [row for row in rows if row["recall_at_k"] >= best_recall - recall_tolerance]
+    return min(candidates, key=lambda row: (row["prompt_tokens_per_query"], row["chunks"], -row["mrr"]))
+
+def print_table(rows):
+    header = f"{'size':>6}{'overlap':>9}{'separators':>12}{'k':>4}{'chunks':>8}{'index MB':>10}" \
+             f"{'recall@k':>10}{'MRR':>8}{'tokens/query':>14}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['chunk_size']:>6}{row['chunk_overlap']:>9}{row['separators']:>12}{row['k']:>4}"
+            f"{row['chunks']:>8}{row['index_mb']:>10.3f}{row['recall_at_k']:>10.3f}{row['mrr']:>8.3f}"
+            f"{row['prompt_tokens_per_query']:>14.1f}"
+        )
+
+def parse_ints(value):
+    return [int(part) for part in value.split(",")]
+
+def main():
+    """Run the chunking sweep and report the cheapest configuration that keeps recall"""
+    parser = argparse.ArgumentParser(description="Evaluate chunking parameters against labelled questions")
+    parser.add_argument("--labels", default=DEFAULT_LABELS_PATH, help="JSONL of questions and source files")
+    parser.add_argument("--docs", default=DEFAULT_DOCS_PATH)
+    parser.add_argument("--chunk-sizes", type=parse_ints, default=[500, 1000, 1500])
+    parser.add_argument("--overlaps", type=parse_ints, default=[0, 100, 200])
+    parser.add_argument("--separators", default=",".join(SEPARATOR_PRESETS),
+                        help=f"Comma-separated presets from: {', '.join(SEPARATOR_PRESETS)}")
+    parser.add_argument("--ks", type=parse_ints, default=[2, 4, 8])
+    parser.add_argument("--retriever", choices=["hybrid", "vector"], default="hybrid")
+    parser.add_argument("--embeddings", choices=["hashing", "openai"], default="hashing",
+                        help="hashing runs offline; openai uses the on-disk embedding cache")
+    parser.add_argument("--recall-tolerance", type=float, default=0.02,
+                        help="Recall below the best that is still acceptable for a cheaper configuration")
+    parser.add_argument("--output", default="chunk_eval_results.json")
+    args = parser.parse_args()
+
+    print("🧪 AI Agent Resell Guide - Chunking Evaluation")
+    print("=" * 50)
+    labels = load_labels(args.labels)
+    with contextlib.redirect_stdout(io.StringIO()):
+        documents = load_documents(args.docs)
+    if not labels or not documents:
+        print("❌ Need labelled questions and at least one loadable document")
+        return
+    if args.embeddings == "openai":
+        embeddings = cache_embeddings(openai_embeddings())
+    else:
+        embeddings = HashingEmbeddings()
+    counter_name, count_tokens = token_counter()
+    print(f"📋 {len(labels)} labelled question(s), {len(documents)} document page(s)")
+    print(f"🔍 {args.retriever} retrieval, {args.embeddings} embeddings, tokens counted with {counter_name}")
+
+    rows = []
+    separators = args.separators.split(",")
+    for chunk_size, chunk_overlap, preset in itertools.product(args.chunk_sizes, args.overlaps, separators):
+        if chunk_overlap >= chunk_size:
+            continue
+        rows.extend(evaluate_config(
+            documents, labels, args.docs, embeddings, count_tokens,
+            chunk_size, chunk_overlap, preset, args.ks, args.retriever
+        ))
+
+    rows.sort(key=lambda row: (-row["recall_at_k"], row["prompt_tokens_per_query"]))
+    print()
+    print_table(rows)
+
+    choice = recommend(rows, args.recall_tolerance)
+    print(
+        f"\n✅ Cheapest configuration within {args.recall_tolerance:.0%} of the best recall: "
+        f"CHUNK_SIZE={choice['chunk_size']} CHUNK_OVERLAP={choice['chunk_overlap']} "
+        f"RETRIEVER_K={choice['k']} ({choice['separators']} separators) - "
+        f"recall@k {choice['recall_at_k']:.3f}, MRR {choice['mrr']:.3f}, "
+        f"{choice['prompt_tokens_per_query']:.0f} prompt tokens per query"
+    )
+
+    results = {
+        "labels": args.labels,
+        "retriever": args.retriever,
+        "embeddings": args.embeddings,
+        "token_counter": counter_name,
+        "recommendation": choice,
+        "rows": rows,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
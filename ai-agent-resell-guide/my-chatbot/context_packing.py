@@ -0,0 +1,174 @@
+"""
+Context packing for Zendesk ISV Resell Assistant
+Post-retrieval stage that drops near-duplicate chunks, merges overlapping
+neighbours from the same source and packs the best-ranked text into a token
+budget before it is stuffed into the answer prompt
+"""
+
+import os
+import re
+import logging
+import functools
+from langchain_core.documents import Document
+
+SHINGLE_SIZE = 5
+MIN_TEXT_OVERLAP = 40
+
+logger = logging.getLogger(__name__)
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def _is_near_duplicate(shingles, kept_shingles, threshold):
+    """True if most of this chunk's shingles already appear in a kept chunk"""
+    if not shingles:
+        return True
+    for other in kept_shingles:
+        if len(shingles & other) / len(shingles) >= threshold:
+            return True
+    return False
+
+def _same_place(a, b):
+    return (
+        a.metadata.get("source") == b.metadata.get("source")
+        and a.metadata.get("page") == b.metadata.get("page")
+    )
+
+def _text_overlap(first, second):
+    """Length of the longest suffix of first that is a prefix of second"""
+    head = second[:MIN_TEXT_OVERLAP]
+    if len(head) < MIN_TEXT_OVERLAP:
+        return 0
+    position = first.find(head)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(head, position + 1)
+    return 0
+
+def _join(first, second):
+    """Merge two chunks in reading order, or None if they aren't neighbours"""
+    start_a, start_b = first.metadata.get("start_index"), second.metadata.get("start_index")
+    if start_a is not None and start_b is not None:
+        if start_b < start_a:
+            first, second = second, first
+            start_a, start_b = start_b, start_a
+        end_a = start_a + len(first.page_content)
+        if start_b > end_a:
+            return None
+        text = first.page_content + second.page_content[end_a - start_b:]
+    else:
+        overlap = _text_overlap(first.page_content, second.page_content)
+        if not overlap:
+            overlap = _text_overlap(second.page_content, first.page_content)
+            if not overlap:
+                return None
+            first, second = second, first
+        text = first.page_content + second.page_content[overlap:]
+
+    metadata = dict(first.metadata)
+    metadata["merged_chunk_ids"] = (
+        first.metadata.get("merged_chunk_ids", [first.metadata.get("chunk_id")])
+        + second.metadata.get("merged_chunk_ids", [second.metadata.get("chunk_id")])
+    )
+    return Document(page_content=text, metadata=metadata)
+
+def merge_adjacent(docs):
+    """Merge overlapping or touching chunks from the same source and page
+
+    A merged chunk takes the rank of its best-ranked part.
+    """
+    merged = []
+    for doc in docs:
+        for i, kept in enumerate(merged):
+            if _same_place(kept, doc):
+                joined = _join(kept, doc)
+                if joined is not None:
+                    merged[i] = joined
+                    break
+        else:
+            merged.append(doc)
+    return merged
+
+def pack_documents(docs, token_budget, count_tokens, duplicate_threshold=0.8):
+    """Deduplicate, merge and pack ranked documents into a token budget
+
+    `docs` must be ordered best first. Documents that don't fit are skipped in
+    favour of lower-ranked ones that do; if not even the best one fits, it is
+    truncated to the budget.
+    """
+    unique = []
+    kept_shingles = []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if _is_near_duplicate(shingles, kept_shingles, duplicate_threshold):
+            continue
+        unique.append(doc)
+        kept_shingles.append(shingles)
+
+    packed = []
+    used = 0
+    for doc in merge_adjacent(unique):
+        tokens = count_tokens(doc.page_content)
+        if used + tokens <= token_budget:
+            packed.append(doc)
+            used += tokens
+    if not packed and unique:
+        best = unique[0]
+        text = best.page_content
+        while text and count_tokens(text) > token_budget:
+            text = text[:int(len(text) * 0.9)]
+        packed.append(Document(page_content=text, metadata=dict(best.metadata)))
+    return packed
+
+@functools.lru_cache(maxsize=None)
+def token_encoding(model_name):
+    """tiktoken encoding for a model, or None when it can't be loaded
+
+    Encodings are downloaded on first use, so without network access (and
+    no TIKTOKEN_CACHE_DIR) callers fall back to estimate_tokens. tiktoken
+    itself is imported on the first call rather than at startup.
+    """
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken encoding for %s not available (%s); estimating tokens from characters", model_name, e)
+        return None
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) for when tiktoken isn't available"""
+    return len(text) // 4 + 1
+
+class ContextPacker:
+    """Callable packing stage with tiktoken counting for the answer model"""
+
+    def __init__(self, token_budget, model_name="gpt-4", duplicate_threshold=0.8):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self._encoding = token_encoding(model_name)
+
+    def count_tokens(self, text):
+        if self._encoding is None:
+            return estimate_tokens(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def __call__(self, docs):
+        return pack_documents(docs, self.token_budget, self.count_tokens, self.duplicate_threshold)
+
+def context_packer_from_env(model_name="gpt-4"):
+    """ContextPacker configured by CONTEXT_TOKEN_BUDGET, or None when it is 0"""
+    token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+    if token_budget <= 0:
+        return None
+    return ContextPacker(
+        token_budget,
+        model_name=model_name,
+        duplicate_threshold=float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", 0.8)),
+    )
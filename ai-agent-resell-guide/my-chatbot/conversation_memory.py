@@ -0,0 +1,96 @@
+"""
+Conversation memory for Zendesk ISV Resell Assistant
+Keeps the most recent turns verbatim within a token budget and folds older
+turns into a running summary, so the history sent with every question stops
+growing with the length of the session. LangChain's memory classes are only
+imported when the first memory is built
+"""
+
+import os
+import functools
+from context_packing import estimate_tokens
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(str(message.content)) for message in messages)
+
+def count_message_tokens(llm, messages):
+    """Tokens in messages by the model's tokenizer, or estimated when it can't be loaded (e.g. tiktoken offline)"""
+    try:
+        return llm.get_num_tokens_from_messages(messages)
+    except Exception:
+        return estimate_message_tokens(messages)
+
+@functools.lru_cache(maxsize=None)
+def summary_buffer_memory_class():
+    """SummaryBufferMemory, defined on first use: langchain.memory loads LangChain's legacy chains"""
+    from langchain.memory import ConversationSummaryBufferMemory
+
+    class SummaryBufferMemory(ConversationSummaryBufferMemory):
+        """ConversationSummaryBufferMemory that keeps pruning when the model's tokenizer isn't available"""
+
+        tokenizer_failed: bool = False
+        """Set once the model's tokenizer failed to load, so this memory doesn't retry (and re-download) it for every count"""
+
+        def count_tokens(self, messages):
+            """Tokens in messages by the model's tokenizer, or estimated once it has failed"""
+            if not self.tokenizer_failed:
+                try:
+                    return self.llm.get_num_tokens_from_messages(messages)
+                except Exception:
+                    self.tokenizer_failed = True
+            return estimate_message_tokens(messages)
+
+        def _split_overflow(self):
+            """Remove and return the oldest messages beyond max_token_limit"""
+            buffer = self.chat_memory.messages
+            pruned_memory = []
+            while buffer and self.count_tokens(buffer) > self.max_token_limit:
+                pruned_memory.append(buffer.pop(0))
+            return pruned_memory
+
+        def prune(self):
+            pruned_memory = self._split_overflow()
+            if pruned_memory:
+                self.moving_summary_buffer = self.predict_new_summary(pruned_memory, self.moving_summary_buffer)
+
+        async def aprune(self):
+            pruned_memory = self._split_overflow()
+            if pruned_memory:
+                self.moving_summary_buffer = await self.apredict_new_summary(pruned_memory, self.moving_summary_buffer)
+
+    return SummaryBufferMemory
+
+def build_memory(llm):
+    """Token-budgeted sliding window plus summary, configured by MEMORY_MAX_TOKENS"""
+    return summary_buffer_memory_class()(
+        llm=llm,
+        max_token_limit=int(os.getenv("MEMORY_MAX_TOKENS", 1000)),
+        memory_key="chat_history",
+        input_key="question",
+        output_key="answer",
+        return_messages=True
+    )
+
+def no_memory():
+    """Always-empty history for one-off questions; a chain using it can be shared by concurrent runs"""
+    from langchain.memory import ConversationBufferMemory, ReadOnlySharedMemory
+    return ReadOnlySharedMemory(memory=ConversationBufferMemory(
+        memory_key="chat_history",
+        input_key="question",
+        output_key="answer",
+        return_messages=True
+    ))
+
+def history_tokens(memory):
+    """Tokens of history (summary plus recent turns) the next question will carry"""
+    if memory is None:
+        return 0
+    messages = memory.load_memory_variables({})[memory.memory_key]
+    if not messages:
+        return 0
+    if hasattr(memory, "count_tokens"):
+        return memory.count_tokens(messages)
+    llm = getattr(memory, "llm", None)
+    if llm is None:
+        return sum(len(message.content.split()) for message in messages)
+    return count_message_tokens(llm, messages)
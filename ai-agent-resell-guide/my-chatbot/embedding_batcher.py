@@ -0,0 +1,190 @@
+"""
+Query embedding micro-batcher for Zendesk ISV Resell Assistant
+Holds question embeddings from concurrent sessions for a few milliseconds and
+sends them to the embeddings API as one batched request, then hands each
+caller its own vector. Under bursty load this turns many single-text round
+trips into a few requests, keeping well inside requests-per-minute limits
+"""
+
+import os
+import time
+import queue
+import asyncio
+import bisect
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from embedding_cache import model_name_of
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+ADDED_LATENCY_MS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """Observation counts per bucket (by upper bound) with count, mean, max and recent percentiles"""
+
+    def __init__(self, bounds, window=1000):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._recent.append(value)
+
+    def to_dict(self):
+        labels = [f"<={bound:g}" for bound in self.bounds] + [f">{self.bounds[-1]:g}"]
+        summary = {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+        if self._recent:
+            summary["p50"], summary["p95"] = (float(p) for p in np.percentile(self._recent, [50, 95]))
+        return summary
+
+class _PendingQuery:
+    def __init__(self, text):
+        self.text = text
+        self.future = Future()
+        self.queued = time.perf_counter()
+
+class QueryEmbeddingBatcher(Embeddings):
+    """Embeddings wrapper that batches concurrent embed_query calls into one request
+
+    A batch is sent `max_wait` seconds after its first query arrives, or as
+    soon as it holds `max_batch_size` distinct texts. At most `max_in_flight`
+    batches are sent at once; while they are all busy new queries keep
+    queueing, so batches grow with load. Document embedding passes straight
+    through.
+    """
+
+    def __init__(self, embeddings, max_batch_size=32, max_wait=0.005, max_in_flight=4):
+        self.embeddings = embeddings
+        # Same model name as the wrapped embeddings, so embedding cache keys don't change
+        self.model = model_name_of(embeddings)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = 0
+        self.queries = 0
+        self.errors = 0
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.added_latency_ms = Histogram(ADDED_LATENCY_MS_BUCKETS)
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_in_flight, thread_name_prefix="query-embedding-batch")
+        self._collector = None
+        self._lock = threading.Lock()
+
+    def _submit(self, text):
+        pending = _PendingQuery(text)
+        with self._lock:
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, name="query-embedding-batcher", daemon=True)
+                self._collector.start()
+        self._queue.put(pending)
+        return pending.future
+
+    def _collect(self):
+        """Gather queued queries into batches and hand each to a sender thread"""
+        while True:
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            texts = {batch[0].text}
+            deadline = batch[0].queued + self.max_wait
+            while len(texts) < self.max_batch_size:
+                try:
+                    pending = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                texts.add(pending.text)
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        sent = time.perf_counter()
+        texts = list(dict.fromkeys(pending.text for pending in batch))
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            for pending in batch:
+                pending.future.set_exception(e)
+            failed = True
+        else:
+            by_text = dict(zip(texts, vectors))
+            for pending in batch:
+                pending.future.set_result(by_text[pending.text])
+            failed = False
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.requests += 1
+            self.queries += len(batch)
+            self.errors += failed
+            self.batch_sizes.observe(len(texts))
+            for pending in batch:
+                self.added_latency_ms.observe((sent - pending.queued) * 1000)
+
+    def embed_query(self, text):
+        """Embed one query as part of the next batch"""
+        return self._submit(text).result()
+
+    async def aembed_query(self, text):
+        """Async embed_query; the event loop isn't blocked while the batch is sent"""
+        return await asyncio.wrap_future(self._submit(text))
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.embeddings.aembed_documents(texts)
+
+    def batch_stats(self):
+        """Requests sent for how many queries, with batch-size and added-latency histograms"""
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "requests": self.requests,
+                "requests_saved": self.queries - self.requests,
+                "errors": self.errors,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batch_size": self.batch_sizes.to_dict(),
+                "added_latency_ms": self.added_latency_ms.to_dict(),
+            }
+
+def _format_histogram(histogram):
+    return " ".join(f"{label}:{count}" for label, count in histogram["buckets"].items() if count)
+
+def format_batch_stats(stats):
+    """Plain-text batching summary for the CLI"""
+    if not stats["requests"]:
+        return "No query embeddings sent yet."
+    latency = stats["added_latency_ms"]
+    return "\n".join([
+        f"Queries: {stats['queries']} in {stats['requests']} request(s) "
+        f"({stats['requests_saved']} saved, {stats['errors']} failed)",
+        f"Batch size: mean {stats['batch_size']['mean']:.1f}, max {stats['batch_size']['max']:g} "
+        f"(limit {stats['max_batch_size']}) | {_format_histogram(stats['batch_size'])}",
+        f"Added latency: p50 {latency['p50']:.1f}ms, p95 {latency['p95']:.1f}ms, max {latency['max']:.1f}ms "
+        f"(wait limit {stats['max_wait_ms']:g}ms) | {_format_histogram(latency)}",
+    ])
+
+def batch_query_embeddings(embeddings):
+    """Wrap an embeddings object with the query batcher configured by EMBED_BATCH, EMBED_BATCH_MAX_SIZE and EMBED_BATCH_MAX_WAIT_MS"""
+    max_batch_size = int(os.getenv("EMBED_BATCH_MAX_SIZE", 32))
+    if os.getenv("EMBED_BATCH", "true").lower() == "false" or max_batch_size <= 1:
+        return embeddings
+    return QueryEmbeddingBatcher(
+        embeddings,
+        max_batch_size=max_batch_size,
+        max_wait=float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", 5)) / 1000,
+    )
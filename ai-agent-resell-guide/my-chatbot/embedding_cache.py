@@ -0,0 +1,209 @@
+"""
+Persistent embedding cache for AI Agent Resell Guide Chatbot
+Stores embeddings in SQLite keyed by (model name, normalized text hash) so that
+re-indexing identical chunks or repeating a question never pays for an
+embedding call twice
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = "embedding_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 200000
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different copies of a text share a key"""
+    return re.sub(r"\s+", " ", text).strip()
+
+def cache_key(model_name, text):
+    """Return the cache key for a text embedded with the given model"""
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+class EmbeddingCache:
+    """Size-bounded, least-recently-used embedding store backed by SQLite"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, model_name, texts):
+        """Return cached vectors for texts, with None for every miss"""
+        keys = [cache_key(model_name, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+            hit_count = sum(1 for key in keys if key in found)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+
+        return [
+            array("f", found[key]).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model_name, texts, vectors):
+        """Store vectors for texts and evict the least recently used overflow"""
+        now = time.time()
+        rows = [
+            (cache_key(model_name, text), model_name, array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop the least recently used entries beyond max_entries"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+    def stats(self):
+        """Return hit/miss counters for reporting"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that answers from an EmbeddingCache before calling the model"""
+
+    def __init__(self, embeddings, cache, model_name=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name or model_name_of(embeddings)
+        self._local = threading.local()
+
+    def _store(self, texts, vectors):
+        """Cache newly embedded documents, unless the wrapped model already checkpointed them here"""
+        inner = self.embeddings
+        if getattr(inner, "checkpoint", None) is self.cache and getattr(inner, "model", None) == self.model_name:
+            return
+        self.cache.put_many(self.model_name, texts, vectors)
+
+    def embed_documents(self, texts):
+        """Embed texts, calling the wrapped model only for cache misses"""
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Embed each distinct missing text once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_vectors = self.embeddings.embed_documents(unique_texts)
+            self._store(unique_texts, new_vectors)
+            by_text = dict(zip(unique_texts, new_vectors))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        return vectors
+
+    def embed_query(self, text):
+        """Embed a single query, using the cache when possible"""
+        (vector,) = self.cache.get_many(self.model_name, [text])
+        self._local.query_hit = vector is not None
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many(self.model_name, [text], [vector])
+        return vector
+
+    async def aembed_documents(self, texts):
+        """Async embed_documents; only cache misses await the wrapped model"""
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_vectors = await self.embeddings.aembed_documents(unique_texts)
+            self._store(unique_texts, new_vectors)
+            by_text = dict(zip(unique_texts, new_vectors))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        return vectors
+
+    async def aembed_query(self, text):
+        """Async embed_query; only a cache miss awaits the wrapped model"""
+        (vector,) = self.cache.get_many(self.model_name, [text])
+        hit = vector is not None
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.put_many(self.model_name, [text], [vector])
+        # Set after the await, so the caller reads its own result
+        self._local.query_hit = hit
+        return vector
+
+    @property
+    def last_query_hit(self):
+        """Whether this thread's last embed_query was answered from the cache"""
+        return getattr(self._local, "query_hit", None)
+
+    def stats(self):
+        """Return hit/miss counters of the underlying cache"""
+        return self.cache.stats()
+
+def model_name_of(embeddings):
+    """Best-effort model identifier for an embeddings object"""
+    for attr in ("model", "model_name", "deployment"):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    return type(embeddings).__name__
+
+def cache_embeddings(embeddings):
+    """Wrap an embeddings object with the on-disk cache configured in the environment"""
+    cache = EmbeddingCache(
+        path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    )
+    return CachedEmbeddings(embeddings, cache)
@@ -0,0 +1,221 @@
+"""
+Embedding scheduler for AI Agent Resell Guide Chatbot
+Groups texts into token-bounded batches and embeds them concurrently while
+respecting tokens-per-minute and requests-per-minute budgets
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from langchain_core.embeddings import Embeddings
+from context_packing import estimate_tokens, token_encoding
+
+class RateLimiter:
+    """Sliding one-minute window over request and token budgets"""
+
+    def __init__(self, tokens_per_minute, requests_per_minute, window=60.0):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self._events = deque()
+        self._tokens_in_window = 0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    async def acquire(self, tokens):
+        """Wait until a request of `tokens` tokens fits in both budgets"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._prune(now)
+                fits_requests = len(self._events) < self.requests_per_minute
+                # An oversized batch is let through on its own once the window is empty
+                fits_tokens = (
+                    self._tokens_in_window + tokens <= self.tokens_per_minute
+                    or not self._events
+                )
+                if fits_requests and fits_tokens:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                await asyncio.sleep(max(self._events[0][0] + self.window - now, 0.01))
+
+    def pause(self, seconds):
+        """Hold back every caller, e.g. after the server answered 429"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+def is_retryable(error):
+    """Return True for rate limits, timeouts and server-side errors"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("RateLimitError", "APITimeoutError", "APIConnectionError")
+
+def retry_after(error):
+    """Return the server's Retry-After hint in seconds, if it sent one"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class EmbeddingScheduler(Embeddings):
+    """Embeddings wrapper that batches, rate-limits and retries embedding calls
+
+    Completed batches are written to `checkpoint` (anything with a
+    put_many(model_name, texts, vectors) method, such as an EmbeddingCache)
+    as soon as they finish, so an interrupted run only re-embeds the batches
+    that were still outstanding.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        model_name=None,
+        max_batch_tokens=20000,
+        max_batch_size=512,
+        max_concurrency=4,
+        tokens_per_minute=1000000,
+        requests_per_minute=3000,
+        max_retries=8,
+        checkpoint=None,
+        rate_window=60.0,
+    ):
+        self.embeddings = embeddings
+        self.model = model_name or getattr(embeddings, "model", None) or "text-embedding-ada-002"
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        # Seconds the TPM/RPM budgets apply to; shorter windows are for tests
+        self.rate_window = rate_window
+        self.max_retries = max_retries
+        self.checkpoint = checkpoint
+        self.retries = 0
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        # Created on the scheduler's event loop by the first call, then shared by every later one
+        self._limiter = None
+        self._semaphore = None
+        self._encoding = token_encoding(self.model)
+
+    @classmethod
+    def from_env(cls, embeddings, checkpoint=None):
+        """Build a scheduler configured from EMBEDDING_* environment variables"""
+        return cls(
+            embeddings,
+            max_batch_tokens=int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", 20000)),
+            max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", 4)),
+            tokens_per_minute=int(os.getenv("EMBEDDING_TPM", 1000000)),
+            requests_per_minute=int(os.getenv("EMBEDDING_RPM", 3000)),
+            max_retries=int(os.getenv("EMBEDDING_MAX_RETRIES", 8)),
+            checkpoint=checkpoint,
+        )
+
+    def count_tokens(self, text):
+        """Count tokens the way the embedding model will, or estimate them without tiktoken"""
+        if self._encoding is None:
+            return estimate_tokens(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def make_batches(self, texts):
+        """Group text indexes into batches bounded by token and item counts
+
+        Returns a list of (indexes, token_count) tuples.
+        """
+        batches = []
+        indexes, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if indexes and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(indexes) >= self.max_batch_size
+            ):
+                batches.append((indexes, batch_tokens))
+                indexes, batch_tokens = [], 0
+            indexes.append(i)
+            batch_tokens += tokens
+        if indexes:
+            batches.append((indexes, batch_tokens))
+        return batches
+
+    async def _embed_batch(self, texts, tokens, limiter, semaphore):
+        """Embed one batch, backing off and retrying on retryable errors"""
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await limiter.acquire(tokens)
+                try:
+                    vectors = await self.embeddings.aembed_documents(texts)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    self.retries += 1
+                    delay = retry_after(e) or min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+                    limiter.pause(delay)
+                    continue
+                if self.checkpoint is not None:
+                    self.checkpoint.put_many(self.model, texts, vectors)
+                return vectors
+
+    async def aembed_documents(self, texts):
+        """Embed texts in concurrent, rate-limited batches, preserving order
+
+        Every call runs on the scheduler's own event loop, so the TPM/RPM
+        window, 429 pauses and concurrency cap hold across calls (one per
+        indexing batch) rather than restarting with each.
+        """
+        loop = self._event_loop()
+        if asyncio.get_running_loop() is not loop:
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.aembed_documents(texts), loop))
+        if self._limiter is None:
+            self._limiter = RateLimiter(self.tokens_per_minute, self.requests_per_minute, self.rate_window)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = self.make_batches(texts)
+        results = await asyncio.gather(*(
+            self._embed_batch([texts[i] for i in indexes], tokens, self._limiter, self._semaphore)
+            for indexes, tokens in batches
+        ))
+        vectors = [None] * len(texts)
+        for (indexes, _), batch_vectors in zip(batches, results):
+            for i, vector in zip(indexes, batch_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def _event_loop(self):
+        """Event loop kept for the scheduler's lifetime on a background thread
+
+        Reusing one loop lets the shared async HTTP client keep its
+        connections alive from one indexing batch to the next.
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    def embed_documents(self, texts):
+        """Synchronous entry point used by vector stores"""
+        if not texts:
+            return []
+        return asyncio.run_coroutine_threadsafe(self.aembed_documents(texts), self._event_loop()).result()
+
+    def embed_query(self, text):
+        """Queries are single texts, so they go straight to the wrapped model"""
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text):
+        return await self.embeddings.aembed_query(text)
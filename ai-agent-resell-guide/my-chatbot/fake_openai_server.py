@@ -0,0 +1,277 @@
+"""
+Fake OpenAI-compatible server for AI Agent Resell Guide Chatbot
+Serves deterministic embeddings and canned chat completions (optionally
+streamed) locally so indexing and chat can be exercised without network
+access or API spend. Point the OpenAI client at it with
+OPENAI_BASE_URL=http://127.0.0.1:8765/v1, and the Anthropic client (which
+gets the same canned answers from /v1/messages) with
+ANTHROPIC_API_URL=http://127.0.0.1:8765
+"""
+
+import json
+import time
+import random
+import base64
+import hashlib
+import argparse
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def fake_embedding(value, dim):
+    """Deterministic unit vector derived from the hash of a text or token list"""
+    seed = hashlib.sha256(json.dumps(value).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Request handler; behaviour is configured on the server object"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _should_rate_limit(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            return server.rng.random() < server.fail_rate
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self._should_rate_limit():
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": str(self.server.retry_after)},
+            )
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/embeddings"):
+            self._handle_embeddings(payload)
+        elif path.endswith("/chat/completions"):
+            self._handle_chat(payload)
+        elif path.endswith("/messages"):
+            self._handle_messages(payload)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _handle_embeddings(self, payload):
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        with self.server.lock:
+            self.server.embedding_requests += 1
+            self.server.embedded_inputs += len(inputs)
+        data = []
+        tokens = 0
+        for i, value in enumerate(inputs):
+            vector = fake_embedding(value, self.server.dim)
+            if payload.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+            tokens += len(value) if isinstance(value, list) else len(value.split())
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _handle_chat(self, payload):
+        with self.server.lock:
+            self.server.chat_requests += 1
+        messages = payload.get("messages", [])
+        question = messages[-1]["content"] if messages else ""
+        if isinstance(question, list):
+            question = " ".join(part.get("text", "") for part in question)
+        answer = fake_answer(question)
+        words = answer.split(" ")
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content", "")).split()) for m in messages),
+            "completion_tokens": len(words),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = payload.get("model", "fake-chat")
+        created = int(time.time())
+
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_chunk({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            if self.server.token_latency:
+                time.sleep(self.server.token_latency)
+            send_chunk({"content": word if i == 0 else " " + word})
+        send_chunk({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _handle_messages(self, payload):
+        """Anthropic Messages API, with the same canned answer as /chat/completions"""
+        with self.server.lock:
+            self.server.chat_requests += 1
+        messages = payload.get("messages", [])
+        question = messages[-1]["content"] if messages else ""
+        if isinstance(question, list):
+            question = " ".join(part.get("text", "") for part in question)
+        answer = fake_answer(question)
+        words = answer.split(" ")
+        usage = {
+            "input_tokens": sum(len(str(m.get("content", "")).split()) for m in messages),
+            "output_tokens": len(words),
+        }
+        message = {
+            "id": "msg_fake",
+            "type": "message",
+            "role": "assistant",
+            "model": payload.get("model", "fake-chat"),
+            "content": [{"type": "text", "text": answer}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+        if not payload.get("stream"):
+            self._send_json(200, message)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_event(event, data):
+            data = dict(data, type=event)
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_event("message_start", {"message": dict(
+            message, content=[], stop_reason=None, usage={"input_tokens": usage["input_tokens"], "output_tokens": 0}
+        )})
+        send_event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+        for i, word in enumerate(words):
+            if self.server.token_latency:
+                time.sleep(self.server.token_latency)
+            text = word if i == 0 else " " + word
+            send_event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": text}})
+        send_event("content_block_stop", {"index": 0})
+        send_event("message_delta", {
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": usage["output_tokens"]},
+        })
+        send_event("message_stop", {})
+
+def fake_answer(question):
+    """Canned, deterministic answer that echoes the start of the prompt's last message"""
+    topic = " ".join(question.split()[-12:])
+    return f"Based on the ISV resell documentation, here is what applies to: {topic}"
+
+def make_server(host="127.0.0.1", port=8765, dim=1536, latency=0.0, fail_rate=0.0,
+                retry_after=1, seed=0, verbose=False, token_latency=0.0):
+    """Create (but don't start) a fake server; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.dim = dim
+    server.latency = latency
+    server.token_latency = token_latency
+    server.fail_rate = fail_rate
+    server.retry_after = retry_after
+    server.rng = random.Random(seed)
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.embedding_requests = 0
+    server.embedded_inputs = 0
+    server.chat_requests = 0
+    return server
+
+def start_in_thread(**kwargs):
+    """Start a fake server on a background thread and return (server, base_url)"""
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+def main():
+    """Run the fake server from the command line"""
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per request")
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="Delay between streamed chat tokens")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(
+        host=args.host, port=args.port, dim=args.dim, latency=args.latency_ms / 1000.0,
+        fail_rate=args.fail_rate, retry_after=args.retry_after, verbose=args.verbose,
+        token_latency=args.token_latency_ms / 1000.0,
+    )
+    print(f"🧪 Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    print(f"   export OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    print(f"   export ANTHROPIC_API_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopping fake server")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Shared HTTP clients for Zendesk ISV Resell Assistant
+One keep-alive connection pool per process for every OpenAI and Anthropic
+call (answers, condensing and embeddings), with limits on total and per-host
+connections, HTTP/2 when the h2 package is installed, and utilization counters
+for the CLI stats command, GET /stats and the Streamlit sidebar
+"""
+
+import os
+import asyncio
+import functools
+import threading
+import weakref
+import httpx
+
+# Matches the OpenAI and Anthropic SDK defaults; both pass per-request timeouts anyway
+DEFAULT_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+def http2_available():
+    """Whether the h2 package httpx needs for HTTP/2 is installed"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def http_settings_from_env():
+    """Pool limits from HTTP_MAX_CONNECTIONS, HTTP_MAX_PER_HOST, HTTP_MAX_EMBEDDINGS_PER_HOST,
+    HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_SECONDS and HTTP2"""
+    max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", 32))
+    http2 = os.getenv("HTTP2", "auto").lower()
+    return {
+        "max_connections": max_connections,
+        # Room for the service's 8 concurrent streamed answers plus their condense calls
+        "max_per_host": min(int(os.getenv("HTTP_MAX_PER_HOST", 16)), max_connections),
+        # A separate budget, so embeddings never queue behind answers that hold their slots while streaming
+        "max_embeddings_per_host": min(int(os.getenv("HTTP_MAX_EMBEDDINGS_PER_HOST", 8)), max_connections),
+        "max_keepalive": int(os.getenv("HTTP_MAX_KEEPALIVE", max_connections)),
+        "keepalive_seconds": float(os.getenv("HTTP_KEEPALIVE_SECONDS", 60)),
+        # auto: HTTP/2 whenever h2 is installed; true without h2 would fail at the first request
+        "http2": http2_available() if http2 == "auto" else http2 in ("1", "true", "yes"),
+    }
+
+class PoolStats:
+    """Request and connection counters shared by the sync and async clients"""
+
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # Requests that had to wait for a per-host slot (HTTP_MAX_PER_HOST or HTTP_MAX_EMBEDDINGS_PER_HOST)
+        self.host_waits = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+
+    def started(self, waited):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.host_waits += waited
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def traced(self, event):
+        """Count new connections from httpcore trace events"""
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+def _pool_connections(transport):
+    """(open, idle) connection counts of an httpx transport's connection pool"""
+    pool = getattr(transport, "_pool", None)
+    connections = [c for c in getattr(pool, "connections", []) if not c.is_closed()]
+    return len(connections), sum(c.is_idle() for c in connections)
+
+def _host_budget(url, settings):
+    """(slot key, slot count): embeddings and completions to one host have separate budgets"""
+    if url.path.rstrip("/").endswith("/embeddings"):
+        return (url.scheme, url.host, url.port, "embeddings"), settings["max_embeddings_per_host"]
+    return (url.scheme, url.host, url.port), settings["max_per_host"]
+
+def _transport_options(settings):
+    return {
+        "http2": settings["http2"],
+        "limits": httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive"],
+            keepalive_expiry=settings["keepalive_seconds"],
+        ),
+    }
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees its per-host slot once the body is closed"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    """Async counterpart of _ReleasingStream"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for part in self.stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.release()
+
+def _once(release):
+    done = []
+
+    def wrapper():
+        if not done:
+            done.append(True)
+            release()
+    return wrapper
+
+class LimitedTransport(httpx.BaseTransport):
+    """httpx transport that caps concurrent requests per host and counts pool use
+
+    A streamed response (a token stream) holds its host slot until the body is
+    closed, so with HTTP/1.1 the cap is also the host's connection count.
+    Embedding requests count against their own per-host cap.
+    """
+
+    def __init__(self, settings, stats):
+        self.settings = settings
+        self.stats = stats
+        self.transport = httpx.HTTPTransport(**_transport_options(settings))
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_slots(self, url):
+        key, limit = _host_budget(url, self.settings)
+        with self._lock:
+            if key not in self._hosts:
+                self._hosts[key] = threading.BoundedSemaphore(limit)
+            return self._hosts[key]
+
+    def handle_request(self, request):
+        slots = self._host_slots(request.url)
+        waited = not slots.acquire(blocking=False)
+        if waited:
+            slots.acquire()
+        self.stats.started(waited)
+
+        def release():
+            self.stats.finished()
+            slots.release()
+        release = _once(release)
+
+        request.extensions["trace"] = lambda event, info: self.stats.traced(event)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    def connections(self):
+        return _pool_connections(self.transport)
+
+    def close(self):
+        self.transport.close()
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of LimitedTransport with one connection pool per event loop
+
+    Connections can't move between event loops, and the process has several:
+    the HTTP service's, the embedding scheduler's background loop and one per
+    asyncio.run in the CLI tools. So each running loop gets its own pool and
+    per-host slots; pools of finished loops are dropped with the loop.
+    """
+
+    def __init__(self, settings, stats):
+        self.settings = settings
+        self.stats = stats
+        self._loops = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._loops:
+                self._loops[loop] = (httpx.AsyncHTTPTransport(**_transport_options(self.settings)), {})
+            return self._loops[loop]
+
+    async def handle_async_request(self, request):
+        transport, hosts = self._loop_state()
+        key, limit = _host_budget(request.url, self.settings)
+        if key not in hosts:
+            hosts[key] = asyncio.Semaphore(limit)
+        slots = hosts[key]
+        waited = slots.locked()
+        await slots.acquire()
+        self.stats.started(waited)
+
+        def release():
+            self.stats.finished()
+            slots.release()
+        release = _once(release)
+
+        async def trace(event, info):
+            self.stats.traced(event)
+        request.extensions["trace"] = trace
+        try:
+            response = await transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_AsyncReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    def connections(self):
+        with self._lock:
+            transports = [transport for loop, (transport, _) in self._loops.items() if not loop.is_closed()]
+        counts = [_pool_connections(transport) for transport in transports]
+        return sum(open_ for open_, _ in counts), sum(idle for _, idle in counts)
+
+    async def aclose(self):
+        transport, _ = self._loop_state()
+        await transport.aclose()
+
+_settings = None
+_stats = PoolStats()
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _shared(kind):
+    global _settings
+    with _clients_lock:
+        if kind not in _clients:
+            _settings = _settings or http_settings_from_env()
+            if kind == "sync":
+                _clients[kind] = httpx.Client(
+                    transport=LimitedTransport(_settings, _stats), timeout=DEFAULT_TIMEOUT, follow_redirects=True
+                )
+            else:
+                _clients[kind] = httpx.AsyncClient(
+                    transport=AsyncLimitedTransport(_settings, _stats), timeout=DEFAULT_TIMEOUT, follow_redirects=True
+                )
+        return _clients[kind]
+
+def shared_http_client():
+    """The process-wide httpx.Client every provider SDK client is built on"""
+    return _shared("sync")
+
+def shared_async_http_client():
+    """The process-wide httpx.AsyncClient every provider SDK client is built on"""
+    return _shared("async")
+
+def http_pool_stats():
+    """Request counts, open and idle connections and limits of the shared clients"""
+    open_connections = idle_connections = 0
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        open_, idle = client._transport.connections()
+        open_connections += open_
+        idle_connections += idle
+    settings = _settings or http_settings_from_env()
+    return {
+        "requests": _stats.requests,
+        "in_flight": _stats.in_flight,
+        "peak_in_flight": _stats.peak_in_flight,
+        "host_waits": _stats.host_waits,
+        "connections_opened": _stats.connections_opened,
+        "tls_handshakes": _stats.tls_handshakes,
+        "open_connections": open_connections,
+        "idle_connections": idle_connections,
+        "utilization": (open_connections - idle_connections) / settings["max_connections"],
+        "max_connections": settings["max_connections"],
+        "max_per_host": settings["max_per_host"],
+        "max_embeddings_per_host": settings["max_embeddings_per_host"],
+        "http2": settings["http2"],
+    }
+
+def format_http_stats(stats):
+    """Plain-text pool summary for the CLI"""
+    return "\n".join([
+        f"Requests: {stats['requests']} ({stats['in_flight']} in flight, peak {stats['peak_in_flight']})",
+        f"Connections opened: {stats['connections_opened']} ({stats['tls_handshakes']} TLS handshake(s))",
+        f"Open connections: {stats['open_connections']} of {stats['max_connections']} "
+        f"({stats['idle_connections']} idle, {stats['utilization']:.0%} busy)",
+        f"Waits for a per-host slot: {stats['host_waits']} "
+        f"(limit {stats['max_per_host']} per host, {stats['max_embeddings_per_host']} for embeddings)",
+        f"HTTP/2: {'on' if stats['http2'] else 'off'}",
+    ])
+
+def _response_vectors(response):
+    if not isinstance(response, dict):
+        response = response.model_dump()
+    return [item["embedding"] for item in response["data"]]
+
+@functools.lru_cache(maxsize=None)
+def batched_embeddings_class():
+    """BatchedOpenAIEmbeddings, defined on first use so langchain_openai is imported with the first client"""
+    from langchain_openai import OpenAIEmbeddings
+
+    class BatchedOpenAIEmbeddings(OpenAIEmbeddings):
+        """OpenAIEmbeddings that keeps sending chunk_size texts per request with check_embedding_ctx_length off
+
+        OpenAIEmbeddings itself falls back to one request per text then.
+        """
+
+        def _request_params(self):
+            params = {"model": self.model, **self.model_kwargs}
+            if self.dimensions is not None:
+                params["dimensions"] = self.dimensions
+            return params
+
+        def embed_documents(self, texts, chunk_size=0):
+            if self.check_embedding_ctx_length:
+                return super().embed_documents(texts, chunk_size)
+            size = chunk_size or self.chunk_size
+            vectors = []
+            for start in range(0, len(texts), size):
+                response = self.client.create(input=texts[start:start + size], **self._request_params())
+                vectors.extend(_response_vectors(response))
+            return vectors
+
+        async def aembed_documents(self, texts, chunk_size=0):
+            if self.check_embedding_ctx_length:
+                return await super().aembed_documents(texts, chunk_size)
+            size = chunk_size or self.chunk_size
+            vectors = []
+            for start in range(0, len(texts), size):
+                response = await self.async_client.create(input=texts[start:start + size], **self._request_params())
+                vectors.extend(_response_vectors(response))
+            return vectors
+
+    return BatchedOpenAIEmbeddings
+
+def openai_embeddings(**kwargs):
+    """OpenAI embeddings client on the shared connection pool; kwargs go to OpenAIEmbeddings"""
+    from context_packing import token_encoding
+    embeddings = batched_embeddings_class()(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=shared_http_client(),
+        http_async_client=shared_async_http_client(),
+        **kwargs,
+    )
+    if token_encoding(embeddings.model) is None:
+        # The context-length check tokenizes with tiktoken; without its encoding texts
+        # are sent as they are (chunks are far below the limit anyway)
+        embeddings.check_embedding_ctx_length = False
+    return embeddings
@@ -1,10 +1,14 @@
 """
 Document indexing script for AI Agent Resell Guide Chatbot
-Processes documents in the docs folder and creates a ChromaDB vector store
+Processes documents in the docs folder and creates a ChromaDB vector store,
+or a memory-mapped one with VECTOR_BACKEND=mmap
 """
 
 import os
 import glob
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 from langchain.document_loaders import (
     TextLoader,
@@ -14,63 +18,219 @@ from langchain.document_loaders import (
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
+from http_clients import openai_embeddings, http_pool_stats
+from embedding_cache import cache_embeddings
+from embedding_scheduler import EmbeddingScheduler
+from bm25_index import BM25Index
+from index_snapshots import LEGACY_VERSION, SnapshotBuild, close_vectorstore, collect_garbage, current_path
+from metadata_index import METADATA_FILENAME, MetadataIndex, annotate_chunks, partner_names_from_env
+from mmap_store import MmapVectorStore, mmap_store_from_env, vector_backend
+from ivf_index import IVFIndex, update_ivf
 
 # Load environment variables
 load_dotenv()
 
-def load_documents(docs_path):
-    """Load documents from the specified path"""
-    documents = []
-    
-    # Supported file extensions
-    supported_extensions = {
-        '.txt': TextLoader,
-        '.pdf': PyPDFLoader,
-        '.docx': Docx2txtLoader,
-    }
-    
-    # Find all files in the docs directory
-    for file_path in glob.glob(os.path.join(docs_path, "**/*"), recursive=True):
+# Supported file extensions
+SUPPORTED_EXTENSIONS = {
+    '.txt': TextLoader,
+    '.pdf': PyPDFLoader,
+    '.docx': Docx2txtLoader,
+}
+
+# Separators tried in order by the text splitter
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# Manifest of indexed files, stored inside the vector store directory
+MANIFEST_FILENAME = "index_manifest.json"
+# Version 2 chunks carry title, doc_type, partner folder, modified and section metadata
+MANIFEST_VERSION = 2
+
+# Manifests written before the mmap backend existed describe Chroma indexes
+DEFAULT_BACKEND = "chroma"
+
+# With ANN_INDEX=auto, mmap indexes at least this large get an IVF index
+DEFAULT_ANN_MIN_ROWS = 20000
+
+def find_documents(docs_path):
+    """Return the supported files under docs_path, keyed by their path relative to it"""
+    files = {}
+    for file_path in sorted(glob.glob(os.path.join(docs_path, "**/*"), recursive=True)):
         if os.path.isfile(file_path):
             file_ext = os.path.splitext(file_path)[1].lower()
-            
-            if file_ext in supported_extensions:
-                try:
-                    print(f"Loading: {file_path}")
-                    loader_class = supported_extensions[file_ext]
-                    loader = loader_class(file_path)
-                    documents.extend(loader.load())
-                except Exception as e:
-                    print(f"Error loading {file_path}: {e}")
+            if file_ext in SUPPORTED_EXTENSIONS:
+                files[os.path.relpath(file_path, docs_path)] = file_path
             else:
                 print(f"Skipping unsupported file: {file_path}")
+    return files
+
+def load_file(file_path):
+    """Load a single document file with the loader for its extension"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    loader_class = SUPPORTED_EXTENSIONS[file_ext]
+    return loader_class(file_path).load()
+
+def _load_file_in_worker(file_path):
+    """Process pool entry point: load a file and report errors as text"""
+    try:
+        return load_file(file_path), None
+    except Exception as e:
+        return None, str(e)
+
+def iter_loaded_files(file_paths, workers=1):
+    """Yield (file_path, documents, error) as files finish loading
+
+    With more than one worker, files are parsed in a process pool and at most
+    two files per worker are in flight, so parsed pages never pile up in memory
+    faster than the caller consumes them.
+    """
+    if workers <= 1:
+        for file_path in file_paths:
+            print(f"Loading: {file_path}")
+            yield (file_path, *_load_file_in_worker(file_path))
+        return
+    
+    pending_paths = iter(file_paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        
+        def submit_next():
+            for file_path in pending_paths:
+                print(f"Loading: {file_path}")
+                in_flight[executor.submit(_load_file_in_worker, file_path)] = file_path
+                return
+        
+        for _ in range(workers * 2):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path = in_flight.pop(future)
+                submit_next()
+                yield (file_path, *future.result())
+
+def load_documents(docs_path):
+    """Load documents from the specified path"""
+    documents = []
+    
+    for file_path in find_documents(docs_path).values():
+        try:
+            print(f"Loading: {file_path}")
+            documents.extend(load_file(file_path))
+        except Exception as e:
+            print(f"Error loading {file_path}: {e}")
     
     return documents
 
-def split_documents(documents, chunk_size=1000, chunk_overlap=200):
+def hash_file(file_path):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_ids_for(rel_path, file_hash, count):
+    """Build stable vector store IDs for the chunks of one file version"""
+    path_key = hashlib.sha1(rel_path.encode("utf-8")).hexdigest()[:8]
+    return [f"{path_key}-{file_hash[:12]}-{i}" for i in range(count)]
+
+def manifest_path(persist_directory):
+    """Return the manifest location for a vector store directory"""
+    return os.path.join(persist_directory, MANIFEST_FILENAME)
+
+def load_manifest(persist_directory):
+    """Load the index manifest, or None if the index has none yet"""
+    path = manifest_path(persist_directory)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(persist_directory, manifest):
+    """Atomically write the index manifest"""
+    os.makedirs(persist_directory, exist_ok=True)
+    path = manifest_path(persist_directory)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def new_manifest(chunk_size, chunk_overlap, backend=DEFAULT_BACKEND):
+    """Return an empty manifest for the given splitter settings and vector store backend"""
+    return {
+        "version": MANIFEST_VERSION,
+        "backend": backend,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "files": {},
+    }
+
+def plan_changes(files, manifest):
+    """Compare files on disk against the manifest
+
+    Returns a dict with 'added', 'updated', 'unchanged' and 'removed' lists of
+    relative paths, plus 'hashes' mapping every file on disk to its content hash.
+    """
+    indexed = manifest["files"]
+    plan = {"added": [], "updated": [], "unchanged": [], "removed": [], "hashes": {}}
+    for rel_path, file_path in files.items():
+        file_hash = hash_file(file_path)
+        plan["hashes"][rel_path] = file_hash
+        if rel_path not in indexed:
+            plan["added"].append(rel_path)
+        elif indexed[rel_path]["hash"] != file_hash:
+            plan["updated"].append(rel_path)
+        else:
+            plan["unchanged"].append(rel_path)
+    plan["removed"] = sorted(set(indexed) - set(files))
+    return plan
+
+def split_documents(documents, chunk_size=1000, chunk_overlap=200, separators=None):
     """Split documents into chunks"""
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
-        separators=["\n\n", "\n", " ", ""]
+        separators=separators or DEFAULT_SEPARATORS,
+        add_start_index=True
     )
     
     return text_splitter.split_documents(documents)
 
-def create_vectorstore(chunks, persist_directory="rag_index"):
-    """Create and persist the vector store"""
+def get_embeddings():
+    """Create the embeddings client used for indexing"""
     # Check if OpenAI API key is available
     if not os.getenv("OPENAI_API_KEY"):
         raise ValueError("OPENAI_API_KEY is required for creating embeddings")
     
-    embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
+    embeddings = cache_embeddings(openai_embeddings())
+    # Cache misses go through the rate-limited scheduler, which checkpoints
+    # every finished batch into the cache
+    embeddings.embeddings = EmbeddingScheduler.from_env(
+        embeddings.embeddings, checkpoint=embeddings.cache
+    )
+    return embeddings
+
+def create_vectorstore(chunks, persist_directory="rag_index", ids=None, embeddings=None, backend=None):
+    """Create and persist the vector store
+
+    `backend` is "chroma" or "mmap"; by default VECTOR_BACKEND decides.
+    """
+    embeddings = embeddings or get_embeddings()
+    
+    if (backend or vector_backend(persist_directory)) == "mmap":
+        vectorstore = mmap_store_from_env(persist_directory, embeddings)
+        vectorstore.add_documents(chunks, ids=ids)
+        return vectorstore
     
     # Create vector store
     vectorstore = Chroma.from_documents(
         documents=chunks,
         embedding=embeddings,
+        ids=ids,
         persist_directory=persist_directory
     )
     
@@ -79,6 +239,212 @@ def create_vectorstore(chunks, persist_directory="rag_index"):
     
     return vectorstore
 
+def open_vectorstore(persist_directory="rag_index", embeddings=None, backend=None):
+    """Open the persisted vector store for incremental updates"""
+    if (backend or vector_backend(persist_directory)) == "mmap":
+        return mmap_store_from_env(persist_directory, embeddings or get_embeddings())
+    return Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embeddings or get_embeddings()
+    )
+
+def update_index(docs_path, persist_directory="rag_index", chunk_size=1000, chunk_overlap=200,
+                 workers=1, batch_size=256, embeddings=None, backend=None):
+    """Incrementally bring the vector store in line with the docs folder
+
+    Only new or changed files are loaded, split and embedded; chunks belonging to
+    changed or removed files are deleted by the IDs recorded in the manifest.
+    Files are loaded by `workers` processes and streamed through the splitter
+    into upserts of about `batch_size` chunks.
+    `embeddings` defaults to the cached, rate-limited OpenAI client and
+    `backend` to VECTOR_BACKEND; switching backends rebuilds the index.
+    Returns (vectorstore, summary), where vectorstore is None if nothing is indexed.
+    """
+    files = find_documents(docs_path)
+    backend = backend or vector_backend(persist_directory)
+    manifest = load_manifest(persist_directory)
+    rebuild = (
+        manifest is None
+        or manifest.get("chunk_size") != chunk_size
+        or manifest.get("chunk_overlap") != chunk_overlap
+        or manifest.get("backend", DEFAULT_BACKEND) != backend
+    )
+    if rebuild:
+        manifest = new_manifest(chunk_size, chunk_overlap, backend)
+    
+    plan = plan_changes(files, manifest)
+    summary = {
+        "added": 0,
+        "updated": 0,
+        "skipped": len(plan["unchanged"]),
+        "deleted": len(plan["removed"]),
+        "failed": 0,
+        "chunks_added": 0,
+        "chunks_deleted": 0,
+    }
+    
+    if not os.path.exists(persist_directory) and not files:
+        return None, summary
+    
+    if embeddings is None:
+        embeddings = get_embeddings()
+    vectorstore = open_vectorstore(persist_directory, embeddings, backend)
+    if rebuild:
+        # Chunks from an index without a usable manifest can't be matched to
+        # files, so start from an empty collection.
+        print("♻️  No matching index manifest found, rebuilding the full index")
+        vectorstore.delete_collection()
+        vectorstore = open_vectorstore(persist_directory, embeddings, backend)
+    
+    # Drop chunks of removed files
+    for rel_path in plan["removed"]:
+        stale_ids = manifest["files"].pop(rel_path)["chunk_ids"]
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+        summary["chunks_deleted"] += len(stale_ids)
+        print(f"🗑️  Removed: {rel_path}")
+    save_manifest(persist_directory, manifest)
+    
+    # Re-index new and changed files. Chunks are upserted in batches, and a
+    # file is recorded in the manifest only once all of its chunks are stored,
+    # so an interrupted run picks up where it stopped.
+    status_of = {rel_path: status for status in ("added", "updated") for rel_path in plan[status]}
+    rel_path_of = {files[rel_path]: rel_path for rel_path in status_of}
+    pending = []
+    
+    def flush():
+        for rel_path, chunks, chunk_ids in pending:
+            old_entry = manifest["files"].get(rel_path)
+            if old_entry and old_entry["chunk_ids"]:
+                vectorstore.delete(ids=old_entry["chunk_ids"])
+                summary["chunks_deleted"] += len(old_entry["chunk_ids"])
+        batch_chunks = [chunk for _, chunks, _ in pending for chunk in chunks]
+        batch_ids = [chunk_id for _, _, chunk_ids in pending for chunk_id in chunk_ids]
+        for start in range(0, len(batch_chunks), batch_size):
+            vectorstore.add_documents(
+                batch_chunks[start:start + batch_size],
+                ids=batch_ids[start:start + batch_size]
+            )
+        for rel_path, chunks, chunk_ids in pending:
+            manifest["files"][rel_path] = {"hash": plan["hashes"][rel_path], "chunk_ids": chunk_ids}
+            summary[status_of[rel_path]] += 1
+            summary["chunks_added"] += len(chunks)
+        save_manifest(persist_directory, manifest)
+        pending.clear()
+    
+    for file_path, documents, error in iter_loaded_files(list(rel_path_of), workers):
+        if error is not None:
+            print(f"Error loading {file_path}: {error}")
+            summary["failed"] += 1
+            continue
+        
+        rel_path = rel_path_of[file_path]
+        chunks = annotate_chunks(split_documents(documents, chunk_size, chunk_overlap), documents, docs_path)
+        chunk_ids = chunk_ids_for(rel_path, plan["hashes"][rel_path], len(chunks))
+        for chunk_id, chunk in zip(chunk_ids, chunks):
+            chunk.metadata["chunk_id"] = chunk_id
+        
+        pending.append((rel_path, chunks, chunk_ids))
+        if sum(len(chunks) for _, chunks, _ in pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    
+    vectorstore.persist()
+    
+    if hasattr(embeddings, "stats"):
+        cache_stats = embeddings.stats()
+        summary["embedding_cache_hits"] = cache_stats["hits"]
+        summary["embedding_cache_misses"] = cache_stats["misses"]
+    http_stats = http_pool_stats()
+    if http_stats["requests"]:
+        summary["http_requests"] = http_stats["requests"]
+        summary["http_connections_opened"] = http_stats["connections_opened"]
+    return vectorstore, summary
+
+def iter_stored_chunks(vectorstore, page_size=5000):
+    """Yield (chunk_id, text) for every chunk in the vector store, a page at a time"""
+    offset = 0
+    while True:
+        page = vectorstore.get(limit=page_size, offset=offset, include=["documents"])
+        if not page["ids"]:
+            return
+        yield from zip(page["ids"], page["documents"])
+        offset += len(page["ids"])
+
+def iter_stored_metadata(vectorstore, page_size=5000):
+    """Yield (chunk_id, text, metadata) for every chunk in the vector store, a page at a time"""
+    offset = 0
+    while True:
+        page = vectorstore.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            return
+        yield from zip(page["ids"], page["documents"], (metadata or {} for metadata in page["metadatas"]))
+        offset += len(page["ids"])
+
+def update_keyword_index(vectorstore, persist_directory, summary):
+    """Rebuild the BM25 index when the vector store changed or it is missing"""
+    changed = summary["added"] or summary["updated"] or summary["deleted"]
+    if not changed and BM25Index.load(persist_directory) is not None:
+        return None
+    bm25 = BM25Index.build(iter_stored_chunks(vectorstore))
+    bm25.save(persist_directory)
+    return bm25
+
+def update_metadata_index(vectorstore, persist_directory, summary):
+    """Rebuild the metadata side tables when the vector store or PARTNER_NAMES changed, or they are missing"""
+    changed = summary["added"] or summary["updated"] or summary["deleted"]
+    partner_names = partner_names_from_env()
+    metadata_index = MetadataIndex(os.path.join(persist_directory, METADATA_FILENAME))
+    if not changed and metadata_index.partner_names == partner_names:
+        metadata_index.close()
+        return None
+    metadata_index.replace(iter_stored_metadata(vectorstore), partner_names)
+    return metadata_index
+
+def ann_index_wanted(vectorstore):
+    """Whether the vector store should have an IVF index, per ANN_INDEX (auto, true or false)"""
+    if not isinstance(vectorstore, MmapVectorStore):
+        # Chroma keeps its own HNSW index
+        return False
+    setting = os.getenv("ANN_INDEX", "auto").lower()
+    if setting == "auto":
+        return len(vectorstore) >= int(os.getenv("ANN_MIN_ROWS", DEFAULT_ANN_MIN_ROWS))
+    return setting in ("1", "true", "yes")
+
+def update_ann_index(vectorstore, persist_directory, summary):
+    """Train or extend the IVF index of an mmap store, or remove one no longer wanted"""
+    if not ann_index_wanted(vectorstore):
+        IVFIndex.remove(persist_directory)
+        return None
+    changed = summary["added"] or summary["updated"] or summary["deleted"]
+    lists = int(os.getenv("IVF_LISTS", 0)) or None
+    existing = IVFIndex.load(persist_directory)
+    if not changed and existing is not None and (lists is None or lists == existing.lists):
+        return None
+    return update_ivf(vectorstore, lists)
+
+def print_summary(summary):
+    """Print what an indexing run changed"""
+    print("\n📊 Indexing summary:")
+    print(f"  • Added:   {summary['added']} file(s)")
+    print(f"  • Updated: {summary['updated']} file(s)")
+    print(f"  • Skipped: {summary['skipped']} unchanged file(s)")
+    print(f"  • Deleted: {summary['deleted']} file(s)")
+    if summary["failed"]:
+        print(f"  • Failed:  {summary['failed']} file(s)")
+    print(f"  • Chunks:  +{summary['chunks_added']} / -{summary['chunks_deleted']}")
+    if "embedding_cache_hits" in summary:
+        print(
+            f"  • Embedding cache: {summary['embedding_cache_hits']} hit(s), "
+            f"{summary['embedding_cache_misses']} miss(es)"
+        )
+    if "http_requests" in summary:
+        print(
+            f"  • HTTP: {summary['http_requests']} request(s) over "
+            f"{summary['http_connections_opened']} new connection(s)"
+        )
+
 def main():
     """Main function to index documents"""
     print("🤖 AI Agent Resell Guide - Document Indexing")
@@ -89,6 +455,8 @@ def main():
     rag_index_path = "rag_index"
     chunk_size = int(os.getenv("CHUNK_SIZE", 1000))
     chunk_overlap = int(os.getenv("CHUNK_OVERLAP", 200))
+    workers = int(os.getenv("LOADER_WORKERS", os.cpu_count() or 1))
+    batch_size = int(os.getenv("INDEX_BATCH_SIZE", 256))
     
     # Check if docs directory exists
     if not os.path.exists(docs_path):
@@ -96,42 +464,74 @@ def main():
         print("Please create the docs directory and add your documents.")
         return
     
-    # Load documents
-    print(f"📚 Loading documents from: {docs_path}")
-    documents = load_documents(docs_path)
+    # Index new and changed documents
+    print(f"📚 Indexing documents from: {docs_path}")
+    print(f"✂️  Splitting documents (chunk_size={chunk_size}, overlap={chunk_overlap})")
+    print(f"⚙️  Loader workers: {workers}, upsert batch size: {batch_size}")
+    # Running apps keep serving the published snapshot while a copy of it is updated
+    build = SnapshotBuild(rag_index_path)
+    print(f"🔍 Updating {vector_backend(build.path)} vector store in snapshot: {build.path}")
+    try:
+        vectorstore, summary = update_index(
+            docs_path, build.path, chunk_size, chunk_overlap,
+            workers=workers, batch_size=batch_size
+        )
+    except Exception as e:
+        build.discard()
+        print(f"❌ Error creating vector store: {e}")
+        return
+    
+    print_summary(summary)
     
-    if not documents:
+    if vectorstore is None:
+        build.discard()
         print("❌ No documents found to index")
         return
     
-    print(f"✅ Loaded {len(documents)} documents")
+    # Keyword index for hybrid retrieval
+    bm25 = update_keyword_index(vectorstore, build.path, summary)
+    if bm25 is not None:
+        print(f"🔤 Rebuilt BM25 keyword index: {len(bm25)} chunks, {len(bm25.terms)} terms")
     
-    # Split documents into chunks
-    print(f"✂️  Splitting documents (chunk_size={chunk_size}, overlap={chunk_overlap})")
-    chunks = split_documents(documents, chunk_size, chunk_overlap)
-    print(f"✅ Created {len(chunks)} chunks")
+    # Partner, document type and section filters
+    metadata_index = update_metadata_index(vectorstore, build.path, summary)
+    if metadata_index is not None:
+        print(
+            f"🏷️  Rebuilt metadata index: {len(metadata_index)} chunks, "
+            f"{len(metadata_index.values('title'))} documents, {len(metadata_index.values('partner'))} partner(s)"
+        )
+        metadata_index.close()
     
-    # Create vector store
-    print(f"🔍 Creating vector store in: {rag_index_path}")
-    try:
-        vectorstore = create_vectorstore(chunks, rag_index_path)
-        print("✅ Vector store created successfully!")
-        
-        # Test the vector store
-        print("🧪 Testing vector store...")
-        test_query = "pricing guidelines"
-        results = vectorstore.similarity_search(test_query, k=1)
-        if results:
-            print(f"✅ Test query successful: Found {len(results)} results")
-        else:
-            print("⚠️  Test query returned no results")
-            
-    except Exception as e:
-        print(f"❌ Error creating vector store: {e}")
-        return
+    # Approximate nearest neighbour index for large mmap stores
+    ivf = update_ann_index(vectorstore, build.path, summary)
+    if ivf is not None:
+        print(f"🧭 Updated IVF index: {ivf.rows} rows in {ivf.lists} lists")
+    
+    # Test the vector store
+    print("🧪 Testing vector store...")
+    test_query = "pricing guidelines"
+    results = vectorstore.similarity_search(test_query, k=1)
+    if results:
+        print(f"✅ Test query successful: Found {len(results)} results")
+    else:
+        print("⚠️  Test query returned no results")
+    close_vectorstore(vectorstore)
+    
+    # Publish the snapshot; unchanged indexes are not republished
+    changed = summary["added"] or summary["updated"] or summary["deleted"]
+    rebuilt = bm25 is not None or metadata_index is not None or ivf is not None
+    if changed or rebuilt or build.previous is None or build.previous[0] == LEGACY_VERSION:
+        build.publish()
+        print(f"📌 Published index snapshot {build.version}; running apps switch to it on their next question")
+    else:
+        build.discard()
+        print(f"📌 Nothing changed; still serving index snapshot {build.previous[0]}")
+    removed = collect_garbage(rag_index_path)
+    if removed:
+        print(f"🧹 Removed {len(removed)} unused snapshot(s): {', '.join(removed)}")
     
     print("\n🎉 Document indexing completed successfully!")
-    print(f"📁 Vector store saved to: {rag_index_path}")
+    print(f"📁 Vector store saved to: {current_path(rag_index_path)}")
     print("\nYou can now run the chatbot:")
     print("  • Web interface: streamlit run streamlit_app.py")
     print("  • CLI interface: python main.py")
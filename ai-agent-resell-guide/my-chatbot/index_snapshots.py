@@ -0,0 +1,405 @@
+"""
+Versioned index snapshots for Zendesk ISV Resell Assistant
+The indexer builds every update into a new directory under
+rag_index/snapshots and publishes it by atomically replacing the
+rag_index/CURRENT pointer. Running apps notice the new pointer between
+requests and swap to the new snapshot, while questions already in flight
+finish on the old one. Snapshots nobody serves any more are deleted once a
+grace period has passed
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import atexit
+import asyncio
+import logging
+import threading
+from mmap_store import MMAP_DIRNAME
+
+try:
+    import fcntl
+except ImportError:
+    # No build lock (Windows), so snapshots never share files
+    fcntl = None
+
+SNAPSHOTS_DIRNAME = "snapshots"
+LEASES_DIRNAME = "leases"
+CURRENT_FILENAME = "CURRENT"
+SUPERSEDED_FILENAME = ".superseded"
+BUILD_LOCK_FILENAME = "BUILD.lock"
+# The version name of an index written straight into rag_index before snapshots existed
+LEGACY_VERSION = "legacy"
+LAYOUT_NAMES = (
+    SNAPSHOTS_DIRNAME, LEASES_DIRNAME, CURRENT_FILENAME, CURRENT_FILENAME + ".tmp", SUPERSEDED_FILENAME,
+    BUILD_LOCK_FILENAME,
+)
+
+# Snapshot subdirectories whose files are shared with the previous snapshot through hard
+# links instead of copied. The mmap store never changes a committed byte: data files only
+# grow past the length index.json commits, and index.json is replaced through a temporary
+# file, so the old snapshot's files (and its readers' memory maps) stay as they were.
+# Two builds appending to the same shared file would overwrite each other, so builds
+# take BUILD.lock first. Chroma, SQLite, BM25 and IVF files are rewritten in place and
+# are always copied.
+LINKED_DIRNAMES = (MMAP_DIRNAME,)
+
+# Leases from other hosts can't be checked by PID, so they count until this old
+REMOTE_LEASE_SECONDS = 24 * 3600
+LEASE_REFRESH_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+def grace_seconds_from_env():
+    """Seconds a superseded snapshot is kept for questions still using it (INDEX_SNAPSHOT_GRACE_SECONDS)"""
+    return float(os.getenv("INDEX_SNAPSHOT_GRACE_SECONDS", 300))
+
+def snapshot_path(root, version):
+    return root if version == LEGACY_VERSION else os.path.join(root, SNAPSHOTS_DIRNAME, version)
+
+def _legacy_entries(root):
+    """Index files written directly into root by older versions of the indexer"""
+    try:
+        return [name for name in os.listdir(root) if name not in LAYOUT_NAMES]
+    except OSError:
+        return []
+
+def current_snapshot(root):
+    """(version, path) of the published index, or None when there is none yet"""
+    try:
+        with open(os.path.join(root, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        version = LEGACY_VERSION if _legacy_entries(root) else None
+    return (version, snapshot_path(root, version)) if version else None
+
+def current_path(root):
+    """Directory of the published index, or root itself when nothing is published yet"""
+    current = current_snapshot(root)
+    return current[1] if current else root
+
+def _pointer_stat(root):
+    """Changes whenever CURRENT is replaced"""
+    try:
+        stat = os.stat(os.path.join(root, CURRENT_FILENAME))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def close_vectorstore(vectorstore):
+    """Release a vector store's open files and memory
+
+    Chroma keeps one system per directory in a process-wide cache until it is
+    stopped, so a swapped-out snapshot would otherwise stay loaded.
+    """
+    client = getattr(vectorstore, "_client", None)
+    identifier = getattr(client, "_identifier", None)
+    if identifier is None:
+        return
+    system = type(client)._identifier_to_system.pop(identifier, None)
+    if system is not None:
+        system.stop()
+
+class SnapshotLease:
+    """A file under rag_index/leases naming the snapshot versions this process uses
+
+    Garbage collection never deletes a leased snapshot while the process that
+    holds the lease is alive. The file is removed when the process exits.
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(
+            root, LEASES_DIRNAME, f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        )
+        self.versions = []
+        self._refreshed = 0.0
+        atexit.register(self.release)
+
+    def hold(self, versions):
+        """Replace the leased versions"""
+        self.versions = list(versions)
+        self._refreshed = time.time()
+        lease = {"host": socket.gethostname(), "pid": os.getpid(), "versions": self.versions}
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(lease, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # A read-only index (e.g. baked into an image) is never re-indexed in place
+            logger.warning("Could not write index lease %s: %s", self.path, e)
+
+    def refresh(self):
+        """Touch the lease now and then, so leases on other hosts don't go stale"""
+        if self.versions and time.time() - self._refreshed > LEASE_REFRESH_SECONDS:
+            try:
+                os.utime(self.path)
+                self._refreshed = time.time()
+            except OSError:
+                self.hold(self.versions)
+
+    def release(self):
+        self.versions = []
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def leased_versions(root):
+    """Versions held by leases of live processes; leases of dead processes are removed"""
+    directory = os.path.join(root, LEASES_DIRNAME)
+    versions = set()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return versions
+    hostname = socket.gethostname()
+    for name in names:
+        path = os.path.join(directory, name)
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lease = json.load(f)
+            modified = os.path.getmtime(path)
+        except (OSError, ValueError):
+            continue
+        if lease.get("host") == hostname:
+            alive = _process_alive(lease.get("pid", 0))
+        else:
+            alive = time.time() - modified < REMOTE_LEASE_SECONDS
+        if alive:
+            versions.update(lease.get("versions", []))
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return versions
+
+class SnapshotBuild:
+    """A snapshot being built: a leased copy of the published index to update and publish
+
+    Only one build runs at a time per index; a second one waits for the
+    first to be published or discarded.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._build_lock = self._lock_builds()
+        # Named after the lock is held, so versions sort in publishing order
+        self.version = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self.path = snapshot_path(root, self.version)
+        self.previous = current_snapshot(root)
+        # Leased before the directory exists, so garbage collection never sees it unleased
+        self.lease = SnapshotLease(root)
+        self.lease.hold([self.version])
+        if self.previous is not None:
+            shutil.copytree(
+                self.previous[1], self.path,
+                ignore=lambda directory, names: [
+                    name for name in names if directory == self.previous[1] and name in LAYOUT_NAMES
+                ],
+                copy_function=self._copy_file,
+            )
+        else:
+            os.makedirs(self.path)
+
+    def _lock_builds(self):
+        """Hold BUILD.lock until publish or discard (the OS drops it if the process dies)"""
+        if fcntl is None:
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        lock_file = open(os.path.join(self.root, BUILD_LOCK_FILENAME), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logger.warning("Waiting for another indexing run on %s to finish", self.root)
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _unlock_builds(self):
+        if self._build_lock is not None:
+            self._build_lock.close()
+            self._build_lock = None
+
+    def _copy_file(self, source, destination):
+        """Hard-link files under LINKED_DIRNAMES (copying where links aren't supported), copy the rest"""
+        linked = [os.path.join(self.previous[1], name) for name in LINKED_DIRNAMES]
+        if self._build_lock is not None and os.path.dirname(source) in linked:
+            try:
+                os.link(source, destination)
+                return destination
+            except OSError:
+                pass
+        return shutil.copy2(source, destination)
+
+    def publish(self):
+        """Point CURRENT at this snapshot; readers swap to it on their next request"""
+        tmp_path = os.path.join(self.root, CURRENT_FILENAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.version)
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILENAME))
+        if self.previous is not None:
+            with open(os.path.join(self.previous[1], SUPERSEDED_FILENAME), "w", encoding="utf-8") as f:
+                f.write(str(time.time()))
+        self.lease.release()
+        self._unlock_builds()
+
+    def discard(self):
+        """Delete the snapshot without publishing it"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.lease.release()
+        self._unlock_builds()
+
+def _superseded_at(path):
+    try:
+        with open(os.path.join(path, SUPERSEDED_FILENAME), "r", encoding="utf-8") as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        # Never published (e.g. an interrupted build): age from the directory itself
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+def collect_garbage(root, grace_seconds=None):
+    """Delete snapshots that are neither published nor leased and were superseded over grace_seconds ago
+
+    Returns the deleted versions. An index left in root by older versions of
+    the indexer is deleted the same way once a snapshot replaced it.
+    """
+    grace_seconds = grace_seconds_from_env() if grace_seconds is None else grace_seconds
+    current = current_snapshot(root)
+    if current is None or current[0] == LEGACY_VERSION:
+        return []
+    keep = leased_versions(root) | {current[0]}
+    cutoff = time.time() - grace_seconds
+    removed = []
+    directory = os.path.join(root, SNAPSHOTS_DIRNAME)
+    for version in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        path = snapshot_path(root, version)
+        if version not in keep and _superseded_at(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(version)
+    legacy = _legacy_entries(root)
+    if legacy and LEGACY_VERSION not in keep and _superseded_at(root) < cutoff:
+        for name in legacy:
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        os.remove(os.path.join(root, SUPERSEDED_FILENAME))
+        removed.append(LEGACY_VERSION)
+    return removed
+
+class OpenSnapshot:
+    """A published snapshot opened for serving"""
+
+    def __init__(self, version, path, vectorstore, retriever):
+        self.version = version
+        self.path = path
+        self.vectorstore = vectorstore
+        self.retriever = retriever
+
+class LiveIndex:
+    """The published snapshot of an index root, swapped for a newer one between requests
+
+    `open_snapshot(path)` returns (vectorstore, retriever) for a snapshot
+    directory. `current()` costs one stat() while nothing changes. When a new
+    snapshot is published, the first caller opens it while concurrent callers
+    keep getting the old one; the old one is closed after the grace period,
+    so questions already using it can finish.
+    """
+
+    def __init__(self, root, open_snapshot, grace_seconds=None):
+        self.root = root
+        self.open_snapshot = open_snapshot
+        self.grace_seconds = grace_seconds_from_env() if grace_seconds is None else grace_seconds
+        self.swaps = 0
+        self._snapshot = None
+        self._pointer = None
+        self._retired = []
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._lease = SnapshotLease(root)
+
+    def exists(self):
+        return current_snapshot(self.root) is not None
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot is not None else None
+
+    def current(self):
+        """The open snapshot, after swapping to a newly published one; None when there is no index"""
+        pointer = _pointer_stat(self.root)
+        snapshot = self._snapshot
+        if snapshot is not None and pointer == self._pointer:
+            self._lease.refresh()
+            self._close_retired()
+            return snapshot
+        if snapshot is None:
+            # Nothing to serve yet, so wait for whoever is opening the first snapshot
+            with self._open_lock:
+                return self._swap(pointer)
+        if not self._open_lock.acquire(blocking=False):
+            # Another request is opening the new snapshot; keep serving this one meanwhile
+            return snapshot
+        try:
+            return self._swap(pointer)
+        finally:
+            self._open_lock.release()
+
+    async def acurrent(self):
+        """current() for event loops: a new snapshot is opened on a worker thread"""
+        if self._snapshot is not None and _pointer_stat(self.root) == self._pointer:
+            return self.current()
+        return await asyncio.to_thread(self.current)
+
+    def _swap(self, pointer):
+        found = current_snapshot(self.root)
+        if found is None:
+            return self._snapshot
+        version, path = found
+        if self._snapshot is not None and version == self._snapshot.version:
+            self._pointer = pointer
+            return self._snapshot
+        # Lease the new version (and keep the old one) before opening anything
+        self._lease.hold([version] + ([self._snapshot.version] if self._snapshot is not None else []))
+        vectorstore, retriever = self.open_snapshot(path)
+        with self._lock:
+            previous = self._snapshot
+            self._snapshot = OpenSnapshot(version, path, vectorstore, retriever)
+            self._pointer = pointer
+            if previous is not None:
+                self._retired.append((time.monotonic(), previous))
+                self.swaps += 1
+        self._lease.hold([version] + [retired.version for _, retired in self._retired])
+        return self._snapshot
+
+    def _close_retired(self):
+        """Close swapped-out snapshots whose grace period is over and drop them from the lease"""
+        if not self._retired or time.monotonic() - self._retired[0][0] < self.grace_seconds:
+            return
+        with self._lock:
+            cutoff = time.monotonic() - self.grace_seconds
+            expired = [snapshot for retired_at, snapshot in self._retired if retired_at < cutoff]
+            self._retired = [(at, snapshot) for at, snapshot in self._retired if at >= cutoff]
+        for snapshot in expired:
+            close_vectorstore(snapshot.vectorstore)
+        self._lease.hold([self._snapshot.version] + [snapshot.version for _, snapshot in self._retired])
@@ -0,0 +1,170 @@
+"""
+IVF approximate nearest neighbour index for Zendesk ISV Resell Assistant
+Partitions the vectors of an mmap index into lists with spherical k-means. A
+query is scored against the list centroids and only the rows of the closest
+`probes` lists are searched, trading a little recall for much less scoring.
+Built and updated by index_documents.py in rag_index/ivf
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+
+IVF_DIRNAME = "ivf"
+IVF_VERSION = 1
+
+# Rows assigned to centroids per NumPy call
+ASSIGN_BLOCK_ROWS = 8192
+
+def default_lists(rows):
+    """About 4 * sqrt(rows) lists, the usual starting point for IVF"""
+    return max(1, min(rows, int(4 * np.sqrt(rows))))
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def assign(vectors, centroids, start=0):
+    """Nearest centroid (by cosine) of each row of vectors from `start` on"""
+    labels = np.empty(max(len(vectors) - start, 0), dtype=np.int32)
+    for offset in range(start, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = _normalize(np.asarray(vectors[offset:offset + ASSIGN_BLOCK_ROWS], dtype=np.float32))
+        labels[offset - start:offset - start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+def train_centroids(vectors, lists, iterations=10, sample_size=None, seed=0):
+    """Spherical k-means centroids from a random sample of the rows"""
+    rng = np.random.default_rng(seed)
+    lists = min(lists, len(vectors))
+    sample_size = min(len(vectors), sample_size or lists * 64)
+    sample = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+    data = _normalize(np.asarray(vectors[sample], dtype=np.float32))
+    centroids = data[rng.choice(len(data), lists, replace=False)]
+    for _ in range(iterations):
+        labels = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids = centroids.copy()
+        centroids[present] = _normalize(sums)
+        # Lists that lost every member restart from random rows
+        empty = np.setdiff1d(np.arange(lists), present)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids.astype(np.float32)
+
+class IVFIndex:
+    """Centroids plus the list each row of one mmap index generation belongs to
+
+    Rows appended after the index was last updated are not in any list; the
+    store scans them exactly until the indexer assigns them.
+    """
+
+    def __init__(self, centroids, assignments, generation, trained_rows):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.generation = generation
+        self.trained_rows = trained_rows
+        # Rows grouped by list, ascending within each list
+        self.list_rows = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.searchsorted(assignments[self.list_rows], np.arange(len(centroids) + 1))
+
+    @property
+    def rows(self):
+        return len(self.assignments)
+
+    @property
+    def lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors, lists, generation, iterations=10):
+        centroids = train_centroids(vectors, lists, iterations)
+        return cls(centroids, assign(vectors, centroids), generation, len(vectors))
+
+    def extend(self, vectors, generation):
+        """Assign rows appended since this index was built; every row when the store was compacted"""
+        if generation != self.generation:
+            return IVFIndex(self.centroids, assign(vectors, self.centroids), generation, self.trained_rows)
+        added = assign(vectors, self.centroids, start=self.rows)
+        return IVFIndex(self.centroids, np.concatenate([self.assignments, added]), generation, self.trained_rows)
+
+    def candidates(self, query, probes):
+        """Ascending rows in the `probes` lists whose centroids are closest to the query"""
+        probes = min(probes, self.lists)
+        scores = self.centroids @ query
+        nearest = np.argpartition(-scores, probes - 1)[:probes]
+        rows = np.concatenate([
+            self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in nearest
+        ])
+        return np.sort(rows)
+
+    def save(self, persist_directory):
+        """Write the index to <persist_directory>/ivf, replacing any previous one"""
+        directory = os.path.join(persist_directory, IVF_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "assignments.npy"), self.assignments)
+        meta = {
+            "version": IVF_VERSION,
+            "generation": self.generation,
+            "rows": self.rows,
+            "trained_rows": self.trained_rows,
+        }
+        # The metadata file is written last, so an interrupted first build never loads
+        tmp_path = os.path.join(directory, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, "meta.json"))
+
+    @classmethod
+    def load(cls, persist_directory):
+        """Load the index saved next to a vector store, or None if there is none"""
+        directory = os.path.join(persist_directory, IVF_DIRNAME)
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != IVF_VERSION:
+            return None
+        assignments = np.load(os.path.join(directory, "assignments.npy"))[:meta["rows"]]
+        return cls(
+            np.load(os.path.join(directory, "centroids.npy")),
+            assignments,
+            meta["generation"],
+            meta["trained_rows"],
+        )
+
+    @staticmethod
+    def remove(persist_directory):
+        shutil.rmtree(os.path.join(persist_directory, IVF_DIRNAME), ignore_errors=True)
+
+def update_ivf(store, lists=None, iterations=10):
+    """Bring the IVF index of an mmap store up to date and save it
+
+    Trains new centroids when there is no index, when the store has doubled
+    or halved since training, or when `lists` asks for a different count;
+    otherwise only assigns rows added since the last update. A store with
+    no live rows gets no index (any old one is removed) and None is returned.
+    """
+    live = len(store)
+    if not live:
+        IVFIndex.remove(store.persist_directory)
+        return None
+    ivf = IVFIndex.load(store.persist_directory)
+    vectors = store.vectors()
+    generation = store.header["generation"]
+    retrain = (
+        ivf is None
+        or live > 2 * ivf.trained_rows
+        or live < ivf.trained_rows / 2
+        or (lists is not None and lists != ivf.lists)
+    )
+    if retrain:
+        ivf = IVFIndex.train(vectors, lists or default_lists(live), generation, iterations)
+    else:
+        ivf = ivf.extend(vectors, generation)
+    ivf.save(store.persist_directory)
+    return ivf
@@ -0,0 +1,414 @@
+"""
+LLM provider pool for Zendesk ISV Resell Assistant
+A chat model that spreads questions over several providers (OpenAI and
+Anthropic) and tracks each one's rolling latency and error rate. Requests go
+to the fastest healthy provider; a provider that fails is replaced by the
+next one, and with hedging on a second provider is asked once the first has
+been slower than its own p95, keeping whichever answers first
+"""
+
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from typing import Any, List
+import numpy as np
+from http_clients import shared_http_client, shared_async_http_client
+from langchain_core.language_models.chat_models import (
+    BaseChatModel,
+    agenerate_from_stream,
+    generate_from_stream,
+)
+
+# Provider name -> (API key variable, model)
+PROVIDERS = {
+    "openai": ("OPENAI_API_KEY", "gpt-4"),
+    "anthropic": ("ANTHROPIC_API_KEY", "claude-3-sonnet-20240229"),
+}
+
+def chat_model(provider, max_retries=2, model=None, temperature=0.7, streaming=True):
+    """Chat model for a provider on the shared HTTP clients, importing only that provider's package"""
+    key_variable, default_model = PROVIDERS[provider]
+    if provider == "anthropic":
+        import anthropic
+        from langchain_anthropic import ChatAnthropic
+        llm = ChatAnthropic(
+            model=model or default_model,
+            temperature=temperature,
+            streaming=streaming,
+            max_retries=max_retries,
+            api_key=os.getenv(key_variable)
+        )
+        # ChatAnthropic takes no HTTP client, so its SDK clients are rebuilt on the shared ones
+        client_params = {
+            "api_key": llm.anthropic_api_key.get_secret_value(),
+            "base_url": llm.anthropic_api_url,
+            "max_retries": max_retries,
+            "default_headers": llm.default_headers,
+        }
+        object.__setattr__(llm, "_client", anthropic.Client(**client_params, http_client=shared_http_client()))
+        object.__setattr__(
+            llm, "_async_client", anthropic.AsyncClient(**client_params, http_client=shared_async_http_client())
+        )
+        return llm
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=model or default_model,
+        temperature=temperature,
+        streaming=streaming,
+        max_retries=max_retries,
+        api_key=os.getenv(key_variable),
+        http_client=shared_http_client(),
+        http_async_client=shared_async_http_client()
+    )
+
+class ProviderStats:
+    """Latency and outcome of a provider's recent requests
+
+    Latency is the time to the first streamed token, or to the whole response
+    when not streaming. Samples older than `window` seconds are forgotten, so
+    a provider that was slow or failing is tried again later. Updates come
+    from every request's worker threads, so they all take the lock.
+    """
+
+    def __init__(self, window=300.0, max_samples=200):
+        self.window = window
+        # (monotonic time, seconds or None for a failure)
+        self.samples = deque(maxlen=max_samples)
+        self.requests = 0
+        self.wins = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def started(self):
+        """Count a request sent to the provider"""
+        with self._lock:
+            self.requests += 1
+
+    def record(self, seconds=None, won=False):
+        """Add a latency sample, or a failure when seconds is None; `won` counts a request this provider answered"""
+        with self._lock:
+            self.samples.append((time.monotonic(), seconds))
+            if seconds is None:
+                self.errors += 1
+            if won:
+                self.wins += 1
+
+    def counts(self):
+        """(requests, wins, errors) read together"""
+        with self._lock:
+            return self.requests, self.wins, self.errors
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            return [seconds for at, seconds in self.samples if at >= cutoff]
+
+    def latency(self, percentile=50):
+        """Recent latency percentile in seconds, or None without recent successes"""
+        latencies = [seconds for seconds in self._recent() if seconds is not None]
+        return float(np.percentile(latencies, percentile)) if latencies else None
+
+    def error_rate(self):
+        recent = self._recent()
+        return sum(seconds is None for seconds in recent) / len(recent) if recent else 0.0
+
+    def healthy(self, max_error_rate=0.5, min_samples=3):
+        recent = self._recent()
+        if len(recent) < min_samples:
+            return True
+        return sum(seconds is None for seconds in recent) / len(recent) < max_error_rate
+
+class Provider:
+    """A named chat model and its stats"""
+
+    def __init__(self, name, model, window=300.0):
+        self.name = name
+        self.model = model
+        self.stats = ProviderStats(window)
+
+class _Attempt:
+    """One provider's try at the current request"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.started = time.perf_counter()
+        self.cancel = lambda: None
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+class _Race:
+    """Routing, hedging and failover bookkeeping for one request, shared by the sync and async paths
+
+    `handle` turns worker events into ("item", payload), ("launch", None),
+    ("done", None) or ("skip", None), and raises once every provider failed.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.pending = pool.route()
+        self.active = []
+        self.winner = None
+
+    def next_attempt(self):
+        attempt = _Attempt(self.pending.pop(0))
+        attempt.provider.stats.started()
+        self.active.append(attempt)
+        return attempt
+
+    def hedge_timeout(self):
+        """Seconds to wait before asking another provider, or None to wait indefinitely"""
+        if not self.pool.hedge or self.winner is not None or not self.pending or len(self.active) != 1:
+            return None
+        attempt = self.active[0]
+        return max(0.0, self.pool.hedge_after(attempt.provider) - attempt.elapsed())
+
+    def handle(self, attempt, kind, payload):
+        if self.winner is not None and attempt is not self.winner:
+            # A cancelled loser still finishing
+            return "skip", None
+        if kind == "error":
+            attempt.provider.stats.record(None)
+            self.active.remove(attempt)
+            if attempt is self.winner or (not self.active and not self.pending):
+                raise payload
+            return ("launch", None) if not self.active else ("skip", None)
+        if self.winner is None:
+            self.winner = attempt
+            attempt.provider.stats.record(attempt.elapsed(), won=True)
+            for other in self.active:
+                if other is not attempt:
+                    # Slower than this, at least; keeps a slow provider from staying first
+                    other.provider.stats.record(other.elapsed())
+                    other.cancel()
+            self.active = [attempt]
+        return ("done", None) if kind == "end" else ("item", payload)
+
+    def cancel_all(self):
+        for attempt in self.active:
+            attempt.cancel()
+
+class ProviderPool(BaseChatModel):
+    """Chat model that routes each request to the fastest healthy provider
+
+    Providers are ranked by recent median latency; unhealthy ones (error rate
+    at or above max_error_rate) go last, and providers without recent samples
+    go first so every provider keeps being measured. With `hedge`, a request
+    still waiting for its first token after the provider's p95 latency (or
+    `hedge_delay` before there is one) is also sent to the next provider.
+    """
+
+    providers: List[Any]
+    hedge: bool = False
+    hedge_delay: float = 2.0
+    min_hedge_delay: float = 0.2
+    max_error_rate: float = 0.5
+    streaming: bool = True
+    hedges: int = 0
+
+    @property
+    def _llm_type(self):
+        return "provider-pool"
+
+    @property
+    def _identifying_params(self):
+        return {"providers": [provider.name for provider in self.providers], "hedge": self.hedge}
+
+    def route(self):
+        """Providers in the order to try them"""
+        def rank(provider):
+            stats = provider.stats
+            latency = stats.latency(50)
+            return (not stats.healthy(self.max_error_rate), latency is not None, latency or 0.0)
+        return sorted(self.providers, key=rank)
+
+    def hedge_after(self, provider):
+        """Seconds to wait on a provider before hedging"""
+        p95 = provider.stats.latency(95)
+        return max(self.min_hedge_delay, self.hedge_delay if p95 is None else p95)
+
+    def provider_stats(self):
+        """Per-provider request counts, latency percentiles and health"""
+        rows = []
+        for provider in self.route():
+            requests, wins, errors = provider.stats.counts()
+            rows.append({
+                "name": provider.name,
+                "requests": requests,
+                "wins": wins,
+                "errors": errors,
+                "p50": provider.stats.latency(50),
+                "p95": provider.stats.latency(95),
+                "error_rate": provider.stats.error_rate(),
+                "healthy": provider.stats.healthy(self.max_error_rate),
+            })
+        return {"hedges": self.hedges, "providers": rows}
+
+    def _race(self, call):
+        """Yield the items `call(model)` produces for the winning provider, in a thread per attempt"""
+        race = _Race(self)
+        events = queue.Queue()
+
+        def start():
+            attempt = race.next_attempt()
+            cancelled = threading.Event()
+            attempt.cancel = cancelled.set
+
+            def run():
+                try:
+                    for item in call(attempt.provider.model):
+                        if cancelled.is_set():
+                            return
+                        events.put((attempt, "item", item))
+                    events.put((attempt, "end", None))
+                except Exception as e:
+                    events.put((attempt, "error", e))
+
+            threading.Thread(target=run, daemon=True).start()
+
+        start()
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=race.hedge_timeout())
+                except queue.Empty:
+                    self.hedges += 1
+                    start()
+                    continue
+                action, payload = race.handle(*event)
+                if action == "launch":
+                    start()
+                elif action == "item":
+                    yield payload
+                elif action == "done":
+                    return
+        finally:
+            race.cancel_all()
+
+    async def _arace(self, call):
+        """Async counterpart of _race, with a task per attempt"""
+        race = _Race(self)
+        events = asyncio.Queue()
+
+        def start():
+            attempt = race.next_attempt()
+
+            async def run():
+                try:
+                    async for item in call(attempt.provider.model):
+                        await events.put((attempt, "item", item))
+                    await events.put((attempt, "end", None))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await events.put((attempt, "error", e))
+
+            attempt.cancel = asyncio.ensure_future(run()).cancel
+
+        start()
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), race.hedge_timeout())
+                except asyncio.TimeoutError:
+                    self.hedges += 1
+                    start()
+                    continue
+                action, payload = race.handle(*event)
+                if action == "launch":
+                    start()
+                elif action == "item":
+                    yield payload
+                elif action == "done":
+                    return
+        finally:
+            race.cancel_all()
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        def call(model):
+            yield from model._stream(messages, stop=stop, **kwargs)
+
+        for chunk in self._race(call):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async def call(model):
+            async for chunk in model._astream(messages, stop=stop, **kwargs):
+                yield chunk
+
+        async for chunk in self._arace(call):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+
+        def call(model):
+            yield model._generate(messages, stop=stop, **kwargs)
+
+        return list(self._race(call))[0]
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+        async def call(model):
+            yield await model._agenerate(messages, stop=stop, **kwargs)
+
+        return [result async for result in self._arace(call)][0]
+
+    # Token counts (for conversation memory) come from the first configured provider
+    def get_num_tokens_from_messages(self, messages, *args, **kwargs):
+        return self.providers[0].model.get_num_tokens_from_messages(messages, *args, **kwargs)
+
+    def get_token_ids(self, text):
+        return self.providers[0].model.get_token_ids(text)
+
+def format_provider_stats(stats):
+    """Plain-text provider table for the CLI"""
+    lines = [
+        f"Hedged requests: {stats['hedges']}",
+        f"{'provider':<12}{'requests':>9}{'wins':>7}{'errors':>8}{'p50':>10}{'p95':>10}  health",
+    ]
+    for row in stats["providers"]:
+        p50, p95 = (f"{row[key]:>9.3f}s" if row[key] is not None else f"{'-':>10}" for key in ("p50", "p95"))
+        health = "ok" if row["healthy"] else f"unhealthy ({row['error_rate']:.0%} errors)"
+        lines.append(f"{row['name']:<12}{row['requests']:>9}{row['wins']:>7}{row['errors']:>8}{p50}{p95}  {health}")
+    return "\n".join(lines)
+
+def primary_model(llm):
+    """The model a pool counts tokens with, or llm itself"""
+    return llm.providers[0].model if isinstance(llm, ProviderPool) else llm
+
+def llm_from_env():
+    """The answer model: one provider, or a ProviderPool when LLM_PROVIDERS names several
+
+    Without LLM_PROVIDERS, OpenAI is used if OPENAI_API_KEY is set and
+    Anthropic otherwise. Pools are tuned with LLM_HEDGE, LLM_HEDGE_DELAY_MS,
+    LLM_MAX_ERROR_RATE and LLM_STATS_WINDOW_SECONDS.
+    """
+    names = [name.strip().lower() for name in os.getenv("LLM_PROVIDERS", "").split(",") if name.strip()]
+    if not names:
+        names = [name for name, (key_variable, _) in PROVIDERS.items() if os.getenv(key_variable)][:1]
+    if not names:
+        raise ValueError("No API key found. Please set OPENAI_API_KEY or ANTHROPIC_API_KEY")
+    unknown = [name for name in names if name not in PROVIDERS]
+    if unknown:
+        raise ValueError(f"Unknown LLM provider(s): {', '.join(unknown)}; choose from {', '.join(PROVIDERS)}")
+    if len(names) == 1:
+        return chat_model(names[0])
+    window = float(os.getenv("LLM_STATS_WINDOW_SECONDS", 300))
+    return ProviderPool(
+        # The pool fails over to the next provider instead of retrying a struggling one
+        providers=[Provider(name, chat_model(name, max_retries=0), window) for name in names],
+        hedge=os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes"),
+        hedge_delay=float(os.getenv("LLM_HEDGE_DELAY_MS", 2000)) / 1000,
+        max_error_rate=float(os.getenv("LLM_MAX_ERROR_RATE", 0.5)),
+    )
@@ -0,0 +1,184 @@
+"""
+Load test for the Zendesk ISV Resell Assistant HTTP service
+Simulates concurrent conversations against server.py and reports latency
+percentiles, time to first token, throughput and rejected or timed-out
+requests. Without --url it starts everything locally: the fake OpenAI server,
+a temporary index of the docs folder and the HTTP service
+"""
+
+import os
+import io
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+import aiohttp
+from aiohttp import web
+
+QUESTIONS = [
+    "What are the steps for ISV reselling?",
+    "How do I create a sales order for an ISV?",
+    "What approvals do I need for ISV deals?",
+    "How do I price ISV products?",
+    "What documentation is required?",
+    "What's the approval workflow?",
+]
+FOLLOW_UPS = ["What about the discount on it?", "Who do I contact about that?"]
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {"p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1)}
+
+async def ask(http, url, session_id, question, stream):
+    """One question; returns (status, seconds, seconds to first token or None)"""
+    start = time.perf_counter()
+    body = {"session_id": session_id, "question": question}
+    if not stream:
+        async with http.post(f"{url}/chat", json=body) as response:
+            await response.read()
+            return response.status, time.perf_counter() - start, None
+
+    first_token = None
+    status = None
+    async with http.post(f"{url}/chat/stream", json=body) as response:
+        status = response.status
+        if status != 200:
+            await response.read()
+            return status, time.perf_counter() - start, None
+        async for line in response.content:
+            line = line.decode("utf-8").strip()
+            if line == "event: token" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif line == "event: error":
+                status = 504
+            elif line == "event: done":
+                break
+    return status, time.perf_counter() - start, first_token
+
+async def conversation(http, url, number, turns, stream, unique, results):
+    """A user asking `turns` questions in one session, each after the previous answer"""
+    session_id = f"load-{number}"
+    for turn in range(turns):
+        if turn % 2 == 0:
+            question = QUESTIONS[(number + turn) % len(QUESTIONS)]
+        else:
+            question = FOLLOW_UPS[turn // 2 % len(FOLLOW_UPS)]
+        if unique:
+            # Distinct wording per request keeps the answer cache from serving everything
+            question += f" (ticket {number}-{turn})"
+        status, seconds, first_token = await ask(http, url, session_id, question, stream)
+        results.append({"status": status, "seconds": seconds, "first_token": first_token})
+
+async def run_load(url, conversations, turns, stream, unique):
+    results = []
+    start = time.perf_counter()
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as http:
+        await asyncio.gather(*(
+            conversation(http, url, number, turns, stream, unique, results) for number in range(conversations)
+        ))
+        async with http.get(f"{url}/health") as response:
+            health = await response.json()
+        async with http.get(f"{url}/stats") as response:
+            stats = await response.json()
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    return {
+        "conversations": conversations,
+        "turns": turns,
+        "stream": stream,
+        "requests": len(results),
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "latency": percentiles([r["seconds"] for r in ok]),
+        "time_to_first_token": percentiles([r["first_token"] for r in ok if r["first_token"] is not None]),
+        "server": health,
+        # How many questions shared each query embedding request (see embedding_batcher.py)
+        "embedding_batches": stats.get("embedding_batches"),
+    }
+
+def build_local_assistant(index_path):
+    """Index the docs folder into index_path and open an assistant on it"""
+    from index_documents import update_index, update_keyword_index
+    from main import ZendeskISVAssistant
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        vectorstore, summary = update_index("docs/TechResellChatbotRAG", index_path)
+        update_keyword_index(vectorstore, index_path, summary)
+        return ZendeskISVAssistant(persist_directory=index_path)
+
+@contextlib.asynccontextmanager
+async def local_service(token_latency_ms, settings):
+    """Fake OpenAI server, temporary index and HTTP service; yields the service URL"""
+    from fake_openai_server import start_in_thread
+    from server import create_app
+
+    fake, base_url = start_in_thread(port=0, dim=256, token_latency=token_latency_ms / 1000)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update(
+            OPENAI_BASE_URL=base_url,
+            OPENAI_API_KEY="sk-fake",
+            EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.sqlite3"),
+        )
+        # Indexing drives its own event loop, so it runs in a thread
+        assistant = await asyncio.to_thread(build_local_assistant, os.path.join(workdir, "rag_index"))
+
+        runner = web.AppRunner(create_app(assistant, **settings))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            yield f"http://127.0.0.1:{port}"
+        finally:
+            await runner.cleanup()
+            fake.shutdown()
+
+async def run(args):
+    if args.url:
+        return await run_load(args.url.rstrip("/"), args.conversations, args.turns, args.stream, not args.repeat)
+    settings = {
+        "max_concurrency": args.max_concurrency,
+        "max_queue": args.max_queue,
+        "request_timeout": args.timeout,
+    }
+    async with local_service(args.token_latency_ms, settings) as url:
+        return await run_load(url, args.conversations, args.turns, args.stream, not args.repeat)
+
+def main():
+    """Run the load test and print a summary"""
+    parser = argparse.ArgumentParser(description="Load test for server.py")
+    parser.add_argument("--url", help="Running service to test; default starts a local one with a fake LLM")
+    parser.add_argument("--conversations", type=int, default=50, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=4, help="Questions per session")
+    parser.add_argument("--stream", action="store_true", help="Use the server-sent-events endpoint")
+    parser.add_argument("--repeat", action="store_true", help="Reuse question wording so the answer cache can hit")
+    parser.add_argument("--token-latency-ms", type=float, default=20.0, help="Fake LLM delay per streamed token")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Local service concurrency limit")
+    parser.add_argument("--max-queue", type=int, default=32, help="Local service wait queue size")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Local service request timeout in seconds")
+    parser.add_argument("--output", help="Also write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    print("🚦 Zendesk ISV Resell Assistant - Load Test")
+    print("=" * 50)
+    summary = asyncio.run(run(args))
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -3,72 +3,131 @@ Zendesk ISV Resell Assistant - CLI Version
 A helpful assistant for Zendesk sales representatives to navigate ISV reselling processes
 """
 
+# First, so STARTUP_PROFILE=true can time every import below
+import startup_profile
 import os
+import logging
+import threading
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-import chromadb
-from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from embedding_cache import cache_embeddings
+from embedding_batcher import batch_query_embeddings, format_batch_stats
+from mmap_store import mmap_store_from_env, vector_backend
+from answer_cache import answer_cache_from_env
+from llm_pool import llm_from_env, format_provider_stats
+from http_clients import openai_embeddings, http_pool_stats, format_http_stats
+from context_packing import context_packer_from_env
+from conversation_memory import build_memory
+from question_router import question_router_from_env, condense_llm_from_env
+from retrievers import SnapshotRetriever, build_retriever
+from index_snapshots import LiveIndex
+from streaming import stream_chain, format_timings
+from tracing import trace_recorder_from_env, invoke_traced, format_stats
 
 # Load environment variables
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 
 class ZendeskISVAssistant:
-    def __init__(self):
-        self.llm = None
-        self.vectorstore = None
-        self.qa_chain = None
-        self.setup_llm()
+    def __init__(self, llm=None, embeddings=None, persist_directory="rag_index"):
+        # llm and embeddings default to the configured providers; benchmarks
+        # pass local fakes instead
+        self.llm = llm
+        self.embeddings = embeddings
+        self.persist_directory = persist_directory
+        self.live_index = LiveIndex(persist_directory, self.open_snapshot)
+        self.retriever = None
+        self.answer_cache = None
+        self._qa_chain = None
+        self._index_lock = threading.Lock()
+        self.trace_recorder = trace_recorder_from_env()
+        with startup_profile.stage("setup_llm"):
+            self.setup_llm()
         self.setup_vectorstore()
     
     def setup_llm(self):
-        """Initialize the language model"""
-        # Try OpenAI first, fallback to Anthropic
-        if os.getenv("OPENAI_API_KEY"):
-            self.llm = ChatOpenAI(
-                model="gpt-4",
-                temperature=0.7,
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-        elif os.getenv("ANTHROPIC_API_KEY"):
-            self.llm = ChatAnthropic(
-                model="claude-3-sonnet-20240229",
-                temperature=0.7,
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
-        else:
-            raise ValueError("No API key found. Please set OPENAI_API_KEY or ANTHROPIC_API_KEY")
+        """Initialize the language model (or provider pool), importing only the selected providers"""
+        if self.llm is not None:
+            return
+        self.llm = llm_from_env()
     
     def setup_vectorstore(self):
-        """Initialize the vector store with RAG index"""
-        embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        # Check if RAG index exists
-        if os.path.exists("rag_index"):
-            self.vectorstore = Chroma(
-                persist_directory="rag_index",
-                embedding_function=embeddings
-            )
-            
-            # Setup conversation chain
-            memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True
-            )
-            
-            self.qa_chain = ConversationalRetrievalChain.from_llm(
-                llm=self.llm,
-                retriever=self.vectorstore.as_retriever(),
-                memory=memory,
-                return_source_documents=True,
-                output_key="answer"
-            )
-        else:
+        """Check for the RAG index; it is opened by the first question unless LAZY_INDEX is false"""
+        self.index_available = self.live_index.exists()
+        if not self.index_available:
             print("RAG index not found. Please run indexing first.")
-            self.vectorstore = None
+        elif os.getenv("LAZY_INDEX", "true").lower() == "false":
+            self.open_index()
+    
+    @property
+    def vectorstore(self):
+        """The vector store of the published index snapshot, or None until the index is opened"""
+        return self.live_index.current().vectorstore if self.retriever is not None else None
+    
+    def open_snapshot(self, path):
+        """Open the vector store and retriever of one index snapshot directory"""
+        if vector_backend(path) == "mmap":
+            vectorstore = mmap_store_from_env(path, self.cached_embeddings)
+        else:
+            from langchain.vectorstores import Chroma
+            vectorstore = Chroma(
+                persist_directory=path,
+                embedding_function=self.cached_embeddings
+            )
+        return vectorstore, build_retriever(vectorstore, path)
+    
+    def open_index(self):
+        """Open the published index and build the retriever and caches once; False when there is no index
+
+        Chains get a retriever that follows the published snapshot, so a
+        re-index is picked up by the next question without a restart.
+        """
+        if not self.index_available:
+            # Indexed since startup?
+            self.index_available = self.live_index.exists()
+            if not self.index_available:
+                return False
+        with self._index_lock:
+            if self.retriever is not None:
+                return True
+            with startup_profile.stage("open index"):
+                if self.embeddings is None:
+                    # Concurrent questions share embedding requests
+                    self.embeddings = batch_query_embeddings(openai_embeddings())
+                self.cached_embeddings = cache_embeddings(self.embeddings)
+                self.live_index.current()
+                self.retriever = SnapshotRetriever(index=self.live_index)
+                self.condense_llm = condense_llm_from_env(self.llm)
+                self.context_packer = context_packer_from_env()
+                self.answer_cache = answer_cache_from_env(
+                    self.cached_embeddings,
+                    lambda: self.live_index.current().vectorstore,
+                    self.persist_directory
+                )
+        return True
+    
+    @property
+    def qa_chain(self):
+        """The CLI's conversation chain, built (and the index opened) on first use"""
+        if self._qa_chain is None and self.open_index():
+            self._qa_chain = self.new_chain()
+        return self._qa_chain
+    
+    def new_chain(self, memory=None):
+        """Conversation chain with its own memory (by default), sharing the model, index and caches"""
+        # LangChain's legacy chains load here, with the first question, not at startup
+        from assistant_chain import AssistantRetrievalChain
+        self.open_index()
+        return AssistantRetrievalChain.from_llm(
+            llm=self.llm,
+            retriever=self.retriever,
+            condense_question_llm=self.condense_llm,
+            memory=memory or build_memory(self.llm),
+            return_source_documents=True,
+            output_key="answer",
+            answer_cache=self.answer_cache,
+            context_packer=self.context_packer,
+            question_router=question_router_from_env()
+        )
     
     def get_response(self, user_input: str):
         """Get response from the assistant"""
@@ -76,13 +135,25 @@ class ZendeskISVAssistant:
             return "Vector store not initialized. Please run indexing first.", []
         
         try:
-            result = self.qa_chain({"question": user_input})
+            result, _ = invoke_traced(self.qa_chain, user_input, self.trace_recorder)
             response = result["answer"]
             source_docs = result.get("source_documents", [])
             return response, source_docs
         except Exception as e:
             return f"Error generating response: {e}", []
     
+    def stream_response(self, user_input: str):
+        """Stream the response as ("sources", docs), ("token", text) and ("done", result) events"""
+        if not self.qa_chain:
+            message = "Vector store not initialized. Please run indexing first."
+            yield "done", {"answer": message, "source_documents": [], "timings": {}}
+            return
+        
+        try:
+            yield from stream_chain(self.qa_chain, user_input, self.trace_recorder)
+        except Exception as e:
+            yield "done", {"answer": f"Error generating response: {e}", "source_documents": [], "timings": {}}
+    
     def show_help(self):
         """Display help information"""
         help_text = """
@@ -125,6 +196,7 @@ COMMON QUESTIONS YOU CAN ASK:
 COMMANDS:
 - Type 'help' to see this message
 - Type 'sources' to see source documents for the last response
+- Type 'stats' to see per-stage latency percentiles, or 'stats <file>' to also export traces as JSONL
 - Type 'quit' to exit
 
 TIPS:
@@ -134,6 +206,23 @@ TIPS:
 """
         print(help_text)
     
+    def show_stats(self, export_path=None):
+        """Display rolling latency percentiles, optionally exporting the traces"""
+        print("\n⏱️  Latency by stage (recent requests):")
+        print("=" * 50)
+        print(format_stats(self.trace_recorder.summary()))
+        if hasattr(self.llm, "provider_stats"):
+            print("\n🔀 LLM providers (fastest healthy first):")
+            print(format_provider_stats(self.llm.provider_stats()))
+        if hasattr(self.embeddings, "batch_stats"):
+            print("\n🧮 Query embedding batches:")
+            print(format_batch_stats(self.embeddings.batch_stats()))
+        print("\n🔌 HTTP connection pool:")
+        print(format_http_stats(http_pool_stats()))
+        if export_path:
+            count = self.trace_recorder.export_jsonl(export_path)
+            print(f"💾 Exported {count} trace(s) to {export_path}")
+    
     def show_sources(self, source_docs):
         """Display source documents"""
         if not source_docs:
@@ -150,14 +239,37 @@ TIPS:
             print(f"   Preview: {content_preview}")
             print()
 
+def print_stream(events):
+    """Print an answer's tokens as they stream in; returns the final ("done") payload
+
+    When the answer differs from what was streamed (the chain failed
+    part-way through), the rest of it, or the error, is printed after them.
+    """
+    streamed = []
+    for kind, payload in events:
+        if kind == "token":
+            print(payload, end="", flush=True)
+            streamed.append(payload)
+        elif kind == "done":
+            result = payload
+    shown = "".join(streamed)
+    answer = result["answer"]
+    if answer.startswith(shown):
+        print(answer[len(shown):])
+    else:
+        print(f"\n{answer}")
+    return result
+
 def main():
     """Main function to run the assistant"""
     print("🤖 Zendesk ISV Resell Assistant")
     print("=" * 50)
     
     try:
-        assistant = ZendeskISVAssistant()
+        with startup_profile.stage("ZendeskISVAssistant()"):
+            assistant = ZendeskISVAssistant()
         print("✅ Assistant initialized successfully!")
+        startup_profile.report()
         
         # Show help
         assistant.show_help()
@@ -181,15 +293,25 @@ def main():
             elif user_input.lower() == 'sources':
                 assistant.show_sources(last_sources)
                 continue
+            elif user_input.lower().split()[:1] == ['stats']:
+                parts = user_input.split(maxsplit=1)
+                assistant.show_stats(parts[1] if len(parts) > 1 else None)
+                continue
             elif not user_input:
                 continue
             
-            # Get response
-            response, sources = assistant.get_response(user_input)
-            last_response = response
-            last_sources = sources
+            # Stream response
+            print("\n🤖 Assistant: ", end="", flush=True)
+            result = print_stream(assistant.stream_response(user_input))
+            last_response = result["answer"]
+            last_sources = sources = result.get("source_documents", [])
+            timings = result.get("timings", {})
+            history = result.get("history_tokens")
             
-            print(f"\n🤖 Assistant: {response}")
+            if timings:
+                print(f"⏱️  {format_timings(timings)}")
+            if history is not None:
+                print(f"🧠 History: {history} tokens")
             
             if sources:
                 print(f"\n📚 Sources: {len(sources)} document(s) referenced")
@@ -0,0 +1,287 @@
+"""
+Chunk metadata index for Zendesk ISV Resell Assistant
+Extracts partners, document type, title, file modification time and section
+heading for every chunk at indexing time and keeps them in indexed SQLite side
+tables in rag_index, so retrieval can be scoped to a subset of chunks before
+any vector is scored. Filters come from the caller (e.g. the quick question
+presets) or are inferred from names mentioned in the question
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+
+METADATA_FILENAME = "metadata.sqlite3"
+
+# Columns that can be filtered on by equality (a value or a list of values)
+FILTER_COLUMNS = ("partner", "doc_type", "title", "section", "source")
+
+# Document types, tried in order against the file name; the first match wins
+DOC_TYPE_KEYWORDS = (
+    ("form", ("form", "template", "questionnaire")),
+    ("pricing", ("discount", "pricing", "price list", "rate card")),
+    ("contract", ("sow", "agreement", "addendum", "contract", "terms")),
+    ("enablement", ("enablement", "training", "onboarding")),
+    ("instructions", ("instruction", "guide", "process", "how to", "playbook")),
+)
+DEFAULT_DOC_TYPE = "document"
+
+def document_title(source):
+    """Readable title from a file name: 'Tech Alliances _ Resell Discounts (2).pdf' -> 'Tech Alliances - Resell Discounts'"""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    stem = re.sub(r"\s*\(\d+\)$", "", stem)
+    stem = re.sub(r"\s+_\s+", " - ", stem)
+    return re.sub(r"\s+", " ", stem.replace("_", " ")).strip()
+
+def document_type(title):
+    """Coarse document type from keywords in the title"""
+    lowered = title.lower()
+    for doc_type, keywords in DOC_TYPE_KEYWORDS:
+        if any(re.search(rf"\b{re.escape(keyword)}", lowered) for keyword in keywords):
+            return doc_type
+    return DEFAULT_DOC_TYPE
+
+def document_partner(source, docs_path):
+    """Partner a file belongs to: the first folder below docs_path, if the file is in one"""
+    parts = os.path.normpath(os.path.relpath(source, docs_path)).split(os.sep)
+    return parts[0] if len(parts) > 1 and parts[0] != ".." else None
+
+def partner_names_from_env():
+    """Known partner names from PARTNER_NAMES (comma-separated)"""
+    return [name.strip() for name in os.getenv("PARTNER_NAMES", "").split(",") if name.strip()]
+
+def mentioned(names, text):
+    """The names that occur in text as whole words, ignoring case and punctuation"""
+    words = f" {_words(text)} "
+    return [name for name in names if f" {_words(name)} " in words]
+
+def is_heading(line):
+    """Whether a line looks like a section heading rather than body text"""
+    line = line.strip()
+    if line.startswith("#"):
+        return bool(line.lstrip("#").strip())
+    if not 3 <= len(line) <= 80 or line[-1] in ".,;?!" or not line[0].isalpha():
+        return False
+    # Table rows (prices, percentages, dates) and numbered list items aren't headings
+    if re.search(r"[$%]|\d{2,}", line):
+        return False
+    words = re.findall(r"[A-Za-z][\w'&/-]*", line)
+    if not words or len(words) > 10:
+        return False
+    if line.isupper():
+        return True
+    small = {"a", "an", "and", "as", "at", "by", "for", "in", "of", "on", "or", "the", "to", "vs", "with"}
+    capitalized = [word[0].isupper() for word in words if word.lower() not in small]
+    return bool(capitalized) and all(capitalized)
+
+def _words(text):
+    """Lowercase words joined by single spaces, for punctuation-insensitive matching"""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def _headings(text):
+    """(offset, heading) for every heading line in text"""
+    return [
+        (match.start(), match.group().strip().lstrip("#").strip())
+        for match in re.finditer(r"^[^\n]+$", text, re.MULTILINE)
+        if is_heading(match.group())
+    ]
+
+def annotate_chunks(chunks, documents, docs_path):
+    """Add partner, doc_type, title, modified and section metadata to chunks in place
+
+    `documents` are the loaded pages the chunks were split from (with
+    add_start_index), in order. A chunk's section is the last heading at or
+    before its first line, carried over from earlier pages of the same file.
+    """
+    headings = {}
+    previous = {}
+    for doc in documents:
+        source = doc.metadata.get("source", "")
+        key = (source, doc.metadata.get("page"))
+        headings[key] = (previous.get(source), _headings(doc.page_content))
+        if headings[key][1]:
+            previous[source] = headings[key][1][-1][1]
+
+    file_metadata = {}
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        if source not in file_metadata:
+            title = document_title(source)
+            file_metadata[source] = {
+                "title": title,
+                "doc_type": document_type(title),
+                "partner": document_partner(source, docs_path),
+                "modified": os.path.getmtime(source) if os.path.exists(source) else None,
+            }
+        # Chroma rejects None metadata values, so unknown fields are left out
+        chunk.metadata.update({key: value for key, value in file_metadata[source].items() if value is not None})
+
+        carried, page_headings = headings.get((source, chunk.metadata.get("page")), (None, []))
+        first_line_end = chunk.metadata.get("start_index", 0) + len(chunk.page_content.split("\n", 1)[0])
+        section = carried
+        for offset, heading in page_headings:
+            if offset > first_line_end:
+                break
+            section = heading
+        if section:
+            chunk.metadata["section"] = section
+    return chunks
+
+def chunk_partners(metadata, text, partner_names):
+    """The chunk's partner folder, if any, plus every known partner it mentions"""
+    partners = [metadata["partner"]] if metadata.get("partner") else []
+    return partners + [name for name in mentioned(partner_names, text) if name not in partners]
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+def check_filters(filters):
+    """Raise ValueError unless `filters` is a valid filter object from a caller
+
+    Columns take a string or number, or a non-empty list of them;
+    "modified_after" takes a number (a Unix time).
+    """
+    if not isinstance(filters, dict):
+        raise ValueError('"filters" must be an object, e.g. {"doc_type": "form"}')
+    unknown = set(filters) - set(FILTER_COLUMNS) - {"modified_after"}
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(sorted(unknown))}")
+    for column, value in filters.items():
+        if column == "modified_after":
+            if not _is_scalar(value) or isinstance(value, str):
+                raise ValueError('"modified_after" must be a number (a Unix time)')
+        elif not (_is_scalar(value) or (isinstance(value, list) and value and all(map(_is_scalar, value)))):
+            raise ValueError(f'Filter "{column}" must be a string or number, or a list of them')
+
+class MetadataIndex:
+    """SQLite tables of per-chunk metadata with an index on every filterable column
+
+    A chunk has one row in `chunks` and one row in `chunk_partners` per
+    partner it belongs to or mentions. Partners are matched when the table is
+    built, so changing PARTNER_NAMES only rebuilds the table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " chunk_id TEXT PRIMARY KEY,"
+            " source TEXT,"
+            " title TEXT,"
+            " doc_type TEXT,"
+            " section TEXT,"
+            " modified REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_partners ("
+            " chunk_id TEXT NOT NULL,"
+            " partner TEXT NOT NULL,"
+            " PRIMARY KEY (partner, chunk_id))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        for column in FILTER_COLUMNS + ("modified",):
+            if column != "partner":
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS chunks_{column} ON chunks ({column})")
+        self._conn.commit()
+
+    @classmethod
+    def open(cls, persist_directory):
+        """Open the table kept next to a vector store, or None if it hasn't been built"""
+        path = os.path.join(persist_directory, METADATA_FILENAME)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    @property
+    def partner_names(self):
+        """The PARTNER_NAMES the table was built with, or None before the first build"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = 'partner_names'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def replace(self, chunks, partner_names=()):
+        """Replace the tables with (chunk_id, text, metadata) records in one transaction"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM chunk_partners")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings VALUES ('partner_names', ?)", (json.dumps(list(partner_names)),)
+            )
+            for chunk_id, text, metadata in chunks:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?)",
+                    (chunk_id, metadata.get("source"), metadata.get("title"), metadata.get("doc_type"),
+                     metadata.get("section"), metadata.get("modified")),
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO chunk_partners VALUES (?, ?)",
+                    ((chunk_id, partner) for partner in chunk_partners(metadata, text, partner_names)),
+                )
+        # Fold the WAL back in so the file can be copied on its own
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def values(self, column):
+        """Distinct non-empty values of a filterable column"""
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Unknown metadata column: {column}")
+        table = "chunk_partners" if column == "partner" else "chunks"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY {column}"
+            ).fetchall()
+        return [value for value, in rows]
+
+    def chunk_ids(self, filters):
+        """IDs of the chunks matching every filter
+
+        `filters` maps a column in FILTER_COLUMNS to a value or list of values;
+        "modified_after" keeps chunks of files modified at or after a Unix time.
+        """
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column == "modified_after":
+                clauses.append("modified >= ?")
+                params.append(value)
+                continue
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Unknown metadata filter: {column}")
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            placeholders = ",".join("?" * len(values))
+            if column == "partner":
+                clauses.append(
+                    f"chunk_id IN (SELECT chunk_id FROM chunk_partners WHERE partner IN ({placeholders}))"
+                )
+            else:
+                clauses.append(f"{column} IN ({placeholders})")
+            params.extend(values)
+        where = " AND ".join(clauses) or "1"
+        with self._lock:
+            rows = self._conn.execute(f"SELECT chunk_id FROM chunks WHERE {where}", params).fetchall()
+        return [chunk_id for chunk_id, in rows]
+
+    def infer_filters(self, question):
+        """Filters for partners and document titles named in the question, or None
+
+        Only exact (case-insensitive) mentions count, so a general question is
+        never narrowed by accident.
+        """
+        filters = {}
+        for column in ("partner", "title"):
+            names = mentioned(self.values(column), question)
+            if names:
+                filters[column] = names
+        return filters or None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
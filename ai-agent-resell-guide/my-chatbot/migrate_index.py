@@ -0,0 +1,101 @@
+"""
+Index migration for Zendesk ISV Resell Assistant
+Copies an existing Chroma rag_index into the memory-mapped backend without
+re-embedding anything: vectors, texts and metadata are read a page at a time
+and appended to the mmap files, and the manifest is updated so incremental
+indexing carries on with the new backend
+"""
+
+import os
+import shutil
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from langchain.vectorstores import Chroma
+from bm25_index import BM25_DIRNAME
+from metadata_index import METADATA_FILENAME
+from index_documents import load_manifest, save_manifest
+from index_snapshots import SnapshotBuild, close_vectorstore, collect_garbage, current_path
+from mmap_store import MmapVectorStore
+
+# Load environment variables
+load_dotenv()
+
+def migrate(source, target, dtype="float16", quantize=True, page_size=2000):
+    """Copy every chunk of the Chroma index in `source` into an mmap index in `target`
+
+    Returns (mmap store, Chroma store).
+    """
+    chroma = Chroma(persist_directory=source)
+    store = MmapVectorStore(target, dtype=dtype, quantize=quantize)
+    store.delete_collection()
+    offset = 0
+    while True:
+        page = chroma.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not len(page["ids"]):
+            break
+        store.add_vectors(page["ids"], np.asarray(page["embeddings"]), page["documents"], page["metadatas"])
+        offset += len(page["ids"])
+        print(f"  • Copied {offset} chunk(s)")
+
+    manifest = load_manifest(source)
+    if manifest is not None:
+        manifest["backend"] = "mmap"
+        save_manifest(target, manifest)
+    if os.path.abspath(source) != os.path.abspath(target):
+        if os.path.isdir(os.path.join(source, BM25_DIRNAME)):
+            shutil.copytree(os.path.join(source, BM25_DIRNAME), os.path.join(target, BM25_DIRNAME), dirs_exist_ok=True)
+        if os.path.exists(os.path.join(source, METADATA_FILENAME)):
+            shutil.copy2(os.path.join(source, METADATA_FILENAME), os.path.join(target, METADATA_FILENAME))
+    return store, chroma
+
+def agreement(store, chroma, samples=20, k=4):
+    """Average overlap of the top-k chunk IDs from both stores, querying with stored embeddings"""
+    page = chroma.get(limit=samples, include=["embeddings"])
+    overlaps = []
+    for embedding in page["embeddings"]:
+        expected = {doc.metadata.get("chunk_id") for doc in chroma.similarity_search_by_vector(list(embedding), k=k)}
+        found = {doc.metadata.get("chunk_id") for doc in store.similarity_search_by_vector(embedding, k=k)}
+        overlaps.append(len(expected & found) / len(expected) if expected else 1.0)
+    return float(np.mean(overlaps)) if overlaps else 1.0
+
+def main():
+    """Migrate rag_index from Chroma to the mmap backend"""
+    parser = argparse.ArgumentParser(description="Copy a Chroma index into the memory-mapped backend")
+    parser.add_argument("--source", default="rag_index", help="Existing Chroma index directory")
+    parser.add_argument("--target", help="Directory for the mmap index (default: a new snapshot of --source)")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default=os.getenv("MMAP_DTYPE", "float16"))
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 copy used for the first scoring pass")
+    parser.add_argument("--drop-chroma", action="store_true", help="Delete the Chroma collection once migrated")
+    args = parser.parse_args()
+
+    print("🤖 AI Agent Resell Guide - Index Migration")
+    print("=" * 50)
+    if not os.path.exists(args.source):
+        print(f"❌ Index not found: {args.source}")
+        return
+    if args.target:
+        build = None
+        source, target = current_path(args.source), args.target
+    else:
+        # Migrate a copy of the published snapshot, so running apps switch once it is done
+        build = SnapshotBuild(args.source)
+        source = target = build.path
+    print(f"📦 Copying {source} (Chroma) to {target} (mmap, {args.dtype})")
+    store, chroma = migrate(source, target, args.dtype, not args.no_quantize)
+
+    stats = store.stats()
+    print(f"✅ Migrated {stats['live']} chunk(s), dimension {stats['dim']}, {stats['bytes'] / 1e6:.1f} MB on disk")
+    print(f"🧪 Top-4 agreement with Chroma: {agreement(store, chroma):.0%}")
+    if args.drop_chroma:
+        chroma.delete_collection()
+        print("🗑️  Deleted the Chroma collection")
+    close_vectorstore(chroma)
+    if build is not None:
+        build.publish()
+        collect_garbage(args.source)
+        print(f"📌 Published index snapshot {build.version}")
+    print("\nThe apps pick the mmap index automatically; set VECTOR_BACKEND=chroma to switch back.")
+
+if __name__ == "__main__":
+    main()
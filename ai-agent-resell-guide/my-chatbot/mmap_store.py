@@ -0,0 +1,461 @@
+"""
+Memory-mapped vector store for Zendesk ISV Resell Assistant
+A compact alternative to Chroma for small containers. Embeddings are one
+contiguous float16 or float32 matrix that is memory-mapped instead of loaded,
+chunk text and metadata live in a JSON-lines side file addressed by byte
+offsets, and an optional int8 copy with per-row scales gives a cheaper first
+scoring pass. Search is a vectorized NumPy top-k over normalized vectors,
+restricted to the closest IVF lists when an IVF index has been built
+"""
+
+import os
+import json
+import uuid
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from ivf_index import IVF_DIRNAME, IVFIndex
+
+# Stored inside the vector store directory, next to the manifest and bm25/
+MMAP_DIRNAME = "mmap"
+HEADER_FILENAME = "index.json"
+MMAP_VERSION = 1
+
+# Rows scored per NumPy call; small blocks keep each float32 copy in cache
+BLOCK_ROWS = 512
+
+# Rows copied per batch when compacting
+COMPACT_BATCH_ROWS = 8192
+
+# Candidates per result re-scored at full precision after the int8 pass
+RESCORE_FACTOR = 8
+
+# Deleted rows are dropped from the files once they are this share of all rows
+COMPACT_THRESHOLD = 0.2
+
+def mmap_directory(persist_directory):
+    return os.path.join(persist_directory, MMAP_DIRNAME)
+
+def vector_backend(persist_directory):
+    """"mmap" or "chroma": VECTOR_BACKEND when set, else whichever kind of index the directory holds"""
+    backend = os.getenv("VECTOR_BACKEND", "").lower()
+    if backend in ("mmap", "chroma"):
+        return backend
+    if os.path.exists(os.path.join(mmap_directory(persist_directory), HEADER_FILENAME)):
+        return "mmap"
+    return "chroma"
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _quantize(vectors):
+    """Symmetric per-row int8 quantization: (int8 rows, float32 scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _append(path, data, committed_bytes):
+    """Write data after the committed part of a file, dropping anything an interrupted run left"""
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(committed_bytes)
+        f.truncate()
+        f.write(data)
+
+class MmapVectorStore(VectorStore):
+    """Append-only, memory-mapped vector store with the parts of Chroma's API this app uses
+
+    Files are only appended to; `index.json` records how much of each is
+    committed and is replaced last, so readers and interrupted writes never
+    see half a batch. Deletes are tombstoned rows, listed in `index.json` so
+    a replacement's new rows and its old rows' tombstones are committed
+    together, until compaction rewrites the files under a new generation. Readers pick up commits made by another
+    process (the indexer) on their next call.
+    """
+
+    def __init__(self, persist_directory="rag_index", embedding_function=None, dtype="float16", quantize=False,
+                 probes=0):
+        self.persist_directory = persist_directory
+        self.directory = mmap_directory(persist_directory)
+        self._embedding_function = embedding_function
+        # IVF lists searched per query; 0 always searches exactly
+        self.probes = probes
+        self._lock = threading.RLock()
+        self.header = self._read_header() or self._empty_header(dtype, quantize)
+        self._load()
+
+    @staticmethod
+    def _empty_header(dtype, quantize):
+        return {
+            "version": MMAP_VERSION,
+            "generation": 0,
+            "dtype": np.dtype(dtype).name,
+            "quantized": bool(quantize),
+            "dim": None,
+            "rows": 0,
+            "text_bytes": 0,
+            "id_bytes": 0,
+            "deleted": [],
+        }
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def _read_header(self):
+        path = os.path.join(self.directory, HEADER_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("version") != MMAP_VERSION:
+            raise ValueError(f"Unsupported mmap index version in {path}; rebuild or migrate the index")
+        return header
+
+    def _path(self, name, generation=None):
+        generation = self.header["generation"] if generation is None else generation
+        return os.path.join(self.directory, f"{name}.{generation}")
+
+    def _load(self):
+        """Map the committed part of every file and read the row IDs and tombstones"""
+        header = self.header
+        rows, dim = header["rows"], header["dim"]
+        self._vectors = self._int8 = self._scales = self._offsets = self._texts = None
+        self._ids = []
+        if rows:
+            self._vectors = np.memmap(self._path("vectors"), dtype=header["dtype"], mode="r", shape=(rows, dim))
+            if header["quantized"]:
+                self._int8 = np.memmap(self._path("vectors_int8"), dtype=np.int8, mode="r", shape=(rows, dim))
+                self._scales = np.memmap(self._path("scales"), dtype=np.float32, mode="r", shape=(rows,))
+            self._offsets = np.memmap(self._path("offsets"), dtype=np.int64, mode="r", shape=(rows + 1,))
+            self._texts = np.memmap(self._path("chunks"), dtype=np.uint8, mode="r", shape=(header["text_bytes"],))
+            with open(self._path("ids"), "rb") as f:
+                self._ids = f.read(header["id_bytes"]).decode("utf-8").split("\n")[:rows]
+        self._deleted = {row for row in header.get("deleted", []) if row < rows}
+        # Indexes written before tombstones moved into the header keep them in a side file
+        if os.path.exists(self._path("deleted")):
+            with open(self._path("deleted"), "r", encoding="utf-8") as f:
+                self._deleted.update(row for row in json.load(f) if row < rows)
+        self._live = None
+        if self._deleted:
+            self._live = np.ones(rows, dtype=bool)
+            self._live[list(self._deleted)] = False
+        self._row_of = None
+        self._ivf = None
+        if self.probes:
+            ivf = IVFIndex.load(self.persist_directory)
+            # An index built for another generation has stale row numbers
+            if ivf is not None and ivf.generation == header["generation"] and ivf.rows <= rows:
+                self._ivf = ivf
+        self._fingerprint = self._files_fingerprint()
+
+    def _files_fingerprint(self):
+        fingerprint = []
+        for path in (
+            os.path.join(self.directory, HEADER_FILENAME),
+            os.path.join(self.persist_directory, IVF_DIRNAME, "meta.json"),
+        ):
+            try:
+                fingerprint.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    def _refresh(self):
+        """Reload if another process committed since the files were mapped"""
+        if self._files_fingerprint() != self._fingerprint:
+            self.header = self._read_header() or self._empty_header(self.header["dtype"], self.header["quantized"])
+            self._load()
+
+    def _rows_by_id(self):
+        if self._row_of is None:
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._ids) if row not in self._deleted}
+        return self._row_of
+
+    def __len__(self):
+        return self.header["rows"] - len(self._deleted)
+
+    def vectors(self):
+        """The committed embedding matrix (memory-mapped), or None when empty"""
+        with self._lock:
+            self._refresh()
+            return self._vectors
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """Embed and append texts, replacing any stored chunks with the same IDs"""
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding_function.embed_documents(texts)
+        return self.add_vectors(ids, vectors, texts, metadatas)
+
+    def add_vectors(self, ids, vectors, texts, metadatas=None):
+        """Append precomputed embeddings with their texts and metadata; returns the IDs"""
+        if not ids:
+            return []
+        with self._lock:
+            self._refresh()
+            replaced = self._rows_of_ids(ids)
+            header = self._append_rows(self.header, ids, vectors, texts, metadatas)
+            # One header write both adds the new rows and tombstones the ones they replace
+            self._commit(dict(header, deleted=sorted(self._deleted.union(replaced))))
+        return ids
+
+    def _append_rows(self, header, ids, vectors, texts, metadatas):
+        """Write rows after the committed part of `header`'s files; returns the header covering them"""
+        if any("\n" in chunk_id for chunk_id in ids):
+            raise ValueError("Chunk IDs may not contain newlines")
+        vectors = _normalize(vectors)
+        metadatas = metadatas or [{} for _ in ids]
+        header = dict(header)
+        if header["dim"] is None:
+            header["dim"] = int(vectors.shape[1])
+        elif vectors.shape[1] != header["dim"]:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index ({header['dim']})")
+
+        def path(name):
+            return self._path(name, header["generation"])
+
+        os.makedirs(self.directory, exist_ok=True)
+        rows, dim = header["rows"], header["dim"]
+        itemsize = np.dtype(header["dtype"]).itemsize
+        _append(path("vectors"), vectors.astype(header["dtype"]).tobytes(), rows * dim * itemsize)
+        if header["quantized"]:
+            int8, scales = _quantize(vectors)
+            _append(path("vectors_int8"), int8.tobytes(), rows * dim)
+            _append(path("scales"), scales.tobytes(), rows * 4)
+
+        records = [
+            (json.dumps({"id": chunk_id, "text": text, "metadata": metadata or {}}) + "\n").encode("utf-8")
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        offsets = header["text_bytes"] + np.cumsum([0] + [len(record) for record in records], dtype=np.int64)
+        _append(path("chunks"), b"".join(records), header["text_bytes"])
+        # The offsets file holds rows + 1 entries; the first batch writes the leading 0
+        if rows:
+            _append(path("offsets"), offsets[1:].tobytes(), (rows + 1) * 8)
+        else:
+            _append(path("offsets"), offsets.tobytes(), 0)
+        id_block = "".join(f"{chunk_id}\n" for chunk_id in ids).encode("utf-8")
+        _append(path("ids"), id_block, header["id_bytes"])
+
+        header["rows"] = rows + len(ids)
+        header["text_bytes"] = int(offsets[-1])
+        header["id_bytes"] += len(id_block)
+        return header
+
+    def _commit(self, header):
+        """Make `header` current: the rows it covers become visible to every reader"""
+        _write_json(os.path.join(self.directory, HEADER_FILENAME), header)
+        self.header = header
+        self._load()
+
+    def _rows_of_ids(self, ids):
+        row_of = self._rows_by_id()
+        return [row_of[chunk_id] for chunk_id in ids if chunk_id in row_of]
+
+    def delete(self, ids=None, **kwargs):
+        """Tombstone chunks by ID; the rows are reclaimed by compaction"""
+        with self._lock:
+            self._refresh()
+            rows = self._rows_of_ids(list(ids or []))
+            if not rows:
+                return False
+            self._commit(dict(self.header, deleted=sorted(self._deleted.union(rows))))
+            return True
+
+    def delete_collection(self):
+        """Remove every stored chunk and the files holding them"""
+        with self._lock:
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    os.remove(os.path.join(self.directory, name))
+            self.header = self._empty_header(self.header["dtype"], self.header["quantized"])
+            self._load()
+
+    def persist(self):
+        """Compact when deletes have piled up; appends are already durable"""
+        with self._lock:
+            if self.header["rows"] and len(self._deleted) >= COMPACT_THRESHOLD * self.header["rows"]:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the files without deleted rows as a new generation, then drop the old one"""
+        with self._lock:
+            old = self.header
+            live_rows = [row for row in range(old["rows"]) if row not in self._deleted]
+            header = dict(old, generation=old["generation"] + 1, rows=0, text_bytes=0, id_bytes=0, deleted=[])
+            for start in range(0, len(live_rows), COMPACT_BATCH_ROWS):
+                block = live_rows[start:start + COMPACT_BATCH_ROWS]
+                docs = [self._document(row) for row in block]
+                header = self._append_rows(
+                    header,
+                    [self._ids[row] for row in block],
+                    np.asarray(self._vectors[block], dtype=np.float32),
+                    [doc.page_content for doc in docs],
+                    [doc.metadata for doc in docs],
+                )
+            self._commit(header)
+            for name in os.listdir(self.directory):
+                if name.endswith(f".{old['generation']}"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _document(self, row):
+        record = json.loads(bytes(self._texts[self._offsets[row]:self._offsets[row + 1]]))
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def get(self, ids=None, limit=None, offset=None, include=None, **kwargs):
+        """Chroma-style get: stored chunks by ID, or a page of all of them in insertion order"""
+        include = include or ["documents", "metadatas"]
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                row_of = self._rows_by_id()
+                rows = [row_of[chunk_id] for chunk_id in ids if chunk_id in row_of]
+            else:
+                rows = range(self.header["rows"])
+                if self._deleted:
+                    rows = [row for row in rows if row not in self._deleted]
+                start = offset or 0
+                rows = rows[start:start + limit if limit is not None else None]
+            result = {"ids": [self._ids[row] for row in rows]}
+            if "documents" in include or "metadatas" in include:
+                docs = [self._document(row) for row in rows]
+                result["documents"] = [doc.page_content for doc in docs]
+                result["metadatas"] = [doc.metadata for doc in docs]
+            if "embeddings" in include:
+                result["embeddings"] = [np.asarray(self._vectors[row], dtype=np.float32).tolist() for row in rows]
+        return result
+
+    def _scores(self, matrix, query, scales=None, rows=None):
+        """Cosine score of every row, or of `rows`, computed a block at a time"""
+        count = len(matrix) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, BLOCK_ROWS):
+            if rows is None:
+                block = matrix[start:start + BLOCK_ROWS]
+            else:
+                block = matrix[rows[start:start + BLOCK_ROWS]]
+            block = np.asarray(block, dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        if scales is not None:
+            scores *= scales if rows is None else scales[rows]
+        return scores
+
+    def _top_k(self, scores, k, rows=None):
+        """(rows, scores) of the k best live rows, best first; `scores` are for `rows` (default: all)"""
+        if self._live is not None:
+            scores[~(self._live if rows is None else self._live[rows])] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.array([], dtype=np.int64), scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[np.isfinite(scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def _ann_rows(self, query):
+        """Rows to score: the IVF candidates plus rows added since it was updated, or None for all"""
+        if self._ivf is None or not self.probes:
+            return None
+        rows = self._ivf.candidates(query, self.probes)
+        if self._ivf.rows < self.header["rows"]:
+            rows = np.concatenate([rows, np.arange(self._ivf.rows, self.header["rows"])])
+        return rows
+
+    def search_rows(self, embedding, k=4, ids=None):
+        """(row, cosine similarity) of the k nearest live rows, best first
+
+        With `ids`, only the rows of those chunks are scored (exactly).
+        """
+        query = _normalize(embedding)
+        with self._lock:
+            self._refresh()
+            if not len(self):
+                return []
+            if ids is not None:
+                row_of = self._rows_by_id()
+                rows = np.array(sorted({row_of[i] for i in ids if i in row_of}), dtype=np.int64)
+                if not len(rows):
+                    return []
+            else:
+                rows = self._ann_rows(query)
+            if self._int8 is not None:
+                # Cheap int8 pass picks candidates, full-precision vectors rank them
+                scores = self._scores(self._int8, query, self._scales, rows)
+                candidates = np.sort(self._top_k(scores, k * RESCORE_FACTOR, rows)[0])
+                exact = np.asarray(self._vectors[candidates], dtype=np.float32) @ query
+                order = np.argsort(-exact, kind="stable")[:k]
+                rows, scores = candidates[order], exact[order]
+            else:
+                rows, scores = self._top_k(self._scores(self._vectors, query, rows=rows), k, rows)
+        return [(int(row), float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        """(document, cosine distance) pairs, nearest first
+
+        The only filter supported is Chroma's {"chunk_id": {"$in": [...]}}
+        form, which limits the search to those chunk IDs.
+        """
+        ids = None
+        if filter:
+            if list(filter) != ["chunk_id"] or not isinstance(filter["chunk_id"], dict) \
+                    or list(filter["chunk_id"]) != ["$in"]:
+                raise ValueError("The mmap backend only supports {'chunk_id': {'$in': [...]}} filters")
+            ids = filter["chunk_id"]["$in"]
+        hits = self.search_rows(embedding, k, ids)
+        with self._lock:
+            return [(self._document(row), 1.0 - score) for row, score in hits]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k, filter)
+
+    def _select_relevance_score_fn(self):
+        # Cosine distance is in [0, 2]
+        return lambda distance: min(1.0, max(0.0, 1.0 - distance / 2))
+
+    def stats(self):
+        """Row counts and bytes on disk"""
+        files = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        return {
+            "rows": self.header["rows"],
+            "live": len(self),
+            "dim": self.header["dim"],
+            "dtype": self.header["dtype"],
+            "quantized": self.header["quantized"],
+            "ivf_lists": self._ivf.lists if self._ivf is not None else None,
+            "bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in files),
+        }
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory="rag_index",
+                   dtype="float16", quantize=False, **kwargs):
+        store = cls(persist_directory, embedding, dtype=dtype, quantize=quantize)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+def mmap_store_from_env(persist_directory="rag_index", embeddings=None):
+    """MmapVectorStore searching IVF_PROBES lists when an IVF index exists
+
+    MMAP_DTYPE and MMAP_QUANTIZE apply when the index is first created.
+    """
+    return MmapVectorStore(
+        persist_directory,
+        embeddings,
+        dtype=os.getenv("MMAP_DTYPE", "float16"),
+        quantize=os.getenv("MMAP_QUANTIZE", "true").lower() not in ("0", "false", "no"),
+        probes=int(os.getenv("IVF_PROBES", 16)),
+    )
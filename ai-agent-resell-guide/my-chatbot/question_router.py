@@ -0,0 +1,55 @@
+"""
+Question routing for Zendesk ISV Resell Assistant
+Decides whether a question has to be rewritten into a standalone question
+before retrieval, so first turns and self-contained follow-ups skip the
+condense-question model call, and picks the model that does the rewriting
+"""
+
+import os
+import re
+from llm_pool import chat_model, primary_model
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+# Words that usually point back at something said earlier in the conversation
+REFERRING_WORDS = frozenset(
+    "it it's its itself that those these this they them their theirs he him his she her "
+    "one ones same such above previous earlier former latter else again instead".split()
+)
+FOLLOW_UP_OPENERS = ("and", "also", "but", "so", "then", "or", "what about", "how about",
+                     "why", "ok", "okay")
+MIN_STANDALONE_WORDS = 4
+
+def needs_condensing(question, chat_history):
+    """True if the question likely depends on the conversation so far
+
+    Errs towards rewriting: a needless rewrite costs one cheap model call,
+    while a missed one retrieves for a question like "what about the fees?".
+    """
+    if not chat_history:
+        return False
+    words = WORD_PATTERN.findall(question.lower())
+    if len(words) < MIN_STANDALONE_WORDS:
+        return True
+    text = " ".join(words)
+    if any(text == opener or text.startswith(opener + " ") for opener in FOLLOW_UP_OPENERS):
+        return True
+    return any(word in REFERRING_WORDS for word in words)
+
+def question_router_from_env():
+    """The heuristic router, or None (always condense) when QUESTION_ROUTER is false"""
+    if os.getenv("QUESTION_ROUTER", "true").lower() in ("0", "false", "no"):
+        return None
+    return needs_condensing
+
+def condense_llm_from_env(llm):
+    """Model for rewriting follow-ups, CONDENSE_MODEL_NAME from the answer model's provider
+
+    Returns None when unset, so the answer model does the rewriting as before.
+    """
+    model_name = os.getenv("CONDENSE_MODEL_NAME")
+    if not model_name:
+        return None
+    # Compare by name so the other provider's package is never imported; a
+    # provider pool condenses with its first provider
+    provider = "anthropic" if type(primary_model(llm)).__name__ == "ChatAnthropic" else "openai"
+    return chat_model(provider, model=model_name, temperature=0, streaming=False)
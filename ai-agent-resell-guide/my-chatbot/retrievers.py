@@ -0,0 +1,220 @@
+"""
+Retrievers for Zendesk ISV Resell Assistant
+Wrappers around vector store retrievers shared by the CLI and web front ends
+"""
+
+import os
+import time
+import hashlib
+from typing import Any, List, Optional
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from bm25_index import BM25Index
+from metadata_index import MetadataIndex
+from tracing import RETRIEVAL_FILTERS_KEY, STAGE_TIMINGS_EVENT
+
+class SnapshotRetriever(BaseRetriever):
+    """Retrieves from whichever index snapshot is published when the question arrives
+
+    `index` is an index_snapshots.LiveIndex. Chains hold this retriever
+    rather than a snapshot's own, so they follow re-indexing without being
+    rebuilt (and without losing their conversation memory).
+    """
+
+    index: Any
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        retriever = self.index.current().retriever
+        return retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        retriever = (await self.index.acurrent()).retriever
+        return await retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+
+def documents_by_id(vectorstore, ids):
+    """Fetch stored chunks by ID from a Chroma or mmap vector store, in the order given"""
+    if not ids:
+        return []
+    result = vectorstore.get(ids=list(ids), include=["documents", "metadatas"])
+    by_id = {
+        chunk_id: Document(page_content=text, metadata=metadata or {})
+        for chunk_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+def _doc_key(doc):
+    """Chunk ID of a document, or a content hash for chunks indexed without one"""
+    return doc.metadata.get("chunk_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+class HybridRetriever(BaseRetriever):
+    """Fuses BM25 keyword hits and vector similarity hits with reciprocal rank fusion
+
+    Exact terms such as SKU names, "ISV addendum" or "SOW" are found by BM25
+    even when dense similarity ranks them low, so a small k still covers them.
+    Each returned document carries its fused score in metadata["rrf_score"].
+    Without a BM25 index the ranking is plain vector search.
+
+    With a metadata index, both searches only score the chunks matching the
+    filters passed in the run metadata under RETRIEVAL_FILTERS_KEY, or else
+    those inferred from partner and document names in the question. Filters
+    matching no chunk are ignored.
+    """
+
+    vectorstore: Any
+    bm25: Any = None
+    metadata_index: Any = None
+    infer_filters: bool = True
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    vector_weight: float = 1.0
+    bm25_weight: float = 1.0
+
+    def _scope(self, query, run_manager):
+        """(filters, matching chunk IDs) for this question, or (None, None) to search everything"""
+        if self.metadata_index is None:
+            return None, None
+        filters = (run_manager.metadata or {}).get(RETRIEVAL_FILTERS_KEY)
+        if not filters and self.infer_filters:
+            filters = self.metadata_index.infer_filters(query)
+        if not filters:
+            return None, None
+        ids = self.metadata_index.chunk_ids(filters)
+        return (filters, ids) if ids else (None, None)
+
+    def _search_vectors(self, embedding, ids):
+        if ids is None:
+            return self.vectorstore.similarity_search_by_vector(embedding, k=self.fetch_k)
+        return self.vectorstore.similarity_search_by_vector(
+            embedding, k=self.fetch_k, filter={"chunk_id": {"$in": ids}}
+        )
+
+    def _search_keywords(self, query, ids):
+        if self.bm25 is None:
+            return []
+        return self.bm25.search(query, k=self.fetch_k, ids=ids)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        stages = {}
+        cache_hits = {}
+
+        started = time.perf_counter()
+        filters, ids = self._scope(query, run_manager)
+        if self.metadata_index is not None:
+            stages["metadata_filter"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        embeddings = self.vectorstore.embeddings
+        embedding = embeddings.embed_query(query)
+        stages["embed_query"] = time.perf_counter() - started
+        if getattr(embeddings, "last_query_hit", None) is not None:
+            cache_hits["query_embedding"] = embeddings.last_query_hit
+
+        started = time.perf_counter()
+        vector_hits = self._search_vectors(embedding, ids)
+        stages["vector_search"] = time.perf_counter() - started
+
+        if self.bm25 is not None:
+            started = time.perf_counter()
+            keyword_hits = self._search_keywords(query, ids)
+            stages["keyword_search"] = time.perf_counter() - started
+        else:
+            keyword_hits = []
+        run_manager.get_child().on_custom_event(
+            STAGE_TIMINGS_EVENT, {"stages": stages, "cache_hits": cache_hits, "filters": filters}
+        )
+        return self._fuse(vector_hits, keyword_hits)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # Only the query embedding is a network call; the searches run in threads
+        stages = {}
+        cache_hits = {}
+
+        started = time.perf_counter()
+        filters, ids = await run_in_executor(None, self._scope, query, run_manager)
+        if self.metadata_index is not None:
+            stages["metadata_filter"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        embeddings = self.vectorstore.embeddings
+        embedding = await embeddings.aembed_query(query)
+        stages["embed_query"] = time.perf_counter() - started
+        if getattr(embeddings, "last_query_hit", None) is not None:
+            cache_hits["query_embedding"] = embeddings.last_query_hit
+
+        started = time.perf_counter()
+        vector_hits = await run_in_executor(None, self._search_vectors, embedding, ids)
+        stages["vector_search"] = time.perf_counter() - started
+
+        if self.bm25 is not None:
+            started = time.perf_counter()
+            keyword_hits = await run_in_executor(None, self._search_keywords, query, ids)
+            stages["keyword_search"] = time.perf_counter() - started
+        else:
+            keyword_hits = []
+        await run_manager.get_child().on_custom_event(
+            STAGE_TIMINGS_EVENT, {"stages": stages, "cache_hits": cache_hits, "filters": filters}
+        )
+        return await run_in_executor(None, self._fuse, vector_hits, keyword_hits)
+
+    def _fuse(self, vector_hits, keyword_hits):
+        """Rank the union of both hit lists by weighted reciprocal rank"""
+        scores = {}
+        docs = {}
+        for rank, doc in enumerate(vector_hits):
+            key = _doc_key(doc)
+            docs[key] = doc
+            scores[key] = scores.get(key, 0.0) + self.vector_weight / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(keyword_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + self.bm25_weight / (self.rrf_k + rank + 1)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        missing = [key for key in ranked if key not in docs]
+        for doc in documents_by_id(self.vectorstore, missing):
+            docs[doc.metadata.get("chunk_id")] = doc
+
+        results = []
+        for key in ranked:
+            if key in docs:
+                doc = docs[key]
+                doc.metadata["rrf_score"] = scores[key]
+                results.append(doc)
+        return results
+
+def build_retriever(vectorstore, persist_directory="rag_index"):
+    """Hybrid BM25 + vector retriever when a keyword or metadata index exists, else plain vector search
+
+    Configured with RETRIEVER_K, RETRIEVER_FETCH_K, HYBRID_RETRIEVAL,
+    METADATA_FILTERS and INFER_FILTERS.
+    """
+    k = int(os.getenv("RETRIEVER_K", 4))
+    bm25 = None
+    if os.getenv("HYBRID_RETRIEVAL", "true").lower() != "false":
+        bm25 = BM25Index.load(persist_directory)
+    metadata_index = None
+    if os.getenv("METADATA_FILTERS", "true").lower() != "false":
+        metadata_index = MetadataIndex.open(persist_directory)
+    if bm25 is None and metadata_index is None:
+        return vectorstore.as_retriever(search_kwargs={"k": k})
+    return HybridRetriever(
+        vectorstore=vectorstore,
+        bm25=bm25,
+        metadata_index=metadata_index,
+        infer_filters=os.getenv("INFER_FILTERS", "true").lower() != "false",
+        k=k,
+        # Plain vector search only needs k candidates
+        fetch_k=int(os.getenv("RETRIEVER_FETCH_K", 20)) if bm25 is not None else k,
+    )
@@ -0,0 +1,299 @@
+"""
+HTTP service for Zendesk ISV Resell Assistant
+An asyncio (aiohttp) API so Slack bots and other internal tools can ask the
+assistant questions concurrently: per-conversation memory keyed by session
+ID, async model and embedding calls, a bounded number of questions in flight
+with a bounded wait queue, request timeouts and a server-sent-events stream
+"""
+
+# First, so STARTUP_PROFILE=true can time every import below
+import startup_profile
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import contextlib
+from collections import OrderedDict
+from aiohttp import web
+from dotenv import load_dotenv
+from http_clients import http_pool_stats
+from metadata_index import check_filters
+from streaming import astream_chain, serialize_sources
+from tracing import ainvoke_traced
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class Overloaded(Exception):
+    """Raised when every slot is busy and the wait queue is full"""
+
+class AdmissionControl:
+    """Runs at most max_concurrency questions at once and lets at most max_queue wait"""
+
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+class Session:
+    """One conversation: its own chain and memory, used by one request at a time"""
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+class SessionStore:
+    """Conversations by session ID, expiring after `ttl` idle seconds and capped at max_sessions"""
+
+    def __init__(self, assistant, max_sessions=1000, ttl=3600):
+        self.assistant = assistant
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+
+    def get(self, session_id):
+        """The session for an ID, created on first use"""
+        now = time.monotonic()
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_used < self.ttl or oldest.lock.locked():
+                break
+            del self._sessions[oldest_id]
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = Session(self.assistant.new_chain())
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        session.last_used = now
+        return session
+
+    def drop(self, session_id):
+        return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+async def read_question(request):
+    """(session_id, question, filters) from a JSON body, or an HTTP 400"""
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Body must be a JSON object")
+    question = str(body.get("question", "")).strip()
+    if not question:
+        raise web.HTTPBadRequest(text='"question" is required')
+    filters = body.get("filters")
+    if filters is not None:
+        try:
+            check_filters(filters)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+    return str(body.get("session_id") or uuid.uuid4().hex), question, filters
+
+def overloaded_response():
+    return web.json_response(
+        {"error": "Too many requests in flight, retry shortly"}, status=503, headers={"Retry-After": "1"}
+    )
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+class AssistantServer:
+    """Routes and shared state of the HTTP service"""
+
+    def __init__(self, assistant, max_concurrency=8, max_queue=32, request_timeout=60.0,
+                 max_sessions=1000, session_ttl=3600):
+        self.assistant = assistant
+        self.request_timeout = request_timeout
+        self.admission = AdmissionControl(max_concurrency, max_queue)
+        self.sessions = SessionStore(assistant, max_sessions, session_ttl)
+
+    async def session(self, session_id):
+        """The session for an ID; the first one opens the index off the event loop"""
+        if self.assistant.retriever is None:
+            await asyncio.to_thread(self.assistant.open_index)
+        return self.sessions.get(session_id)
+
+    async def ask(self, session_id, question, filters=None):
+        async with self.admission.slot():
+            session = await self.session(session_id)
+            async with session.lock:
+                return await ainvoke_traced(session.chain, question, self.assistant.trace_recorder, filters)
+
+    async def chat(self, request):
+        """POST /chat: answer a question and return it with its sources"""
+        session_id, question, filters = await read_question(request)
+        try:
+            result, trace = await asyncio.wait_for(self.ask(session_id, question, filters), self.request_timeout)
+        except Overloaded:
+            return overloaded_response()
+        except asyncio.TimeoutError:
+            return web.json_response({"error": "Request timed out", "session_id": session_id}, status=504)
+        except Exception as e:
+            # e.g. the model provider failed: answer in JSON like every other error
+            logger.exception("Answering a question for session %s failed", session_id)
+            return web.json_response({"error": str(e), "session_id": session_id}, status=502)
+        return web.json_response({
+            "session_id": session_id,
+            "answer": result["answer"],
+            "sources": serialize_sources(result.get("source_documents", [])),
+            "timings": {"total_time": trace["stages"]["total_time"]},
+        })
+
+    async def chat_stream(self, request):
+        """POST /chat/stream: server-sent events "sources", "token", then "done" or "error" """
+        session_id, question, filters = await read_question(request)
+        deadline = time.monotonic() + self.request_timeout
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                await asyncio.wait_for(stack.enter_async_context(self.admission.slot()), self.request_timeout)
+            except Overloaded:
+                return overloaded_response()
+            except asyncio.TimeoutError:
+                return web.json_response({"error": "Request timed out", "session_id": session_id}, status=504)
+
+            response = web.StreamResponse(headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Session-Id": session_id,
+            })
+            await response.prepare(request)
+            try:
+                session = await asyncio.wait_for(self.session(session_id), deadline - time.monotonic())
+                await asyncio.wait_for(stack.enter_async_context(session.lock), deadline - time.monotonic())
+                events = astream_chain(session.chain, question, self.assistant.trace_recorder, filters)
+                stack.push_async_callback(events.aclose)
+                while True:
+                    try:
+                        kind, payload = await asyncio.wait_for(events.__anext__(), deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        break
+                    if kind == "sources":
+                        await response.write(sse("sources", serialize_sources(payload)))
+                    elif kind == "token":
+                        await response.write(sse("token", {"text": payload}))
+                    elif kind == "done":
+                        await response.write(sse("done", {
+                            "session_id": session_id,
+                            "answer": payload["answer"],
+                            "timings": payload["timings"],
+                            "history_tokens": payload["history_tokens"],
+                        }))
+            except ConnectionResetError:
+                # The client went away; closing the event stream cancels the chain
+                return response
+            except asyncio.TimeoutError:
+                await response.write(sse("error", {"error": "Request timed out"}))
+            except Exception as e:
+                await response.write(sse("error", {"error": str(e)}))
+            await response.write_eof()
+            return response
+
+    async def delete_session(self, request):
+        """DELETE /sessions/{session_id}: forget a conversation"""
+        if not self.sessions.drop(request.match_info["session_id"]):
+            raise web.HTTPNotFound()
+        return web.Response(status=204)
+
+    async def health(self, request):
+        """GET /health: load and session counts, and the index snapshot being served"""
+        return web.json_response(dict(
+            self.admission.stats(), status="ok", sessions=len(self.sessions),
+            index_version=self.assistant.live_index.version,
+        ))
+
+    async def stats(self, request):
+        """GET /stats: rolling per-stage latency percentiles, HTTP pool use, query embedding batching, and per-provider stats for a pool"""
+        summary = self.assistant.trace_recorder.summary()
+        summary["http_pool"] = http_pool_stats()
+        if hasattr(self.assistant.embeddings, "batch_stats"):
+            summary["embedding_batches"] = self.assistant.embeddings.batch_stats()
+        if hasattr(self.assistant.llm, "provider_stats"):
+            summary["llm_providers"] = self.assistant.llm.provider_stats()
+        return web.json_response(summary)
+
+def create_app(assistant, **settings):
+    """aiohttp application serving `assistant`; settings as for AssistantServer"""
+    server = AssistantServer(assistant, **settings)
+    app = web.Application()
+    app["server"] = server
+    app.add_routes([
+        web.post("/chat", server.chat),
+        web.post("/chat/stream", server.chat_stream),
+        web.delete("/sessions/{session_id}", server.delete_session),
+        web.get("/health", server.health),
+        web.get("/stats", server.stats),
+    ])
+    return app
+
+def settings_from_env():
+    """AssistantServer settings from SERVER_* and SESSION_* environment variables"""
+    return {
+        "max_concurrency": int(os.getenv("SERVER_MAX_CONCURRENCY", 8)),
+        "max_queue": int(os.getenv("SERVER_MAX_QUEUE", 32)),
+        "request_timeout": float(os.getenv("SERVER_REQUEST_TIMEOUT", 60)),
+        "max_sessions": int(os.getenv("SESSION_MAX_COUNT", 1000)),
+        "session_ttl": float(os.getenv("SESSION_TTL", 3600)),
+    }
+
+def main():
+    """Run the HTTP service"""
+    from main import ZendeskISVAssistant
+
+    parser = argparse.ArgumentParser(description="Zendesk ISV Resell Assistant HTTP service")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", 8080)))
+    args = parser.parse_args()
+
+    with startup_profile.stage("ZendeskISVAssistant()"):
+        assistant = ZendeskISVAssistant()
+    if not assistant.index_available:
+        return
+    settings = settings_from_env()
+    startup_profile.report()
+    print(f"🌐 Serving on http://{args.host}:{args.port} "
+          f"({settings['max_concurrency']} concurrent, {settings['max_queue']} queued)")
+    web.run_app(create_app(assistant, **settings), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Startup profiling for Zendesk ISV Resell Assistant
+With STARTUP_PROFILE=true, every module import is timed (self time, grouped by
+top-level package) along with each named initialization step, and a report is
+printed once the app is ready. The apps import this module first so the hook
+sees every import after it. Run it directly to profile the CLI assistant's
+startup and, optionally, its first question
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import contextlib
+
+# Set in the real environment: .env is only read after the heavy imports
+ENABLED = os.getenv("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes")
+
+class StartupProfiler:
+    """Import hook plus named stages; all times in seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports = {}
+        self.stages = []
+        self._local = threading.local()
+
+    def install(self):
+        """Time every module executed from now on"""
+        sys.meta_path.insert(0, _ImportTimer(self))
+
+    def _record_import(self, name, seconds):
+        package = name.split(".")[0]
+        total, count = self.imports.get(package, (0.0, 0))
+        self.imports[package] = (total + seconds, count + 1)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def report(self, top=15):
+        """Plain-text report: stages in order, then the slowest packages to import"""
+        lines = [f"⏱️  Startup profile: {time.perf_counter() - self.started:.2f}s since the hook was installed"]
+        if self.stages:
+            lines.append("Initialization steps (including imports they trigger):")
+            for name, seconds in self.stages:
+                lines.append(f"  {name:<40}{seconds:>8.3f}s")
+        packages = sorted(self.imports.items(), key=lambda item: -item[1][0])
+        total = sum(seconds for seconds, _ in self.imports.values())
+        lines.append(f"Imports: {total:.2f}s self time across {sum(n for _, n in self.imports.values())} module(s)")
+        for package, (seconds, count) in packages[:top]:
+            lines.append(f"  {package:<40}{seconds:>8.3f}s  {count:>4} module(s)")
+        return "\n".join(lines)
+
+class _ImportTimer:
+    """Meta path finder that wraps each found module's exec_module with a timer"""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # Built-in and frozen importers are shared classes; file loaders are per module
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            loader.exec_module = self._timed(name, loader.exec_module)
+        return spec
+
+    def _timed(self, name, exec_module):
+        profiler = self.profiler
+
+        def exec_module_timed(module):
+            stack = profiler._stack()
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                profiler._record_import(name, elapsed - children)
+        return exec_module_timed
+
+_profiler = None
+
+def enable():
+    """Install the import hook (once) and start collecting"""
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        _profiler.install()
+    return _profiler
+
+def stage(name):
+    """Time a named initialization step; a no-op unless profiling is enabled"""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+def report(top=15):
+    """Print the profile, if profiling is enabled"""
+    if _profiler is not None:
+        print(_profiler.report(top))
+
+if ENABLED and __name__ != "__main__":
+    enable()
+
+def main():
+    """Profile constructing the CLI assistant and, optionally, answering one question"""
+    parser = argparse.ArgumentParser(description="Report import and initialization cost at startup")
+    parser.add_argument("--question", help="Also time a first question, which opens the index")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    args = parser.parse_args()
+
+    # The apps import this module by name; share its profiler rather than __main__'s
+    import startup_profile
+    startup_profile.enable()
+    with startup_profile.stage("import main"):
+        from main import ZendeskISVAssistant
+    with startup_profile.stage("ZendeskISVAssistant()"):
+        assistant = ZendeskISVAssistant()
+    if args.question:
+        with startup_profile.stage("first question"):
+            assistant.get_response(args.question)
+    startup_profile.report(args.top)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Response streaming for Zendesk ISV Resell Assistant
+Runs a ConversationalRetrievalChain in a worker thread (or as an asyncio task)
+and turns its callbacks into a stream of events: the retrieved sources as soon
+as retrieval finishes, then answer tokens as the model produces them
+"""
+
+import time
+import queue
+import asyncio
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from conversation_memory import history_tokens
+from tracing import CONTEXT_DOCUMENTS_EVENT, RequestTracer, chain_config
+
+class StreamingHandler(BaseCallbackHandler):
+    """Forwards retrieval results and answer tokens to a queue
+
+    Sources are published when generation starts, by which point any
+    post-retrieval packing has settled the documents the answer will use.
+    """
+
+    # Called on the event loop in async runs, keeping tokens in order
+    run_inline = True
+
+    def __init__(self, events):
+        self.events = events
+        self.retrieved = False
+        self.answered = False
+        self._sources = None
+        self._retriever_runs = set()
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._retriever_runs.add(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, parent_run_id=None, **kwargs):
+        # Only the outermost retriever's documents are the ones the chain uses
+        if parent_run_id not in self._retriever_runs:
+            self.retrieved = True
+            self._sources = documents
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == CONTEXT_DOCUMENTS_EVENT:
+            self.retrieved = True
+            self._sources = data
+
+    def publish_sources(self):
+        if self._sources is not None:
+            self.events.put(("sources", self._sources))
+            self._sources = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        if self.retrieved:
+            self.publish_sources()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        if self.retrieved:
+            self.publish_sources()
+
+    def on_llm_new_token(self, token, **kwargs):
+        # Tokens before retrieval belong to the question-condensing step, and
+        # tokens after the answer to the memory summarizing older turns
+        if self.retrieved and not self.answered and token:
+            self.events.put(("token", token))
+
+    def on_llm_end(self, response, **kwargs):
+        if self.retrieved:
+            self.answered = True
+
+class _EventStream:
+    """Turns raw queue events into stream events, stamping timings on the way"""
+
+    def __init__(self, tracer, history, recorder):
+        self.tracer = tracer
+        self.history = history
+        self.recorder = recorder
+        self.start = time.perf_counter()
+        self.timings = {"time_to_sources": None, "time_to_first_token": None, "total_time": None}
+        self.sent_sources = False
+
+    def events_for(self, kind, payload):
+        elapsed = time.perf_counter() - self.start
+        if kind == "sources":
+            if self.timings["time_to_sources"] is None:
+                self.timings["time_to_sources"] = elapsed
+            self.sent_sources = True
+            return [(kind, payload)]
+        if kind == "token":
+            if self.timings["time_to_first_token"] is None:
+                self.timings["time_to_first_token"] = elapsed
+            return [(kind, payload)]
+        if kind == "error":
+            raise payload
+        # Answers served without retrieval (e.g. from the answer cache)
+        # still report their sources before finishing
+        events = []
+        if not self.sent_sources and payload.get("source_documents"):
+            self.timings["time_to_sources"] = elapsed
+            events.append(("sources", payload["source_documents"]))
+        self.timings["total_time"] = elapsed
+        trace = self.tracer.finish(self.timings, history_tokens=self.history)
+        if self.recorder is not None:
+            self.recorder.record(trace)
+        events.append(("done", dict(payload, timings=self.timings, history_tokens=self.history, trace=trace)))
+        return events
+
+def stream_chain(qa_chain, question, recorder=None, filters=None):
+    """Yield ("sources", docs), ("token", text) and finally ("done", result)
+
+    The final result is the chain output plus a "timings" dict with
+    time_to_sources, time_to_first_token and total_time in seconds (None when
+    a stage never happened, e.g. a model that doesn't stream), and
+    "history_tokens", the size of the conversation history sent with this
+    question. The request's trace is included as "trace" and, when a
+    TraceRecorder is given, recorded there. `filters` scope retrieval to
+    matching chunks. Exceptions raised by the chain are re-raised in the
+    caller's thread.
+    """
+    events = queue.Queue()
+    handler = StreamingHandler(events)
+    tracer = RequestTracer(question)
+    stream = _EventStream(tracer, history_tokens(getattr(qa_chain, "memory", None)), recorder)
+
+    def run():
+        try:
+            result = qa_chain.invoke({"question": question}, config=chain_config([handler, tracer], filters))
+            handler.publish_sources()
+            events.put(("result", result))
+        except Exception as e:
+            events.put(("error", e))
+
+    threading.Thread(target=run, daemon=True).start()
+
+    while True:
+        for event in stream.events_for(*events.get()):
+            yield event
+            if event[0] == "done":
+                return
+
+class _LoopQueue:
+    """queue.Queue-style put() into an asyncio.Queue, safe from any thread"""
+
+    def __init__(self, loop, events):
+        self.loop = loop
+        self.events = events
+        self.thread = threading.get_ident()
+
+    def put(self, item):
+        if threading.get_ident() == self.thread:
+            self.events.put_nowait(item)
+        else:
+            self.loop.call_soon_threadsafe(self.events.put_nowait, item)
+
+async def astream_chain(qa_chain, question, recorder=None, filters=None):
+    """Async counterpart of stream_chain, running the chain on the caller's event loop
+
+    Closing the generator early cancels the chain run.
+    """
+    events = asyncio.Queue()
+    sink = _LoopQueue(asyncio.get_running_loop(), events)
+    handler = StreamingHandler(sink)
+    tracer = RequestTracer(question)
+    stream = _EventStream(tracer, history_tokens(getattr(qa_chain, "memory", None)), recorder)
+
+    async def run():
+        try:
+            result = await qa_chain.ainvoke({"question": question}, config=chain_config([handler, tracer], filters))
+            handler.publish_sources()
+            sink.put(("result", result))
+        except Exception as e:
+            sink.put(("error", e))
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            for event in stream.events_for(*await events.get()):
+                yield event
+                if event[0] == "done":
+                    return
+    finally:
+        task.cancel()
+
+def serialize_sources(docs):
+    """JSON-friendly source list with a short preview of each chunk"""
+    return [
+        {
+            "source": doc.metadata.get("source", "Unknown"),
+            "page": doc.metadata.get("page"),
+            "section": doc.metadata.get("section"),
+            "preview": doc.page_content[:300],
+        }
+        for doc in docs
+    ]
+
+def format_timings(timings):
+    """Short human-readable latency summary for a streamed answer"""
+    parts = []
+    if timings.get("time_to_sources") is not None:
+        parts.append(f"sources in {timings['time_to_sources']:.2f}s")
+    if timings.get("time_to_first_token") is not None:
+        parts.append(f"first token in {timings['time_to_first_token']:.2f}s")
+    if timings.get("total_time") is not None:
+        parts.append(f"total {timings['total_time']:.2f}s")
+    return ", ".join(parts)
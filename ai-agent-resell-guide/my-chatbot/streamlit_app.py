@@ -3,18 +3,31 @@ Zendesk ISV Resell Assistant - Streamlit Web Application
 A helpful assistant for Zendesk sales representatives to navigate ISV reselling processes
 """
 
+# First, so STARTUP_PROFILE=true can time every import below
+import startup_profile
 import streamlit as st
 import os
+import threading
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_anthropic import ChatAnthropic
-from langchain_chroma import Chroma
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from embedding_cache import cache_embeddings
+from embedding_batcher import batch_query_embeddings
+from mmap_store import mmap_store_from_env, vector_backend
+from answer_cache import answer_cache_from_env
+from llm_pool import llm_from_env
+from http_clients import openai_embeddings, http_pool_stats
+from context_packing import context_packer_from_env
+from conversation_memory import build_memory
+from question_router import question_router_from_env, condense_llm_from_env
+from retrievers import SnapshotRetriever, build_retriever, documents_by_id
+from index_snapshots import LiveIndex
+from streaming import stream_chain, format_timings
+from tracing import trace_recorder_from_env, invoke_traced
 
 
 import os
 import glob
+import logging
+import itertools
 from dotenv import load_dotenv
 
 
@@ -24,6 +37,7 @@ os.environ["LANGCHAIN_TRACING_V2"] = "false"
 os.environ["LANGCHAIN_ENDPOINT"] = ""
 # Load environment variables
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 
 # Page configuration
 st.set_page_config(
@@ -93,41 +107,212 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+class SharedResources:
+    """Clients and index handles shared by every session in this process
+
+    The index and everything built on it (embeddings, retriever, caches) is
+    opened by the first question instead of at page load, and follows newly
+    published index snapshots without a restart.
+    """
+    def __init__(self, llm, condense_llm, trace_recorder):
+        self.llm = llm
+        self.condense_llm = condense_llm
+        self.trace_recorder = trace_recorder
+        self.embeddings = None
+        self.query_embeddings = None
+        self.live_index = LiveIndex("rag_index", self.open_snapshot)
+        self.retriever = None
+        self.answer_cache = None
+        self.context_packer = None
+        self._lock = threading.Lock()
+
+    def open_snapshot(self, path):
+        """Open the vector store and retriever of one index snapshot directory"""
+        if vector_backend(path) == "mmap":
+            vectorstore = mmap_store_from_env(path, self.embeddings)
+        else:
+            from langchain_chroma import Chroma
+            vectorstore = Chroma(
+                persist_directory=path,
+                embedding_function=self.embeddings
+            )
+        return vectorstore, build_retriever(vectorstore, path)
+
+    def open_index(self):
+        """Open the published index and build the retriever and caches, once per process"""
+        with self._lock:
+            if self.retriever is not None:
+                return
+            with startup_profile.stage("open index"):
+                # Questions from every session share embedding requests
+                self.query_embeddings = batch_query_embeddings(openai_embeddings())
+                self.embeddings = cache_embeddings(self.query_embeddings)
+                self.live_index.current()
+                self.retriever = SnapshotRetriever(index=self.live_index)
+                self.answer_cache = answer_cache_from_env(
+                    self.embeddings, lambda: self.live_index.current().vectorstore, "rag_index"
+                )
+                self.context_packer = context_packer_from_env()
+
+@st.cache_resource(show_spinner="Starting assistant...")
+def get_shared_resources():
+    """Build the LLM once per process; the index waits for the first question"""
+    with startup_profile.stage("shared resources"):
+        llm = llm_from_env()
+        resources = SharedResources(llm, condense_llm_from_env(llm), trace_recorder_from_env())
+    startup_profile.report()
+    return resources
+
 class StreamlitApp:
     def __init__(self):
-        # Initialize LLM
-        self.llm = ChatOpenAI(
-            model="gpt-4",
-            temperature=0.7,
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-        # Initialize Embeddings and Vectorstore
-        embeddings = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-        self.vectorstore = Chroma(
-            persist_directory="rag_index",
-            embedding_function=embeddings
-        )
-        # Initialize Memory
-        memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            output_key="answer"
-        )
-        # Initialize QA Chain
-        self.qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=self.vectorstore.as_retriever(),
-            memory=memory,
-            return_source_documents=True,
-            output_key="answer"
-        )
+        # Shared, process-wide LLM and vector store
+        self.resources = get_shared_resources()
+        self.llm = self.resources.llm
+        self.trace_recorder = self.resources.trace_recorder
+        self._qa_chain = None
+
+    @property
+    def answer_cache(self):
+        """The shared answer cache, or None until the index has been opened"""
+        return self.resources.answer_cache
 
-    def get_response(self, user_input):
-        result = self.qa_chain.invoke({"question": user_input})
+    @property
+    def qa_chain(self):
+        """This session's chain, built on its first question (opening the shared index if needed)"""
+        if self._qa_chain is None:
+            # LangChain's legacy chains load here, with the first question, not at startup
+            from assistant_chain import AssistantRetrievalChain
+            resources = self.resources
+            resources.open_index()
+            self._qa_chain = AssistantRetrievalChain.from_llm(
+                llm=self.llm,
+                retriever=resources.retriever,
+                condense_question_llm=resources.condense_llm,
+                # Per-session memory: recent turns plus a summary of older ones
+                memory=build_memory(self.llm),
+                return_source_documents=True,
+                output_key="answer",
+                answer_cache=self.answer_cache,
+                context_packer=resources.context_packer,
+                question_router=question_router_from_env()
+            )
+        return self._qa_chain
+
+    def get_response(self, user_input, filters=None):
+        result, _ = invoke_traced(self.qa_chain, user_input, self.trace_recorder, filters)
         response = result["answer"]
         source_docs = result.get("source_documents", [])
         return response, source_docs
 
+    def stream_response(self, user_input, filters=None):
+        """Stream the response as ("sources", docs), ("token", text) and ("done", result) events
+
+        Errors (opening the index included) end the stream with a "done"
+        event carrying the error as the answer, so the chat history stays
+        a user/assistant pair per question.
+        """
+        try:
+            yield from stream_chain(self.qa_chain, user_input, self.trace_recorder, filters)
+        except Exception as e:
+            yield "done", {"answer": f"Error generating response: {e}", "source_documents": [], "timings": {}}
+
+PREVIEW_CHARS = 300
+
+def preview_text(text):
+    return text[:PREVIEW_CHARS] + "..." if len(text) > PREVIEW_CHARS else text
+
+def compact_sources(docs):
+    """Labels, chunk IDs and offsets of an answer's sources, for the chat history
+
+    The chunk text stays in the index; previews are looked up by chunk ID
+    when the sources are opened.
+    """
+    records = []
+    for doc in docs:
+        metadata = doc.metadata
+        chunk_ids = [c for c in metadata.get("merged_chunk_ids", [metadata.get("chunk_id")]) if c]
+        record = {
+            "source": metadata.get("source", "Unknown"),
+            "section": metadata.get("section"),
+            "start": metadata.get("start_index"),
+        }
+        if chunk_ids:
+            record["chunk_ids"] = chunk_ids
+        else:
+            # Not addressable by ID (e.g. indexed by an older version), so keep the preview itself
+            record["preview"] = preview_text(doc.page_content)
+        records.append(record)
+    return records
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def chunk_previews(version, chunk_ids, _vectorstore):
+    """Previews of stored chunks by ID, cached per index snapshot; None for chunks no longer indexed"""
+    found = {doc.metadata.get("chunk_id"): doc for doc in documents_by_id(_vectorstore, list(chunk_ids))}
+    return [preview_text(found[c].page_content) if c in found else None for c in chunk_ids]
+
+def source_label(i, record):
+    return f"**Source {i}:** {record['source']}" + (f" — {record['section']}" if record["section"] else "")
+
+def render_sources(records, key, resources):
+    """Sources of an answer; their previews are only fetched while the expander is open"""
+    expander = st.expander(f"📚 Sources ({len(records)})", key=key, on_change="rerun")
+    with expander:
+        if not expander.open:
+            return
+        # A merged source starts with its first chunk
+        ids = tuple(record["chunk_ids"][0] for record in records if "chunk_ids" in record)
+        previews = iter(())
+        if ids and resources.retriever is not None:
+            snapshot = resources.live_index.current()
+            previews = iter(chunk_previews(snapshot.version, ids, snapshot.vectorstore))
+        for i, record in enumerate(records, 1):
+            st.markdown(source_label(i, record))
+            preview = record.get("preview") if "chunk_ids" not in record else next(previews, None)
+            if preview is None:
+                st.caption("No longer in the index")
+            else:
+                st.text(preview)
+
+def render_message(message, key, resources):
+    """One chat history entry, rendered from its compact record"""
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("sources"):
+            render_sources(message["sources"], key, resources)
+        if message.get("caption"):
+            st.caption(message["caption"])
+
+def render_latency_panel(recorder):
+    """Sidebar table of p50/p95/p99 latency per stage with a JSONL export"""
+    summary = recorder.summary()
+    with st.expander(f"⏱️ Latency ({summary['requests']} recent requests)"):
+        if not summary["requests"]:
+            st.caption("No requests traced yet.")
+            return
+        st.dataframe(
+            [
+                {"stage": stage, "n": row["count"], "p50 (s)": round(row["p50"], 3),
+                 "p95 (s)": round(row["p95"], 3), "p99 (s)": round(row["p99"], 3)}
+                for stage, row in summary["stages"].items()
+            ],
+            hide_index=True
+        )
+        for cache, rate in summary["cache_hit_rates"].items():
+            st.caption(f"{cache} hit rate: {rate:.0%}")
+        st.download_button(
+            "Download traces (JSONL)",
+            recorder.to_jsonl(),
+            file_name="traces.jsonl",
+            mime="application/jsonl"
+        )
+
+def status_caption(timings, history_tokens=None):
+    """Latency and conversation-history size shown under an answer"""
+    caption = f"⏱️ {format_timings(timings)}"
+    if history_tokens is not None:
+        caption += f" · 🧠 history {history_tokens} tokens"
+    return caption
+
 def main():
     """Main Streamlit application"""
     st.markdown('<h1 class="main-header">🤖 Zendesk ISV Resell Assistant</h1>', unsafe_allow_html=True)
@@ -157,39 +342,72 @@ def main():
             st.error("❌ No API key found")
         
         # Vector store status
-        if os.path.exists("rag_index"):
+        live_index = st.session_state.assistant.resources.live_index
+        if live_index.exists():
             st.success("✅ RAG index found")
+            if live_index.version:
+                st.caption(f"Serving index snapshot {live_index.version}")
         else:
             st.warning("⚠️ RAG index not found")
         
+        # Answer cache effectiveness (shared by all sessions, once the index is open)
+        answer_cache = st.session_state.assistant.answer_cache
+        if answer_cache is not None:
+            cache_stats = answer_cache.stats()
+            st.metric(
+                "⚡ Answer cache hit rate",
+                f"{cache_stats['hit_rate']:.0%}",
+                help=f"{cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es), "
+                     f"{cache_stats['entries']} cached answer(s)"
+            )
+        
+        # Shared HTTP connection pool (all sessions and providers)
+        http_stats = http_pool_stats()
+        st.metric(
+            "🔌 HTTP connections busy",
+            f"{http_stats['open_connections'] - http_stats['idle_connections']} / {http_stats['max_connections']}",
+            help=f"{http_stats['requests']} request(s) over {http_stats['connections_opened']} connection(s) opened, "
+                 f"{http_stats['idle_connections']} idle, peak {http_stats['peak_in_flight']} in flight"
+        )
+        
+        # Query embedding batching across sessions
+        query_embeddings = st.session_state.assistant.resources.query_embeddings
+        if hasattr(query_embeddings, "batch_stats"):
+            batch_stats = query_embeddings.batch_stats()
+            latency = batch_stats["added_latency_ms"]
+            st.metric(
+                "🧮 Questions per embedding request",
+                f"{batch_stats['batch_size']['mean']:.1f}",
+                help=f"{batch_stats['queries']} question(s) in {batch_stats['requests']} request(s); "
+                     f"batching added {latency.get('p50', 0):.1f}ms p50, {latency.get('p95', 0):.1f}ms p95"
+            )
+        
+        # Rolling per-stage latency (shared by all sessions)
+        render_latency_panel(st.session_state.assistant.trace_recorder)
+        
         st.divider()
         
         # Quick Questions
         st.header("💡 Quick Questions")
         st.markdown("Click any question to ask it:")
         
+        # Each question only searches the document types that answer it
+        # (filters matching no indexed chunk are ignored)
         quick_questions = [
-            "What are the steps for ISV reselling?",
-            "How do I create a sales order for an ISV?",
-            "What approvals do I need for ISV deals?",
-            "How do I price ISV products?",
-            "What documentation is required?",
-            "How do I handle implementation costs?",
-            "What's the approval workflow?",
-            "How do I validate ISV compatibility?"
+            ("What are the steps for ISV reselling?", {"doc_type": "instructions"}),
+            ("How do I create a sales order for an ISV?", {"doc_type": "instructions"}),
+            ("What approvals do I need for ISV deals?", None),
+            ("How do I price ISV products?", {"doc_type": "pricing"}),
+            ("What documentation is required?", {"doc_type": ["form", "contract"]}),
+            ("How do I handle implementation costs?", {"doc_type": ["form", "pricing"]}),
+            ("What's the approval workflow?", None),
+            ("How do I validate ISV compatibility?", {"doc_type": ["enablement", "instructions"]})
         ]
         
-        for question in quick_questions:
+        for question, filters in quick_questions:
             if st.button(question, key=f"quick_{question[:20]}"):
-                st.session_state.messages.append({"role": "user", "content": question})
-                with st.spinner("Getting response..."):
-                    response, sources = st.session_state.assistant.get_response(question)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response,
-                        "sources": sources
-                    })
-                st.rerun()
+                # Answered (and streamed) by the chat area below
+                st.session_state.pending_question = (question, filters)
         
         st.divider()
         
@@ -221,26 +439,23 @@ def main():
     chat_container = st.container()
     
     with chat_container:
-        # Display chat messages
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
-                if "sources" in message and message["sources"]:
-                    with st.expander(f"📚 Sources ({len(message['sources'])})"):
-                        for i, doc in enumerate(message["sources"]):
-                            source = doc.metadata.get('source', 'Unknown')
-                            st.write(f"**Source {i+1}:** {source}")
-                            # Show preview of content
-                            content_preview = doc.page_content[:300] + "..." if len(doc.page_content) > 300 else doc.page_content
-                            st.text_area(
-                                f"Content preview {i+1}:",
-                                content_preview,
-                                height=100,
-                                key=f"preview_{id(message)}_{i}"
-                            )
+        # Display chat messages; only the most recent ones unless asked, so reruns stay cheap
+        resources = st.session_state.assistant.resources
+        messages = st.session_state.messages
+        visible = int(os.getenv("CHAT_VISIBLE_MESSAGES", 20))
+        first = max(len(messages) - visible, 0)
+        if first and st.toggle(f"Show {first} earlier message(s)", key="show_earlier_messages"):
+            first = 0
+        for i in range(first, len(messages)):
+            render_message(messages[i], f"sources_{i}", resources)
         
-        # Chat input
-        if prompt := st.chat_input("Ask about ISV reselling processes..."):
+        # Chat input (or a quick question clicked in the sidebar)
+        prompt = st.chat_input("Ask about ISV reselling processes...")
+        filters = None
+        pending = st.session_state.pop("pending_question", None)
+        if not prompt and pending:
+            prompt, filters = pending
+        if prompt:
             # Add user message to chat history
             st.session_state.messages.append({"role": "user", "content": prompt})
             
@@ -248,32 +463,46 @@ def main():
             with st.chat_message("user"):
                 st.markdown(prompt)
             
-            # Get assistant response
+            # Stream assistant response
             with st.chat_message("assistant"):
+                answer_placeholder = st.empty()
+                sources_placeholder = st.empty()
+                timings_placeholder = st.empty()
+                response, sources, timings, history = "", [], {}, None
+                events = st.session_state.assistant.stream_response(prompt, filters)
                 with st.spinner("🤖 Thinking..."):
-                    response, sources = st.session_state.assistant.get_response(prompt)
-                    st.markdown(response)
-                    
-                    # Display sources if available
-                    if sources:
-                        with st.expander(f"📚 Sources ({len(sources)})"):
-                            for i, doc in enumerate(sources):
-                                source = doc.metadata.get('source', 'Unknown')
-                                st.write(f"**Source {i+1}:** {source}")
-                                # Show preview of content
-                                content_preview = doc.page_content[:300] + "..." if len(doc.page_content) > 300 else doc.page_content
-                                st.text_area(
-                                    f"Content preview {i+1}:",
-                                    content_preview,
-                                    height=100,
-                                    key=f"preview_current_{id(response)}_{i}"
-                                )
+                    # Wait for retrieval to finish before dropping the spinner
+                    first_event = next(events)
+                for kind, payload in itertools.chain([first_event], events):
+                    if kind == "sources":
+                        sources = compact_sources(payload)
+                        # List sources as soon as retrieval finishes (previews once the answer is done,
+                        # since opening them reruns the script)
+                        if sources:
+                            sources_placeholder.caption(
+                                "📚 " + " · ".join(dict.fromkeys(record["source"] for record in sources))
+                            )
+                    elif kind == "token":
+                        response += payload
+                        answer_placeholder.markdown(response + "▌")
+                    elif kind == "done":
+                        response = payload["answer"]
+                        timings = payload.get("timings", {})
+                        history = payload.get("history_tokens")
+                answer_placeholder.markdown(response)
+                if sources:
+                    with sources_placeholder.container():
+                        render_sources(sources, f"sources_{len(st.session_state.messages)}", resources)
+                caption = status_caption(timings, history) if timings else None
+                if caption:
+                    timings_placeholder.caption(caption)
             
-            # Add assistant response to chat history
+            # Add assistant response to chat history, keeping only what re-rendering it needs
             st.session_state.messages.append({
                 "role": "assistant", 
                 "content": response,
-                "sources": sources
+                "sources": sources,
+                "caption": caption
             })
     
     # Footer
@@ -0,0 +1,33 @@
+"""
+Shared pytest fixtures: the chatbot modules on sys.path and fake OpenAI servers
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openai_server import start_in_thread
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Start a fake OpenAI-compatible server; call with make_server kwargs, returns (server, base_url)"""
+    servers = []
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+
+    def start(**kwargs):
+        kwargs.setdefault("dim", 8)
+        server, base_url = start_in_thread(port=0, **kwargs)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def fake_embeddings(base_url):
+    """OpenAI embeddings on a fake server, without the SDK's own retries"""
+    from http_clients import openai_embeddings
+    return openai_embeddings(base_url=base_url, max_retries=0)
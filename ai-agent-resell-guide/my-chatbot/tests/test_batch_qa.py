@@ -0,0 +1,64 @@
+import os
+import json
+import asyncio
+from batch_qa import BatchRun, group_duplicates, load_finished, load_questions
+from conftest import fake_embeddings
+from index_documents import update_index
+
+def write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(lines))
+
+def test_repeated_questions_share_a_group(tmp_path):
+    path = str(tmp_path / "questions.jsonl")
+    write_lines(path, [json.dumps(item) + "\n" for item in [
+        {"question": "Which forms do I need?"},
+        {"question": "  which FORMS do i   need? "},
+        {"question": "Which forms do I need?", "filters": {"partner": "Zuper"}},
+        {"question": "What discount applies?"},
+    ]])
+    groups = group_duplicates(load_questions(path))
+    assert [[item["row"] for item in group] for group in groups] == [[1, 2], [3], [4]]
+
+def test_failed_and_torn_results_are_retried(tmp_path):
+    path = str(tmp_path / "answers.jsonl")
+    write_lines(path, [
+        json.dumps({"id": "a", "status": "ok", "answer": "A"}) + "\n",
+        json.dumps({"id": "b", "status": "error", "error": "Timed out"}) + "\n",
+        json.dumps({"id": "c", "status": "ok", "answer": "C"}) + "\n",
+        '{"id": "d", "status": "ok", "ans',
+    ])
+    assert load_finished(path) == {"a", "c"}
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["a", "c"]
+    assert load_finished(str(tmp_path / "missing.jsonl")) == set()
+
+def test_questions_are_embedded_once_up_front(tmp_path, monkeypatch, fake_openai):
+    from main import ZendeskISVAssistant
+
+    server, base_url = fake_openai()
+    monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite3"))
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "guide.txt").write_text("Resell deals need the ISV addendum and a signed order form.\n")
+    index = str(tmp_path / "rag_index")
+    update_index(str(docs), index, embeddings=fake_embeddings(base_url), backend="mmap")
+
+    assistant = ZendeskISVAssistant(persist_directory=index)
+    assert assistant.open_index()
+    questions = ["Which forms do I need?", "What discount applies?", "Who approves ISV deals?"]
+    groups = [[{"id": f"q{i}", "row": i, "question": question, "filters": None}]
+              for i, question in enumerate(questions, 1)]
+    batch = BatchRun(assistant, str(tmp_path / "answers.jsonl"))
+
+    async def run():
+        before = server.embedding_requests
+        await batch.prefetch_embeddings(questions)
+        prefetched = server.embedding_requests
+        await batch.run(groups)
+        return prefetched - before, server.embedding_requests - prefetched
+
+    assert asyncio.run(run()) == (1, 0)
+    assert batch.done == 3 and batch.failed == 0
+    assert os.path.exists(str(tmp_path / "answers.jsonl"))
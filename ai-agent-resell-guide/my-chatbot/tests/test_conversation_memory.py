@@ -0,0 +1,32 @@
+from langchain_core.language_models import FakeListChatModel
+from conversation_memory import build_memory, estimate_message_tokens, history_tokens
+
+class TokenizedModel(FakeListChatModel):
+    """Counts one token per word, or fails like a tokenizer that can't be downloaded"""
+
+    tokenizer_works: bool = True
+    counts: int = 0
+
+    def get_num_tokens_from_messages(self, messages, *args, **kwargs):
+        self.counts += 1
+        if not self.tokenizer_works:
+            raise OSError("encoding not available offline")
+        return sum(len(message.content.split()) for message in messages)
+
+def remember(memory, question, answer):
+    memory.save_context({"question": question}, {"answer": answer})
+
+def test_a_failed_tokenizer_only_affects_its_own_memory():
+    offline = TokenizedModel(responses=["summary"], tokenizer_works=False)
+    online = TokenizedModel(responses=["summary"])
+    estimated, counted = build_memory(offline), build_memory(online)
+    for memory in (estimated, counted):
+        remember(memory, "Which forms do I need?", "The ISV addendum and an order form.")
+
+    messages = estimated.chat_memory.messages
+    assert history_tokens(estimated) == estimate_message_tokens(messages)
+    assert history_tokens(estimated) == estimate_message_tokens(messages)
+    # Tried once when saving, then never again
+    assert offline.counts == 1
+    assert history_tokens(counted) == 12
+    assert not counted.tokenizer_failed
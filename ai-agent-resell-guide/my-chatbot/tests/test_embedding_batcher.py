@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from conftest import fake_embeddings
+from embedding_batcher import QueryEmbeddingBatcher
+from fake_openai_server import fake_embedding
+
+def embed_concurrently(batcher, texts):
+    vectors = [None] * len(texts)
+    ready = threading.Barrier(len(texts))
+
+    def embed(i):
+        ready.wait()
+        vectors[i] = batcher.embed_query(texts[i])
+
+    threads = [threading.Thread(target=embed, args=(i,)) for i in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return vectors
+
+def test_concurrent_queries_share_one_request(fake_openai):
+    server, base_url = fake_openai()
+    batcher = QueryEmbeddingBatcher(fake_embeddings(base_url), max_wait=0.2)
+    texts = [f"question {i}" for i in range(8)] + ["question 0"]
+    vectors = embed_concurrently(batcher, texts)
+    assert server.embedding_requests == 1
+    assert server.embedded_inputs == 8
+    assert np.allclose(vectors, [fake_embedding(text, server.dim) for text in texts])
+    stats = batcher.batch_stats()
+    assert (stats["queries"], stats["requests"], stats["requests_saved"]) == (9, 1, 8)
+
+def test_batches_are_capped_at_max_batch_size(fake_openai):
+    server, base_url = fake_openai()
+    batcher = QueryEmbeddingBatcher(fake_embeddings(base_url), max_batch_size=4, max_wait=0.2)
+    embed_concurrently(batcher, [f"question {i}" for i in range(8)])
+    assert server.embedding_requests == 2
+    assert batcher.batch_stats()["batch_size"]["max"] == 4
+
+def test_async_queries_share_one_request(fake_openai):
+    server, base_url = fake_openai()
+    batcher = QueryEmbeddingBatcher(fake_embeddings(base_url), max_wait=0.2)
+
+    async def ask():
+        return await asyncio.gather(*(batcher.aembed_query(f"question {i}") for i in range(5)))
+
+    assert len(asyncio.run(ask())) == 5
+    assert server.embedding_requests == 1
+
+def test_errors_reach_every_caller(fake_openai):
+    _, base_url = fake_openai(fail_rate=1.0)
+    batcher = QueryEmbeddingBatcher(fake_embeddings(base_url), max_wait=0.2)
+    errors = []
+
+    def embed(text):
+        try:
+            batcher.embed_query(text)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=embed, args=(f"question {i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+    assert batcher.batch_stats()["errors"] == 1
+    with pytest.raises(Exception):
+        batcher.embed_query("again")
@@ -0,0 +1,67 @@
+import time
+import numpy as np
+import pytest
+from conftest import fake_embeddings
+from embedding_scheduler import EmbeddingScheduler
+from fake_openai_server import fake_embedding
+
+def test_rate_limits_hold_across_calls(fake_openai):
+    server, base_url = fake_openai()
+    scheduler = EmbeddingScheduler(
+        fake_embeddings(base_url), max_batch_size=1, requests_per_minute=2, rate_window=1.0
+    )
+    started = time.monotonic()
+    for text in ("first", "second", "third"):
+        assert len(scheduler.embed_documents([text])) == 1
+    # The third request has to wait for the first to leave the shared window
+    assert time.monotonic() - started >= 0.9
+    assert server.embedding_requests == 3
+
+def test_backs_off_on_429(fake_openai):
+    # With seed 1 the first request is rate limited and the retry goes through
+    server, base_url = fake_openai(fail_rate=0.5, retry_after=1, seed=1)
+    scheduler = EmbeddingScheduler(fake_embeddings(base_url))
+    texts = [f"chunk {i}" for i in range(5)]
+    started = time.monotonic()
+    vectors = scheduler.embed_documents(texts)
+    assert time.monotonic() - started >= 1.0
+    assert scheduler.retries == 1
+    assert server.request_count == 2
+    assert np.allclose(vectors, [fake_embedding(text, server.dim) for text in texts])
+
+def test_gives_up_after_max_retries(fake_openai):
+    _, base_url = fake_openai(fail_rate=1.0, retry_after=0.1)
+    scheduler = EmbeddingScheduler(fake_embeddings(base_url), max_retries=2)
+    with pytest.raises(Exception):
+        scheduler.embed_documents(["chunk"])
+    assert scheduler.retries == 2
+
+def test_counts_tokens_without_tiktoken(fake_openai, monkeypatch):
+    import context_packing
+    monkeypatch.setattr(context_packing, "token_encoding", lambda model_name: None)
+    import embedding_scheduler
+    monkeypatch.setattr(embedding_scheduler, "token_encoding", context_packing.token_encoding)
+    _, base_url = fake_openai()
+    scheduler = EmbeddingScheduler(fake_embeddings(base_url))
+    assert scheduler.count_tokens("x" * 40) == context_packing.estimate_tokens("x" * 40)
+    assert len(scheduler.embed_documents(["a", "b"])) == 2
+
+def test_checkpointed_batches_are_cached_once(fake_openai, tmp_path):
+    from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+    class CountingCache(EmbeddingCache):
+        writes = 0
+
+        def put_many(self, model_name, texts, vectors):
+            self.writes += len(texts)
+            super().put_many(model_name, texts, vectors)
+
+    server, base_url = fake_openai()
+    cache = CountingCache(str(tmp_path / "embedding_cache.sqlite3"))
+    embeddings = CachedEmbeddings(fake_embeddings(base_url), cache)
+    embeddings.embeddings = EmbeddingScheduler(embeddings.embeddings, checkpoint=cache)
+    texts = [f"chunk {i}" for i in range(5)]
+    vectors = embeddings.embed_documents(texts)
+    assert cache.writes == 5
+    assert np.allclose(embeddings.embed_documents(texts), vectors)
+    assert cache.writes == 5 and server.embedding_requests == 1
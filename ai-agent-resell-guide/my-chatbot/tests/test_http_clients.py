@@ -0,0 +1,56 @@
+import asyncio
+import httpx
+import numpy as np
+from http_clients import AsyncLimitedTransport, LimitedTransport, PoolStats
+
+SETTINGS = {
+    "max_connections": 4,
+    "max_per_host": 1,
+    "max_embeddings_per_host": 1,
+    "max_keepalive": 4,
+    "keepalive_seconds": 5.0,
+    "http2": False,
+}
+
+CHAT = {"model": "gpt-4", "stream": True, "messages": [{"role": "user", "content": "Hello there"}]}
+EMBEDDING = {"model": "text-embedding-ada-002", "input": ["question"]}
+
+def test_embeddings_do_not_wait_behind_a_streamed_answer(fake_openai):
+    _, base_url = fake_openai(token_latency=0.01)
+    stats = PoolStats()
+    with httpx.Client(transport=LimitedTransport(SETTINGS, stats)) as client:
+        with client.stream("POST", f"{base_url}/chat/completions", json=CHAT) as answer:
+            # The answer holds the host's only completion slot until its body is closed
+            assert client.post(f"{base_url}/embeddings", json=EMBEDDING).status_code == 200
+            assert stats.host_waits == 0
+            answer.read()
+        assert stats.in_flight == 0
+
+def test_async_embeddings_do_not_wait_behind_a_streamed_answer(fake_openai):
+    _, base_url = fake_openai(token_latency=0.01)
+    stats = PoolStats()
+
+    async def run():
+        async with httpx.AsyncClient(transport=AsyncLimitedTransport(SETTINGS, stats)) as client:
+            async with client.stream("POST", f"{base_url}/chat/completions", json=CHAT) as answer:
+                response = await asyncio.wait_for(client.post(f"{base_url}/embeddings", json=EMBEDDING), 5)
+                assert response.status_code == 200
+                await answer.aread()
+
+    asyncio.run(run())
+    assert stats.host_waits == 0
+    assert stats.in_flight == 0
+
+def test_embeddings_stay_batched_without_tiktoken(fake_openai, monkeypatch):
+    import context_packing
+    from fake_openai_server import fake_embedding
+    from http_clients import openai_embeddings
+    monkeypatch.setattr(context_packing, "token_encoding", lambda model_name: None)
+    server, base_url = fake_openai()
+    embeddings = openai_embeddings(base_url=base_url, max_retries=0)
+    assert not embeddings.check_embedding_ctx_length
+    texts = ["first", "second", "third"]
+    expected = [fake_embedding(text, server.dim) for text in texts]
+    assert np.allclose(embeddings.embed_documents(texts), expected)
+    assert np.allclose(asyncio.run(embeddings.aembed_documents(texts)), expected)
+    assert server.embedding_requests == 2
@@ -0,0 +1,78 @@
+import os
+import threading
+import numpy as np
+from index_snapshots import SnapshotBuild, current_snapshot
+from mmap_store import MMAP_DIRNAME, MmapVectorStore
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, 8)).astype(np.float32)
+
+def publish_first_snapshot(root):
+    build = SnapshotBuild(root)
+    store = MmapVectorStore(build.path)
+    store.add_vectors(["a", "b"], vectors(2), ["old a", "old b"])
+    with open(os.path.join(build.path, "metadata.sqlite3"), "wb") as f:
+        f.write(b"rewritten in place")
+    build.publish()
+    return build.path
+
+def test_mmap_files_are_linked_and_others_copied(tmp_path):
+    root = str(tmp_path)
+    previous = publish_first_snapshot(root)
+    build = SnapshotBuild(root)
+    for name in os.listdir(os.path.join(previous, MMAP_DIRNAME)):
+        assert os.path.samefile(os.path.join(previous, MMAP_DIRNAME, name), os.path.join(build.path, MMAP_DIRNAME, name))
+    assert not os.path.samefile(
+        os.path.join(previous, "metadata.sqlite3"), os.path.join(build.path, "metadata.sqlite3")
+    )
+    build.discard()
+
+def test_updates_leave_the_previous_snapshot_unchanged(tmp_path):
+    root = str(tmp_path)
+    previous = publish_first_snapshot(root)
+    serving = MmapVectorStore(previous)
+
+    build = SnapshotBuild(root)
+    store = MmapVectorStore(build.path)
+    store.add_vectors(["a", "c"], vectors(2, seed=1), ["new a", "new c"])
+    store.delete(["b"])
+    store.compact()
+    build.publish()
+
+    for reader in (serving, MmapVectorStore(previous)):
+        assert reader.get() == {"ids": ["a", "b"], "documents": ["old a", "old b"], "metadatas": [{}, {}]}
+    assert MmapVectorStore(current_snapshot(root)[1]).get()["documents"] == ["new a", "new c"]
+
+def test_a_discarded_build_leaves_no_rows_behind(tmp_path):
+    root = str(tmp_path)
+    publish_first_snapshot(root)
+    build = SnapshotBuild(root)
+    MmapVectorStore(build.path).add_vectors(["x"], vectors(1, seed=2), ["never published"])
+    build.discard()
+
+    build = SnapshotBuild(root)
+    store = MmapVectorStore(build.path)
+    store.add_vectors(["c"], vectors(1, seed=3), ["c"])
+    build.publish()
+    assert MmapVectorStore(current_snapshot(root)[1]).get()["documents"] == ["old a", "old b", "c"]
+
+def test_builds_run_one_at_a_time(tmp_path):
+    root = str(tmp_path)
+    publish_first_snapshot(root)
+    first = SnapshotBuild(root)
+    started = threading.Event()
+    second = []
+
+    def build():
+        started.set()
+        second.append(SnapshotBuild(root))
+
+    thread = threading.Thread(target=build)
+    thread.start()
+    started.wait()
+    thread.join(0.3)
+    assert not second
+    first.publish()
+    thread.join(5)
+    assert second and second[0].previous[0] == first.version
+    second[0].discard()
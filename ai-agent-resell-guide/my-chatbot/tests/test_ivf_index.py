@@ -0,0 +1,27 @@
+import os
+import numpy as np
+from ivf_index import IVF_DIRNAME, IVFIndex, update_ivf
+from mmap_store import MmapVectorStore
+
+def add_rows(store, count, start=0):
+    rng = np.random.default_rng(start)
+    ids = [f"chunk-{i}" for i in range(start, start + count)]
+    store.add_vectors(ids, rng.normal(size=(count, 8)).astype(np.float32), [f"text {i}" for i in ids])
+    return ids
+
+def test_empty_store_gets_no_index(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    assert update_ivf(store) is None
+    assert IVFIndex.load(str(tmp_path)) is None
+
+def test_index_is_removed_once_every_row_is_deleted(tmp_path):
+    store = MmapVectorStore(str(tmp_path), probes=4)
+    ids = add_rows(store, 200)
+    ivf = update_ivf(store)
+    assert ivf.rows == 200
+    store.delete(ids)
+    assert update_ivf(store) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), IVF_DIRNAME))
+    add_rows(store, 10, start=200)
+    assert update_ivf(store).rows == store.header["rows"]
+    assert len(store.search_rows(np.ones(8, dtype=np.float32), k=3)) == 3
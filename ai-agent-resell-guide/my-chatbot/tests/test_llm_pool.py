@@ -0,0 +1,81 @@
+import time
+import asyncio
+import threading
+import pytest
+from langchain_core.messages import HumanMessage
+from llm_pool import ProviderPool, ProviderStats, llm_from_env
+
+@pytest.fixture
+def make_pool(fake_openai, monkeypatch):
+    """A pool of OpenAI and Anthropic, each on its own fake server; returns (pool, openai_server, anthropic_server)"""
+
+    def make(openai_server_args=None, hedge=False):
+        openai_server, openai_url = fake_openai(**(openai_server_args or {}))
+        anthropic_server, anthropic_url = fake_openai()
+        monkeypatch.setenv("OPENAI_BASE_URL", openai_url)
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+        monkeypatch.setenv("ANTHROPIC_API_URL", anthropic_url.rsplit("/v1", 1)[0])
+        monkeypatch.setenv("LLM_PROVIDERS", "openai,anthropic")
+        monkeypatch.setenv("LLM_HEDGE", str(hedge).lower())
+        monkeypatch.setenv("LLM_HEDGE_DELAY_MS", "200")
+        pool = llm_from_env()
+        assert isinstance(pool, ProviderPool)
+        return pool, openai_server, anthropic_server
+
+    return make
+
+def provider_row(pool, name):
+    return next(row for row in pool.provider_stats()["providers"] if row["name"] == name)
+
+def test_fails_over_to_next_provider(make_pool):
+    pool, openai_server, anthropic_server = make_pool({"fail_rate": 1.0})
+    answer = pool.invoke([HumanMessage(content="How do I register a deal?")])
+    assert "register a deal" in answer.content
+    assert openai_server.request_count == 1
+    assert anthropic_server.request_count == 1
+    assert provider_row(pool, "openai")["errors"] == 1
+    assert provider_row(pool, "anthropic")["wins"] == 1
+
+def test_raises_when_every_provider_fails(make_pool):
+    pool, _, anthropic_server = make_pool({"fail_rate": 1.0})
+    anthropic_server.fail_rate = 1.0
+    with pytest.raises(Exception):
+        pool.invoke([HumanMessage(content="Anyone there?")])
+
+def test_hedges_a_slow_provider(make_pool):
+    pool, openai_server, anthropic_server = make_pool({"latency": 2.0}, hedge=True)
+    started = time.monotonic()
+    answer = pool.invoke([HumanMessage(content="What discount applies?")])
+    assert time.monotonic() - started < 1.5
+    assert "discount applies" in answer.content
+    assert pool.hedges == 1
+    assert openai_server.request_count == 1 and anthropic_server.request_count == 1
+    assert provider_row(pool, "anthropic")["wins"] == 1
+
+def test_hedges_a_slow_provider_async(make_pool):
+    pool, _, _ = make_pool({"latency": 2.0}, hedge=True)
+
+    async def ask():
+        started = time.monotonic()
+        chunks = [chunk.content async for chunk in pool.astream([HumanMessage(content="Who signs the order?")])]
+        return time.monotonic() - started, "".join(chunks)
+
+    seconds, answer = asyncio.run(ask())
+    assert seconds < 1.5
+    assert "signs the order" in answer
+    assert pool.hedges == 1
+
+def test_stats_count_every_update_from_many_threads():
+    stats = ProviderStats(max_samples=10)
+
+    def requests():
+        for i in range(2000):
+            stats.started()
+            stats.record(None if i % 4 == 0 else 0.1, won=i % 4 != 0)
+
+    threads = [threading.Thread(target=requests) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.counts() == (16000, 12000, 4000)
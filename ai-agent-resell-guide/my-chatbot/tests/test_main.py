@@ -0,0 +1,32 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from main import ZendeskISVAssistant, print_stream
+from tracing import CONTEXT_DOCUMENTS_EVENT, TraceRecorder
+
+class FailingChain:
+    """Streams one answer token, then fails"""
+
+    memory = None
+
+    def invoke(self, inputs, config):
+        for handler in config["callbacks"]:
+            if isinstance(handler, BaseCallbackHandler):
+                handler.on_custom_event(CONTEXT_DOCUMENTS_EVENT, [], run_id=None)
+                handler.on_llm_new_token("Partial", run_id=None)
+        raise RuntimeError("connection reset")
+
+def assistant_with(chain):
+    # Skips model and index setup; only streaming is exercised
+    assistant = ZendeskISVAssistant.__new__(ZendeskISVAssistant)
+    assistant._qa_chain = chain
+    assistant.trace_recorder = TraceRecorder()
+    return assistant
+
+def test_error_after_first_token_is_printed(capsys):
+    result = print_stream(assistant_with(FailingChain()).stream_response("Which forms?"))
+    assert result["answer"] == "Error generating response: connection reset"
+    assert capsys.readouterr().out == "Partial\nError generating response: connection reset\n"
+
+def test_unstreamed_remainder_is_printed(capsys):
+    events = [("token", "Use the "), ("done", {"answer": "Use the ISV addendum."})]
+    assert print_stream(events)["answer"] == "Use the ISV addendum."
+    assert capsys.readouterr().out == "Use the ISV addendum.\n"
@@ -0,0 +1,60 @@
+import json
+import os
+import numpy as np
+import pytest
+import mmap_store
+from mmap_store import HEADER_FILENAME, MmapVectorStore, mmap_directory
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, 8)).astype(np.float32)
+
+def test_replacing_chunks_keeps_one_live_copy(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    store.add_vectors(["a", "b"], vectors(2), ["old a", "old b"])
+    store.add_vectors(["a"], vectors(1, seed=1), ["new a"])
+    reopened = MmapVectorStore(str(tmp_path))
+    assert len(reopened) == 2
+    assert reopened.get(ids=["a", "b"])["documents"] == ["new a", "old b"]
+
+def test_interrupted_replace_loses_nothing(tmp_path, monkeypatch):
+    store = MmapVectorStore(str(tmp_path))
+    store.add_vectors(["a", "b"], vectors(2), ["old a", "old b"])
+
+    write_json = mmap_store._write_json
+
+    def crash(path, data):
+        if path.endswith(HEADER_FILENAME):
+            raise OSError("disk full")
+        write_json(path, data)
+
+    # Dies at the header write, after the new rows were appended
+    monkeypatch.setattr(mmap_store, "_write_json", crash)
+    with pytest.raises(OSError):
+        store.add_vectors(["a"], vectors(1, seed=1), ["new a"])
+    monkeypatch.undo()
+
+    reopened = MmapVectorStore(str(tmp_path))
+    assert len(reopened) == 2
+    assert reopened.get(ids=["a", "b"])["documents"] == ["old a", "old b"]
+
+def test_deletes_are_committed_in_the_header(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    store.add_vectors(["a", "b", "c"], vectors(3), ["a", "b", "c"])
+    assert store.delete(["b", "missing"])
+    assert not store.delete(["missing"])
+    with open(os.path.join(mmap_directory(str(tmp_path)), HEADER_FILENAME), encoding="utf-8") as f:
+        assert json.load(f)["deleted"] == [1]
+    reopened = MmapVectorStore(str(tmp_path))
+    assert reopened.get()["ids"] == ["a", "c"]
+    reopened.compact()
+    assert reopened.header["deleted"] == [] and reopened.get()["ids"] == ["a", "c"]
+
+def test_reads_tombstones_from_older_side_file(tmp_path):
+    store = MmapVectorStore(str(tmp_path))
+    store.add_vectors(["a", "b"], vectors(2), ["a", "b"])
+    with open(os.path.join(mmap_directory(str(tmp_path)), "deleted.0"), "w", encoding="utf-8") as f:
+        json.dump([0], f)
+    reopened = MmapVectorStore(str(tmp_path))
+    assert reopened.get()["ids"] == ["b"]
+    reopened.delete(["b"])
+    assert len(MmapVectorStore(str(tmp_path))) == 0
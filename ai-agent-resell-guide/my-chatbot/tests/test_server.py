@@ -0,0 +1,157 @@
+import json
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_core.documents import Document
+from metadata_index import check_filters
+from server import create_app
+from streaming import StreamingHandler
+from tracing import CONTEXT_DOCUMENTS_EVENT, TraceRecorder
+
+@pytest.mark.parametrize("filters", [
+    {"doc_type": "form"},
+    {"partner": ["Zuper", "Salto"], "modified_after": 1700000000},
+    {"section": 3, "modified_after": 1.5},
+])
+def test_accepts_valid_filters(filters):
+    check_filters(filters)
+
+@pytest.mark.parametrize("filters, message", [
+    (["doc_type"], "must be an object"),
+    ({"color": "red"}, "Unknown filter"),
+    ({"doc_type": {"x": 1}}, '"doc_type" must be'),
+    ({"partner": []}, '"partner" must be'),
+    ({"partner": ["Zuper", ["nested"]]}, '"partner" must be'),
+    ({"title": None}, '"title" must be'),
+    ({"doc_type": True}, '"doc_type" must be'),
+    ({"modified_after": "yesterday"}, '"modified_after" must be a number'),
+    ({"modified_after": [1, 2]}, '"modified_after" must be a number'),
+])
+def test_rejects_invalid_filters(filters, message):
+    with pytest.raises(ValueError, match=message):
+        check_filters(filters)
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+@pytest.mark.parametrize("body", [
+    {"question": "Which forms?", "filters": {"doc_type": {"x": 1}}},
+    {"question": "Which forms?", "filters": {"modified_after": "2024-01-01"}},
+    ["Which forms?"],
+])
+def test_bad_filters_are_a_400(path, body):
+    async def post():
+        # Invalid requests are rejected before the assistant is used
+        async with TestClient(TestServer(create_app(assistant=None))) as client:
+            response = await client.post(path, json=body)
+            return response.status, await response.text()
+
+    status, text = asyncio.run(post())
+    assert status == 400, text
+
+class StubChain:
+    """Async chain answering "answer to <question>" a word at a time after `delay` seconds"""
+
+    memory = None
+
+    def __init__(self, delay=0.0, error=None, started=None, release=None):
+        self.delay = delay
+        self.error = error
+        self.started = started
+        self.release = release
+        self.questions = []
+
+    async def ainvoke(self, inputs, config):
+        self.questions.append(inputs["question"])
+        if self.started is not None:
+            self.started.set()
+        if self.release is not None:
+            await self.release.wait()
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        docs = [Document(page_content="ISV addendum", metadata={"source": "guide.pdf"})]
+        words = ["answer ", "to ", inputs["question"]]
+        for handler in config["callbacks"]:
+            if isinstance(handler, StreamingHandler):
+                handler.on_custom_event(CONTEXT_DOCUMENTS_EVENT, docs, run_id=None)
+                handler.on_chat_model_start({}, [])
+                for word in words:
+                    handler.on_llm_new_token(word)
+                handler.on_llm_end(None)
+        return {"answer": "".join(words), "source_documents": docs}
+
+class StubAssistant:
+    """Just what AssistantServer uses of ZendeskISVAssistant, with a new StubChain per session"""
+
+    def __init__(self, **chain_kwargs):
+        self.chain_kwargs = chain_kwargs
+        self.retriever = object()
+        self.trace_recorder = TraceRecorder()
+        self.chains = []
+
+    def new_chain(self):
+        self.chains.append(StubChain(**self.chain_kwargs))
+        return self.chains[-1]
+
+def serve(assistant, requests, **settings):
+    """Run `requests(client)` against a test server for `assistant`"""
+    async def run():
+        async with TestClient(TestServer(create_app(assistant, **settings))) as client:
+            return await requests(client)
+
+    return asyncio.run(run())
+
+async def post_chat(client, **body):
+    response = await client.post("/chat", json=body)
+    return response.status, await response.json()
+
+def test_chain_errors_are_a_json_502():
+    status, body = serve(StubAssistant(error=RuntimeError("provider down")),
+                         lambda client: post_chat(client, question="Which forms?", session_id="s1"))
+    assert status == 502
+    assert body == {"error": "provider down", "session_id": "s1"}
+
+def test_requests_beyond_the_queue_are_a_503():
+    started, release = asyncio.Event(), asyncio.Event()
+    assistant = StubAssistant(started=started, release=release)
+
+    async def requests(client):
+        first = asyncio.create_task(post_chat(client, question="first"))
+        await started.wait()
+        status, _ = await post_chat(client, question="second")
+        release.set()
+        return status, (await first)[0]
+
+    assert serve(assistant, requests, max_concurrency=1, max_queue=0) == (503, 200)
+
+def test_slow_answers_are_a_504():
+    status, body = serve(StubAssistant(delay=1.0), lambda client: post_chat(client, question="Which forms?"),
+                         request_timeout=0.1)
+    assert status == 504
+    assert body["error"] == "Request timed out"
+
+def test_stream_sends_sources_then_tokens_then_done():
+    async def requests(client):
+        response = await client.post("/chat/stream", json={"question": "pricing", "session_id": "s1"})
+        return [
+            (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+            for block in (await response.text()).strip().split("\n\n")
+        ]
+
+    events = serve(StubAssistant(), requests)
+    assert [kind for kind, _ in events] == ["sources", "token", "token", "token", "done"]
+    assert events[0][1][0]["source"] == "guide.pdf"
+    assert "".join(data["text"] for kind, data in events if kind == "token") == "answer to pricing"
+    assert events[-1][1]["answer"] == "answer to pricing" and events[-1][1]["session_id"] == "s1"
+
+def test_sessions_are_reused_until_they_expire():
+    assistant = StubAssistant()
+
+    async def requests(client):
+        await post_chat(client, question="first", session_id="s1")
+        await post_chat(client, question="second", session_id="s1")
+        await post_chat(client, question="other", session_id="s2")
+        await asyncio.sleep(0.3)
+        await post_chat(client, question="third", session_id="s1")
+
+    serve(assistant, requests, session_ttl=0.2)
+    assert [chain.questions for chain in assistant.chains] == [["first", "second"], ["other"], ["third"]]
@@ -0,0 +1,217 @@
+"""
+Request tracing for Zendesk ISV Resell Assistant
+Lightweight, in-process tracing built on callback handlers: each question
+records how long every stage took (condensing, answer cache, query embedding,
+vector and keyword search, generation), the tokens each model call used and
+which caches hit. Recent traces feed rolling p50/p95/p99 latencies and can be
+exported as JSONL. Independent of LangChain tracing, which the apps disable
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Custom callback event carrying {"stages": {name: seconds or None}, ...}
+STAGE_TIMINGS_EVENT = "stage_timings"
+
+# Custom callback event carrying the documents that go into the answer prompt
+CONTEXT_DOCUMENTS_EVENT = "context_documents"
+
+# Run metadata key (config={"metadata": {...}}) carrying retrieval filters for one question
+RETRIEVAL_FILTERS_KEY = "retrieval_filters"
+
+# Stages in pipeline order, for reports
+STAGE_ORDER = (
+    "condense", "answer_cache", "metadata_filter", "embed_query", "vector_search", "keyword_search",
+    "retrieve", "generate", "time_to_sources", "time_to_first_token", "total_time",
+)
+
+def _usage(response):
+    """(prompt, completion) token counts reported by the provider, if any"""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens"), metadata.get("output_tokens")
+    return None, None
+
+class RequestTracer(BaseCallbackHandler):
+    """Collects stage timings, token counts and cache hits for one question
+
+    Model calls before retrieval belong to question condensing, the first one
+    after it to the answer and any later one to the memory summarizer.
+    """
+
+    # Called on the event loop in async runs instead of a worker thread
+    run_inline = True
+
+    def __init__(self, question):
+        self.trace = {
+            "timestamp": time.time(),
+            "question": question,
+            "stages": {},
+            "tokens": {},
+            "cache_hits": {},
+        }
+        self._retrieved = False
+        self._answered = False
+        self._llm_runs = {}
+
+    def on_retriever_end(self, documents, **kwargs):
+        self._retrieved = True
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == STAGE_TIMINGS_EVENT:
+            self.trace["stages"].update(data.get("stages", {}))
+            self.trace["cache_hits"].update(data.get("cache_hits", {}))
+            if data.get("filters"):
+                self.trace["filters"] = data["filters"]
+            if data.get("cache_hits", {}).get("answer_cache"):
+                self._retrieved = True
+
+    def _start_llm(self, run_id):
+        if not self._retrieved:
+            stage = "condense"
+        elif not self._answered:
+            stage = "generate"
+        else:
+            stage = "summarize"
+        self._llm_runs[run_id] = {"stage": stage, "streamed": 0}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start_llm(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start_llm(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self._llm_runs:
+            self._llm_runs[run_id]["streamed"] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        if run["stage"] == "generate":
+            self._answered = True
+        prompt, completion = _usage(response)
+        self.trace["tokens"][run["stage"]] = {
+            "prompt": prompt,
+            # Streamed chunks approximate tokens when the provider sends no usage
+            "completion": completion if completion is not None else run["streamed"] or None,
+        }
+
+    def finish(self, timings=None, **extra):
+        """Close the trace with end-to-end timings and return it"""
+        self.trace["stages"].update(timings or {})
+        self.trace.update(extra)
+        return self.trace
+
+class TraceRecorder:
+    """Thread-safe rolling window of request traces shared by a process"""
+
+    def __init__(self, window=500, log_path=None):
+        self.log_path = log_path
+        self._traces = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """Add a finished trace, appending it to the JSONL log when configured"""
+        with self._lock:
+            self._traces.append(trace)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace) + "\n")
+
+    def traces(self):
+        with self._lock:
+            return list(self._traces)
+
+    def summary(self):
+        """Per-stage count and p50/p95/p99 seconds plus cache hit rates over the window"""
+        traces = self.traces()
+        stages = {}
+        for stage in STAGE_ORDER:
+            values = [t["stages"][stage] for t in traces if t["stages"].get(stage) is not None]
+            if values:
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                stages[stage] = {"count": len(values), "p50": p50, "p95": p95, "p99": p99}
+        cache_hits = {}
+        for t in traces:
+            for cache, hit in t["cache_hits"].items():
+                hits, lookups = cache_hits.get(cache, (0, 0))
+                cache_hits[cache] = (hits + bool(hit), lookups + 1)
+        return {
+            "requests": len(traces),
+            "stages": stages,
+            "cache_hit_rates": {cache: hits / lookups for cache, (hits, lookups) in cache_hits.items()},
+        }
+
+    def to_jsonl(self):
+        """The traces in the window as JSON lines"""
+        return "".join(json.dumps(trace) + "\n" for trace in self.traces())
+
+    def export_jsonl(self, path):
+        """Write the traces in the window to a JSONL file and return how many were written"""
+        traces = self.traces()
+        with open(path, "w", encoding="utf-8") as f:
+            for trace in traces:
+                f.write(json.dumps(trace) + "\n")
+        return len(traces)
+
+def trace_recorder_from_env():
+    """TraceRecorder configured by TRACE_WINDOW and TRACE_LOG_PATH"""
+    return TraceRecorder(
+        window=int(os.getenv("TRACE_WINDOW", 500)),
+        log_path=os.getenv("TRACE_LOG_PATH") or None,
+    )
+
+def chain_config(callbacks, filters=None):
+    """Run config for one question; `filters` scope its retrieval (see HybridRetriever)"""
+    config = {"callbacks": callbacks}
+    if filters:
+        config["metadata"] = {RETRIEVAL_FILTERS_KEY: filters}
+    return config
+
+def invoke_traced(qa_chain, question, recorder=None, filters=None):
+    """Run the chain once without streaming, recording a trace; returns (result, trace)"""
+    tracer = RequestTracer(question)
+    start = time.perf_counter()
+    result = qa_chain.invoke({"question": question}, config=chain_config([tracer], filters))
+    trace = tracer.finish({"total_time": time.perf_counter() - start})
+    if recorder is not None:
+        recorder.record(trace)
+    return result, trace
+
+async def ainvoke_traced(qa_chain, question, recorder=None, filters=None):
+    """Async counterpart of invoke_traced"""
+    tracer = RequestTracer(question)
+    start = time.perf_counter()
+    result = await qa_chain.ainvoke({"question": question}, config=chain_config([tracer], filters))
+    trace = tracer.finish({"total_time": time.perf_counter() - start})
+    if recorder is not None:
+        recorder.record(trace)
+    return result, trace
+
+def format_stats(summary):
+    """Plain-text latency table for the CLI"""
+    if not summary["requests"]:
+        return "No requests traced yet."
+    lines = [
+        f"Requests traced: {summary['requests']}",
+        f"{'stage':<22}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}",
+    ]
+    for stage, row in summary["stages"].items():
+        lines.append(
+            f"{stage:<22}{row['count']:>7}{row['p50']:>9.3f}s{row['p95']:>9.3f}s{row['p99']:>9.3f}s"
+        )
+    for cache, rate in summary["cache_hit_rates"].items():
+        lines.append(f"{cache} hit rate: {rate:.0%}")
+    return "\n".join(lines)